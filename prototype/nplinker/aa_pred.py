@@ -1,8 +1,6 @@
 import argparse
 import os
 
-from Bio import SeqIO
-
 from .aalist import AA_LIST as AA_CODES
 
 
@@ -19,6 +17,7 @@ class AntiSmashFile(object):
         self.raw_data = []
         self.filename = filename
 
+        from Bio import SeqIO
         with open(filename, 'r') as f:
             # antiSMASH 5 vs. 4 output is vastly different
             for record in SeqIO.parse(f, 'gb'):
@@ -0,0 +1,156 @@
+import json
+import os
+
+import numpy as np
+
+from .pickler import load_pickled_data, save_pickled_data
+from .scoring.data_linking_functions import PackedStrainMatrix, OccurrenceCSR
+
+from .logconfig import LogConfig
+
+logger = LogConfig.getLogger(__file__)
+
+# A directory-based store for objects that mostly consist of large numpy arrays
+# (e.g. the DataLinks and LinkFinder objects used by MetcalfScoring).
+#
+# Each array attribute of each object is saved as a separate .npy file. When
+# the store is loaded these are opened with np.load(mmap_mode='r'), so loading
+# is almost instant, the data is only read from disk when it's actually used,
+# and multiple processes using the same store share the OS page cache instead
+# of each holding a private copy of the arrays.
+#
+# Attributes which aren't arrays (dataframes, lists, dicts, ...) are usually
+# small and are pickled together in a single file per object. A JSON manifest
+# describes the contents of the store. It is written last and removed before
+# anything else is modified, so a store without a manifest is treated as
+# missing/incomplete.
+#
+# Arrays loaded from a store are read-only.
+
+MANIFEST = 'manifest.json'
+STORE_VERSION = 3
+
+def _is_plain_array(value):
+    return isinstance(value, np.ndarray) and value.dtype.kind in 'biufc'
+
+def _save_array(path, name, array):
+    filename = name + '.npy'
+    np.save(os.path.join(path, filename), np.ascontiguousarray(array))
+    return filename
+
+def _load_array(path, filename):
+    return np.load(os.path.join(path, filename), mmap_mode='r')
+
+def _save_object(path, name, obj):
+    # returns the manifest entry for obj, with non-array attributes stored in a pickle file
+    arrays = {}
+    others = {}
+    for attr, value in vars(obj).items():
+        prefix = '{}.{}'.format(name, attr)
+        if _is_plain_array(value):
+            arrays[attr] = {'type': 'array', 'file': _save_array(path, prefix, value)}
+        elif isinstance(value, PackedStrainMatrix):
+            arrays[attr] = {'type': 'packed',
+                            'num_strains': int(value.num_strains),
+                            'words': _save_array(path, prefix + '.words', value.words)}
+        elif isinstance(value, OccurrenceCSR):
+            arrays[attr] = {'type': 'csr',
+                            'num_strains': int(value.num_strains),
+                            'indptr': _save_array(path, prefix + '.indptr', value.indptr),
+                            'indices': _save_array(path, prefix + '.indices', value.indices)}
+        else:
+            others[attr] = value
+
+    others_file = name + '.pckl'
+    save_pickled_data(others, os.path.join(path, others_file))
+    return {'arrays': arrays, 'others': others_file}
+
+def _load_object(nplinker, path, cls, entry):
+    others = load_pickled_data(nplinker, os.path.join(path, entry['others']), delete_on_error=False)
+    if others is None:
+        raise Exception('Failed to load "{}"'.format(entry['others']))
+
+    obj = cls.__new__(cls)
+    obj.__dict__.update(others)
+    for attr, info in entry['arrays'].items():
+        if info['type'] == 'array':
+            value = _load_array(path, info['file'])
+        elif info['type'] == 'packed':
+            value = PackedStrainMatrix(_load_array(path, info['words']), info['num_strains'])
+        elif info['type'] == 'csr':
+            value = OccurrenceCSR(_load_array(path, info['indptr']), _load_array(path, info['indices']), info['num_strains'])
+        else:
+            raise Exception('Unknown array type "{}" in store'.format(info['type']))
+        setattr(obj, attr, value)
+    return obj
+
+def save_store(path, metadata, objects):
+    """
+    Save a set of objects to the store at <path>.
+
+    metadata is any JSON-serialisable value (e.g. information used to check
+    if the store is still valid), objects is a dict of {name: object}
+    """
+    os.makedirs(path, exist_ok=True)
+    manifest_path = os.path.join(path, MANIFEST)
+    if os.path.exists(manifest_path):
+        os.unlink(manifest_path)
+
+    # remove files from any previous version of the store
+    for filename in os.listdir(path):
+        if filename.endswith('.npy') or filename.endswith('.pckl'):
+            os.unlink(os.path.join(path, filename))
+
+    manifest = {'version': STORE_VERSION, 'metadata': metadata, 'objects': {}}
+    for name, obj in objects.items():
+        manifest['objects'][name] = _save_object(path, name, obj)
+
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+def load_store_metadata(path):
+    """
+    Return the metadata from the store at <path>, or None if there is no valid store
+    """
+    manifest = _load_manifest(path)
+    if manifest is None:
+        return None
+    return manifest['metadata']
+
+def load_store(nplinker, path, classes):
+    """
+    Load the objects from the store at <path>. classes is a dict of {name: class}
+    giving the type of each object to load.
+
+    Returns a tuple (metadata, {name: object}), or (None, None) if there is no
+    valid store at <path>
+    """
+    manifest = _load_manifest(path)
+    if manifest is None:
+        return None, None
+
+    try:
+        objects = {name: _load_object(nplinker, path, cls, manifest['objects'][name]) for name, cls in classes.items()}
+    except Exception as e:
+        logger.warning('Failed to load store "{}" (exception={})'.format(path, str(e)))
+        return None, None
+
+    return manifest['metadata'], objects
+
+def _load_manifest(path):
+    manifest_path = os.path.join(path, MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None
+
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except ValueError as e:
+        logger.warning('Failed to parse store manifest "{}" (exception={})'.format(manifest_path, str(e)))
+        return None
+
+    if manifest.get('version', None) != STORE_VERSION:
+        logger.info('Ignoring store "{}" with version {}'.format(path, manifest.get('version', None)))
+        return None
+
+    return manifest
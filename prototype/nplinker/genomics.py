@@ -4,19 +4,25 @@ import os
 import json
 import re
 
-from Bio import SeqIO
-
 from .aa_pred import predict_aa
 from .genomics_utilities import get_smiles
 
-from .strains import Strain, StrainCollection
+from .strains import Strain, StrainSet
 
 from .logconfig import LogConfig
 logger = LogConfig.getLogger(__file__)
 
 CLUSTER_REGION_REGEX = re.compile('(.+?)\\.(cluster|region)(\\d+).gbk$')
 
+# shared by all BGCs without any edges (see BGC.add_edge)
+_NO_EDGES = frozenset()
+
 class BGC(object):
+
+    __slots__ = ('id', 'strain', 'name', 'bigscape_class', 'product_prediction', 'parent', 'description',
+                 '_antismash_header', 'region', 'cluster', 'antismash_file', 
+                 '_aa_predictions', '_known_cluster_blast', '_smiles', '_smiles_parsed', '_edges', '_deferred_edges')
+
     def __init__(self, id, strain, name, bigscape_class, product_prediction, description=None):
         self.id = id
         self.strain = strain
@@ -25,9 +31,9 @@ class BGC(object):
         self.product_prediction = product_prediction
         self.parent = None
         self.description = description
-        # these will get parsed from the .gbk file
-        self.antismash_id = None
-        self.antismash_accession = None
+        # (antismash_id, antismash_accession), these will get parsed from the .gbk file. 
+        # None if that hasn't happened yet (see parse_gbk_header)
+        self._antismash_header = (None, None)
 
         self.region = -1
         self.cluster = -1
@@ -38,7 +44,50 @@ class BGC(object):
         self._smiles = None
         self._smiles_parsed = False
 
-        self.edges = set()
+        # (shared by all BGCs with no edges, see the edges property)
+        self._edges = _NO_EDGES
+        # if the BiG-SCAPE network files haven't been loaded yet, the (shared) object 
+        # which will load them when they're first needed (see DatasetLoader)
+        self._deferred_edges = None
+
+    @property
+    def edges(self):
+        if self._deferred_edges is not None:
+            self._deferred_edges.load()
+        if self._edges is _NO_EDGES:
+            self._edges = set()
+        return self._edges
+
+    @edges.setter
+    def edges(self, edges):
+        if self._deferred_edges is not None:
+            self._deferred_edges.load()
+        self._edges = edges
+
+    def add_edge(self, bgc_id):
+        if self._edges is _NO_EDGES:
+            self._edges = set()
+        self._edges.add(bgc_id)
+
+    @property
+    def antismash_id(self):
+        if self._antismash_header is None:
+            parse_gbk_header(self)
+        return self._antismash_header[0]
+
+    @antismash_id.setter
+    def antismash_id(self, antismash_id):
+        self._antismash_header = (antismash_id, self.antismash_accession)
+
+    @property
+    def antismash_accession(self):
+        if self._antismash_header is None:
+            parse_gbk_header(self)
+        return self._antismash_header[1]
+
+    @antismash_accession.setter
+    def antismash_accession(self, antismash_accession):
+        self._antismash_header = (self.antismash_id, antismash_accession)
 
     def set_filename(self, filename):
         self.antismash_file = filename
@@ -96,6 +145,8 @@ class BGC(object):
 
 class MiBIGBGC(BGC):
 
+    __slots__ = ()
+
     def __init__(self, id, strain, name, product_prediction):
         super(MiBIGBGC, self).__init__(id, strain, name, None, product_prediction)
 
@@ -107,6 +158,9 @@ class MiBIGBGC(BGC):
 
 
 class GCF(object):
+
+    __slots__ = ('id', 'gcf_id', 'product_type', 'bgcs', 'classes', '_aa_predictions', 'strains', 'strains_lookup')
+
     def __init__(self, id, gcf_id, product_type):
         self.id = id
         self.gcf_id = gcf_id
@@ -115,7 +169,7 @@ class GCF(object):
         self.classes = set()
 
         self._aa_predictions = None
-        self.strains = StrainCollection()
+        self.strains = StrainSet()
         self.strains_lookup = {}
 
     def __str__(self):
@@ -180,13 +234,44 @@ class GCF(object):
 
         return self._aa_predictions
 
-def parse_gbk_header(bgc):
-    records = list(SeqIO.parse(bgc.antismash_file, format='gb'))
-    if len(records) > 0:
-        bgc.antismash_accession = records[0].name
-        bgc.antismash_id = records[0].id
+def parse_gbk_header(bgc, lazy=False):
+    # with lazy=True the header is only parsed when the BGC's antismash_id or
+    # antismash_accession is first used
+    if lazy:
+        bgc._antismash_header = None
+        return
+
+    from Bio import SeqIO
+    bgc._antismash_header = (None, None)
+    # (only the first record is needed)
+    record = next(SeqIO.parse(bgc.antismash_file, format='gb'), None)
+    if record is not None:
+        bgc._antismash_header = (record.id, record.name)
+
+def load_network_edges(network_file_dict, bgc_list):
+    bgc_lookup = {bgc.name: bgc for bgc in bgc_list}
+
+    logger.debug('Loading .network files')
+    for filename in network_file_dict.values():
+        with open(filename, 'r') as f:
+            reader = csv.reader(f, delimiter='\t')
+            next(reader) # skip headers
+            # try to look up bgc IDs
+            for line in reader:
+                for i in range(2):
+                    if line[i].startswith('BGC'):
+                        # removing the .<digit> suffix
+                        line[i] = line[i][:line[i].index('.')]
+
+                if line[0] not in bgc_lookup or line[1] not in bgc_lookup:
+                    # should indicate that one or both of these BGCs have been filtered out above
+                    continue
+
+                bgc_src = bgc_lookup[line[0]]
+                bgc_dst = bgc_lookup[line[1]]
+                bgc_src.add_edge(bgc_dst.id)
 
-def loadBGC_from_cluster_files(strains, cluster_file_dict, ann_file_dict, network_file_dict, mibig_bgc_dict, antismash_dir, antismash_filenames, antismash_format, antismash_delimiters):
+def loadBGC_from_cluster_files(strains, cluster_file_dict, ann_file_dict, network_file_dict, mibig_bgc_dict, antismash_dir, antismash_filenames, antismash_format, antismash_delimiters, parse_headers=True, load_edges=True):
     gcf_dict = {}
     gcf_list = []
     metadata = {}
@@ -287,7 +372,7 @@ def loadBGC_from_cluster_files(strains, cluster_file_dict, ann_file_dict, networ
                                 num_missing_antismash += 1
                                 # return None, None, None
                             new_bgc.set_filename(antismash_filename)
-                            parse_gbk_header(new_bgc)
+                            parse_gbk_header(new_bgc, lazy=not parse_headers)
                         else:
                             new_bgc.set_filename(antismash_filenames.get(new_bgc.name, None))
                             if new_bgc.antismash_file is None:
@@ -304,7 +389,7 @@ def loadBGC_from_cluster_files(strains, cluster_file_dict, ann_file_dict, networ
                                 logger.warning('Failed to find an antiSMASH file for {} {}'.format(new_bgc.name, new_bgc))
                                 num_missing_antismash += 1
                             else:
-                                parse_gbk_header(new_bgc)
+                                parse_gbk_header(new_bgc, lazy=not parse_headers)
 
 
                 else:
@@ -338,32 +423,13 @@ def loadBGC_from_cluster_files(strains, cluster_file_dict, ann_file_dict, networ
 
     # filter out irrelevant MiBIG BGCs (and MiBIG-only GCFs)
     bgc_list, gcf_list, strains = filter_mibig_bgcs(bgc_list, gcf_list, strains)
-    # update lookup table as well
-    bgc_lookup = {bgc.name: bgc for bgc in bgc_list}
 
     logger.info('# after filtering, total bgcs = {}, GCFs = {}, strains={}, unknown_strains={}'.format(len(bgc_list), len(gcf_list), len(strains), len(unknown_strains)))
 
     # load edge info - note that this should be done AFTER the filtering step above
     # so that it won't leave us with edges for BGCs that are no longer present
-    logger.debug('Loading .network files')
-    for filename in network_file_dict.values():
-        with open(filename, 'r') as f:
-            reader = csv.reader(f, delimiter='\t')
-            next(reader) # skip headers
-            # try to look up bgc IDs
-            for line in reader:
-                for i in range(2):
-                    if line[i].startswith('BGC'):
-                        # removing the .<digit> suffix
-                        line[i] = line[i][:line[i].index('.')]
-
-                if line[0] not in bgc_lookup or line[1] not in bgc_lookup:
-                    # should indicate that one or both of these BGCs have been filtered out above
-                    continue
-
-                bgc_src = bgc_lookup[line[0]]
-                bgc_dst = bgc_lookup[line[1]]
-                bgc_src.edges.add(bgc_dst.id)
+    if load_edges:
+        load_network_edges(network_file_dict, bgc_list)
 
     return gcf_list, bgc_list, strains, unknown_strains
 
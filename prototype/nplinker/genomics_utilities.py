@@ -1,7 +1,5 @@
 import os
 
-from Bio import SeqIO
-
 from .logconfig import LogConfig
 logger = LogConfig.getLogger(__file__)
 
@@ -13,6 +11,7 @@ def get_smiles(bgc):
         logger.warn('Missing antismash_file: {}'.format(bgc.antismash_file))
         return None
 
+    from Bio import SeqIO
     with open(bgc.antismash_file, 'r') as f:
         for rec in SeqIO.parse(f, 'gb'):
             # rec is a Bio.SeqRecord object, search its .features list 
@@ -7,13 +7,13 @@ from .metabolomics import load_dataset
 
 from .genomics import loadBGC_from_cluster_files
 from .genomics import make_mibig_bgc_dict
+from .genomics import load_network_edges
 
 from .annotations import load_annotations
 
-from .strains import StrainCollection
+from .strains import StrainCollection, new_strain_table
+from .snapshot import input_fingerprint, load_snapshot, save_snapshot
 
-from .pairedomics.downloader import Downloader
-from .pairedomics.downloader import download_and_extract_mibig_json, generate_strain_mappings
 from .pairedomics.runbigscape import run_bigscape
 
 from .logconfig import LogConfig
@@ -70,6 +70,80 @@ def find_bigscape_dir(broot):
 
     return None
 
+class LoadPlan(object):
+    """
+    The optional parts of a dataset which DatasetLoader.load should load up front. 
+    Anything not included in the plan is loaded the first time it's used instead:
+
+        - peaks: the MS2 peaks of each Spectrum (only the metadata of each spectrum
+          is parsed from the MGF file during loading, the peaks are read later)
+        - annotations: the spectral annotation files (Spectrum.annotations/gnps_id)
+        - antismash: the header of each BGC's antiSMASH .gbk file 
+          (BGC.antismash_id/antismash_accession)
+        - edges: the BiG-SCAPE .network files (BGC.edges)
+
+    A plan can be created from a list of these names, or from the name of one of
+    the predefined plans in PLANS (e.g. "metcalf" for workflows which only use
+    Metcalf scoring, as that doesn't need any of them)
+    """
+
+    PEAKS           = 'peaks'
+    ANNOTATIONS     = 'annotations'
+    ANTISMASH       = 'antismash'
+    EDGES           = 'edges'
+    COMPONENTS      = [PEAKS, ANNOTATIONS, ANTISMASH, EDGES]
+
+    PLANS           = {'full': COMPONENTS, 'metcalf': []}
+    DEFAULT         = 'full'
+
+    def __init__(self, plan=DEFAULT):
+        if isinstance(plan, str):
+            if plan not in self.PLANS:
+                raise Exception('Unknown load plan "{}" (available plans: {})'.format(plan, ', '.join(self.PLANS.keys())))
+            plan = self.PLANS[plan]
+
+        for component in plan:
+            if component not in self.COMPONENTS:
+                raise Exception('Unknown dataset component "{}" in load plan (available components: {})'.format(component, ', '.join(self.COMPONENTS)))
+
+        self.components = [component for component in self.COMPONENTS if component in plan]
+
+    def includes(self, component):
+        return component in self.components
+
+    def __repr__(self):
+        return 'LoadPlan({})'.format(self.components)
+
+class DeferredLoad(object):
+    """
+    A part of a dataset that wasn't included in the LoadPlan. Each of the objects
+    it applies to keeps a reference to it in the attribute <attr>, and the first 
+    time any of them needs the data, load() is called to load it for all of them
+    """
+
+    def __init__(self, component, objects, attr, func):
+        self.component = component
+        self.objects = objects
+        self._attr = attr
+        self._func = func
+        for obj in objects:
+            setattr(obj, attr, self)
+
+    @property
+    def loaded(self):
+        return self._func is None
+
+    def load(self):
+        if self._func is None:
+            return
+
+        t = time.time()
+        func, self._func = self._func, None
+        for obj in self.objects:
+            setattr(obj, self._attr, None)
+        func()
+        logger.info('Loaded deferred dataset component "{}" in {:.3f}s'.format(self.component, time.time() - t))
+
 class DatasetLoader(object):
 
     ANTISMASH_FMT_DEFAULT           = 'default'
@@ -82,6 +156,10 @@ class DatasetLoader(object):
 
     BIGSCAPE_CUTOFF_DEFAULT         = 30
 
+    SNAPSHOT_DEFAULT                = True
+
+    MGF_PROCESSES_DEFAULT           = 1
+
     RUN_BIGSCAPE_DEFAULT            = True
     EXTRA_BIGSCAPE_PARAMS_DEFAULT   = ""
 
@@ -117,12 +195,20 @@ class DatasetLoader(object):
         self._antismash_format = self._antismash.get('antismash_format', self.ANTISMASH_FMT_DEFAULT)
         self._antismash_ignore_spaces = self._antismash.get('ignore_spaces', self.ANTISMASH_IGNORE_SPACES_DEFAULT)
         self._bigscape_cutoff = self._dataset.get('bigscape_cutoff', self.BIGSCAPE_CUTOFF_DEFAULT)
+        self._use_snapshot = self._dataset.get('snapshot', self.SNAPSHOT_DEFAULT)
+        self._mgf_processes = self._dataset.get('mgf_processes', self.MGF_PROCESSES_DEFAULT)
+        self._load_plan = LoadPlan(self._dataset.get('load_plan', LoadPlan.DEFAULT))
+        # {component: DeferredLoad} for the parts of the dataset which aren't loaded yet
+        self._deferred = {}
+        self._network_files = {}
         self._root = self._config['dataset']['root']
         self._platform_id = self._config['dataset']['platform_id']
         self._remote_loading = len(self._platform_id) > 0
         self.datadir = os.path.join(os.path.dirname(__file__), 'data')
         self.dataset_id = os.path.split(self._root)[-1] if not self._remote_loading else self._platform_id
         if self._remote_loading:
+            # (the downloader needs httpx etc, so it's only imported for platform datasets)
+            from .pairedomics.downloader import Downloader
             self._downloader = Downloader(self._platform_id)
         else:
             self._downloader = None
@@ -215,7 +301,61 @@ class DatasetLoader(object):
             if not os.path.exists(f):
                 logger.warning('Optional file/directory "{}" does not exist or is not readable!'.format(f))
 
-    def load(self, met_only):
+    @property
+    def load_plan(self):
+        return self._load_plan
+
+    def load(self, met_only, load_plan=None):
+        if load_plan is not None:
+            self._load_plan = load_plan if isinstance(load_plan, LoadPlan) else LoadPlan(load_plan)
+        self._deferred = {}
+        # the StrainSets of the objects from this load share a new strain table,
+        # the table of any previously loaded data is freed with the old objects
+        new_strain_table()
+
+        # if there's an up to date snapshot of the loaded dataset, use that instead
+        # of parsing all the input files again
+        if self._use_snapshot:
+            t = time.time()
+            if load_snapshot(self._snapshot_path(), self, self._snapshot_fingerprint(met_only)):
+                logger.info('Loaded dataset snapshot in {:.3f}s'.format(time.time() - t))
+                return True
+
+        if not self._load_files(met_only):
+            return False
+
+        if self._use_snapshot:
+            # (the fingerprint is only calculated now because loading can create, 
+            # download or rename some of the input files)
+            t = time.time()
+            try:
+                save_snapshot(self._snapshot_path(), self, self._snapshot_fingerprint(met_only))
+                logger.info('Saved dataset snapshot in {:.3f}s'.format(time.time() - t))
+            except Exception as e:
+                logger.warning('Failed to save dataset snapshot to "{}" (exception={})'.format(self._snapshot_path(), str(e)))
+
+        return True
+
+    def _snapshot_path(self):
+        return os.path.join(self._root, 'snapshot')
+
+    def _snapshot_fingerprint(self, met_only):
+        # the snapshot is invalidated if any of the input files or loading options change
+        inputs = [os.path.join(self.datadir, 'strain_id_mapping.csv'), self.strain_mappings_file,
+                  self.nodes_file, self.edges_file, self.extra_nodes_file, self.mgf_file,
+                  self.metadata_table_file, self.quantification_table_file,
+                  self.annotations_dir, self.annotations_config_file,
+                  self.antismash_dir, self.bigscape_dir, self.mibig_json_dir,
+                  self.params_file, self.description_file, self.include_strains_file]
+        options = {'met_only': met_only, 
+                   'bigscape_cutoff': self._bigscape_cutoff, 
+                   'antismash_format': self._antismash_format, 
+                   'antismash_delimiters': tuple(self._antismash_delimiters), 
+                   'ignore_spaces': self._antismash_ignore_spaces,
+                   'load_plan': tuple(self._load_plan.components)}
+        return input_fingerprint(inputs, options)
+
+    def _load_files(self, met_only):
         # load strain mappings first
         if not self._load_strain_mappings():
             return False
@@ -245,6 +385,47 @@ class DatasetLoader(object):
 
         return True
 
+    def deferred(self, component):
+        """
+        Return the DeferredLoad for <component> if it hasn't been loaded yet, otherwise None
+        """
+        deferred = self._deferred.get(component, None)
+        if deferred is None or deferred.loaded:
+            return None
+        return deferred
+
+    def load_deferred(self, *components):
+        """
+        Load any of the given parts of the dataset (see LoadPlan) which haven't been 
+        loaded yet, or all of them if no components are given
+        """
+        for component in components or LoadPlan.COMPONENTS:
+            if component == LoadPlan.PEAKS:
+                for spec in self.spectra:
+                    spec.peaks
+            elif component == LoadPlan.ANTISMASH:
+                for bgc in self.bgcs:
+                    bgc.antismash_id
+            elif component in self._deferred:
+                self._deferred[component].load()
+            elif component not in LoadPlan.COMPONENTS:
+                raise Exception('Unknown dataset component "{}"'.format(component))
+
+    def _defer_annotations(self, spectra):
+        spec_dict = {spec.spectrum_id: spec for spec in spectra}
+
+        def _load():
+            logger.info('Loading provided annotation files ({})'.format(self.annotations_dir))
+            load_annotations(self.annotations_dir, self.annotations_config_file, spectra, spec_dict)
+
+        self._deferred[LoadPlan.ANNOTATIONS] = DeferredLoad(LoadPlan.ANNOTATIONS, spectra, '_deferred_annotations', _load)
+
+    def _defer_edges(self, network_files, bgcs):
+        def _load():
+            load_network_edges(network_files, bgcs)
+
+        self._deferred[LoadPlan.EDGES] = DeferredLoad(LoadPlan.EDGES, bgcs, '_deferred_edges', _load)
+
     def _filter_user_strains(self):
         """
         If the user has supplied a list of strains to be explicitly included, go through the
@@ -365,6 +546,7 @@ class DatasetLoader(object):
     def _load_genomics_extra(self):
         if not os.path.exists(self.mibig_json_dir):
             logger.info('Attempting to download MiBIG JSON database...')
+            from .pairedomics.downloader import download_and_extract_mibig_json
             download_and_extract_mibig_json(self._root, self.mibig_json_dir)
 
         if not os.path.exists(self.bigscape_dir):
@@ -514,7 +696,12 @@ class DatasetLoader(object):
                                                 antismash_dir=self.antismash_dir,
                                                 antismash_filenames=self.antismash_cache,
                                                 antismash_format=self._antismash_format,
-                                                antismash_delimiters=self._antismash_delimiters)
+                                                antismash_delimiters=self._antismash_delimiters,
+                                                parse_headers=self._load_plan.includes(LoadPlan.ANTISMASH),
+                                                load_edges=self._load_plan.includes(LoadPlan.EDGES))
+        self._network_files = network_files
+        if not self._load_plan.includes(LoadPlan.EDGES):
+            self._defer_edges(network_files, self.bgcs)
 
         us_path = os.path.join(self._root, 'unknown_strains_gen.csv')
         logger.warning('Writing unknown strains from GENOMICS data to {}'.format(us_path))
@@ -526,7 +713,9 @@ class DatasetLoader(object):
         return True
 
     def _load_metabolomics(self):
-        spec_dict, self.spectra, self.molfams, unknown_strains = load_dataset(self.strains, self.mgf_file, self.edges_file, self.nodes_file, self.quantification_table_file, self.metadata_table_file)
+        spec_dict, self.spectra, self.molfams, unknown_strains = load_dataset(self.strains, self.mgf_file, self.edges_file, self.nodes_file, self.quantification_table_file, self.metadata_table_file,
+                                                                              load_peaks=self._load_plan.includes(LoadPlan.PEAKS),
+                                                                              mgf_processes=self._mgf_processes)
 
         us_path = os.path.join(self._root, 'unknown_strains_met.csv')
         logger.warning('Writing unknown strains from METABOLOMICS data to {}'.format(us_path))
@@ -535,7 +724,13 @@ class DatasetLoader(object):
             for strain in unknown_strains.keys():
                 us.write('{}\n'.format(strain))
 
-        # load any available annotations from GNPS or user-provided files
+        # load any available annotations from GNPS or user-provided files (unless 
+        # they're not part of the load plan, in which case this happens when they're 
+        # first used)
+        if not self._load_plan.includes(LoadPlan.ANNOTATIONS):
+            self._defer_annotations(self.spectra)
+            return True
+
         logger.info('Loading provided annotation files ({})'.format(self.annotations_dir))
         self.spectra = load_annotations(self.annotations_dir, self.annotations_config_file, self.spectra, spec_dict)
         return True
@@ -557,6 +752,7 @@ class DatasetLoader(object):
         if not os.path.exists(self.strain_mappings_file):
             # create an empty placeholder file and show a warning
             logger.warn('No strain_mappings.csv file found! Attempting to create one')
+            from .pairedomics.downloader import generate_strain_mappings
             generate_strain_mappings(self.strains, self.strain_mappings_file, self.antismash_dir)
             # raise Exception('Unable to load strain_mappings file: {}'.format(self.strain_mappings_file))
         else:
@@ -1,10 +1,13 @@
 import os
 import csv
 import re
+from types import MappingProxyType
+
+import numpy as np
 
 from .parsers.mgf import LoadMGF
-from .strains import StrainCollection
-from .utils import sqrt_normalise
+from .strains import StrainSet
+from .utils import sqrt_normalise, sqrt_normalise_arrays
 from .annotations import GNPS_KEY, GNPS_DATA_COLUMNS, create_gnps_annotation
 
 from .logconfig import LogConfig
@@ -26,37 +29,202 @@ JCAMP = '##TITLE={}\\n' +\
 # compile a regex for matching .mzXML and .mzML strings 
 RE_MZML_MZXML = re.compile('.mzXML|.mzML')
 
+# read-only empty containers shared by all Spectrum objects with no metadata,
+# annotations, edges or growth media (most spectra have no annotations or edges,
+# for example). The public attributes replace them with a new dict/list when 
+# they're first accessed, so they can be modified as usual
+_EMPTY_DICT = MappingProxyType({})
+_EMPTY_LIST = ()
+
 class Spectrum(object):
+
+    __slots__ = ('id', '_peaks', '_normalised_peaks', '_peak_source', '_n_peaks', '_max_ms2_intensity', '_total_ms2_intensity', 
+                 'spectrum_id', 'rt', 'precursor_mz', 'parent_mz', '_gnps_id', '_metadata', '_edges', 'strains', 
+                 '_growth_media', 'family_id', 'family', '_annotations', '_deferred_annotations', '_losses', '_jcamp')
     
     def __init__(self, id, peaks, spectrum_id, precursor_mz, parent_mz=None, rt=None):
         self.id = id
-        self.peaks = sorted(peaks, key=lambda x: x[0]) # ensure sorted by mz
-        self.normalised_peaks = sqrt_normalise(self.peaks) # useful later
-        self.n_peaks = len(self.peaks)
-        self.max_ms2_intensity = max([intensity for mz, intensity in self.peaks])
-        self.total_ms2_intensity = sum([intensity for mz, intensity in self.peaks])
+        # where to get the peaks from if they haven't been loaded yet, see the peaks property
+        self._peak_source = None
+        self._set_peaks(peaks)
         assert(isinstance(spectrum_id, int))
         self.spectrum_id = spectrum_id
         self.rt = rt
         self.precursor_mz = precursor_mz
         self.parent_mz = parent_mz
-        self.gnps_id = None # CCMSLIB...
+        self._gnps_id = None # CCMSLIB...
         # TODO should add intensity here too
-        self.metadata = {}
-        self.edges = []
-        self.strains = StrainCollection()
+        self._metadata = _EMPTY_DICT
+        self._edges = _EMPTY_LIST
+        self.strains = StrainSet()
         # this is a dict indexed by Strain objects (the strains found in this Spectrum), with 
         # the values being dicts of the form {growth_medium: peak intensity} for the parent strain
-        self.growth_media = {}
+        self._growth_media = _EMPTY_DICT
         self.family_id = -1
         self.family = None
-        # a dict indexed by filename, or "gnps" 
-        self.annotations = {}
+        # a dict indexed by filename, or "gnps"
+        self._annotations = _EMPTY_DICT
+        # if the annotation files haven't been loaded yet, the (shared) object which 
+        # will load them when they're first needed (see DatasetLoader)
+        self._deferred_annotations = None
         self._losses = None
         self._jcamp = None
 
+    def _set_peaks(self, peaks):
+        self._peaks = sorted(peaks, key=lambda x: x[0]) # ensure sorted by mz
+        self._normalised_peaks = sqrt_normalise(self._peaks) # useful later
+        self._n_peaks = len(self._peaks)
+        self._max_ms2_intensity = max([intensity for mz, intensity in self._peaks], default=0.0)
+        self._total_ms2_intensity = sum([intensity for mz, intensity in self._peaks])
+
+    def set_peak_source(self, source):
+        """
+        Discard the peaks of this spectrum, they will be loaded from <source> when 
+        they're next used instead (either an MGFPeaks, or a tuple of (peaks, 
+        normalised_peaks) arrays, see _load_peaks)
+        """
+        self._peak_source = source
+        self._peaks = self._normalised_peaks = None
+        self._n_peaks = self._max_ms2_intensity = self._total_ms2_intensity = None
+
+    def _load_peaks(self):
+        # the peaks of a spectrum may not have been loaded yet, if they were not
+        # part of the DatasetLoader load plan (the source is then an MGFPeaks), or
+        # if they were parsed into arrays (see LoadMGF.load_spectra_arrays) or loaded
+        # from a dataset snapshot (the source is then a tuple of (peaks, normalised_peaks)
+        # views of the arrays of all peaks in the dataset). in both cases the usual 
+        # lists of (mz, intensity) tuples are created when they're first used
+        source = self._peak_source
+        self._peak_source = None
+        if isinstance(source, tuple):
+            peaks, normalised_peaks = source
+            self._peaks = [tuple(p) for p in peaks.tolist()]
+            self._normalised_peaks = [tuple(p) for p in normalised_peaks.tolist()]
+            # (the counts and intensities are usually set along with the source, 
+            # see arrays_to_spectra, otherwise they're calculated as in _set_peaks)
+            if self._n_peaks is None:
+                self._n_peaks = len(self._peaks)
+            if self._max_ms2_intensity is None:
+                self._max_ms2_intensity = float(peaks[:, 1].max(initial=0.0))
+            if self._total_ms2_intensity is None:
+                self._total_ms2_intensity = sum([intensity for mz, intensity in self._peaks])
+        else:
+            self._set_peaks(source.load())
+
+    @property
+    def peaks(self):
+        if self._peak_source is not None:
+            self._load_peaks()
+        return self._peaks
+
+    @peaks.setter
+    def peaks(self, peaks):
+        if self._peak_source is not None:
+            self._load_peaks()
+        self._peaks = peaks
+
+    @property
+    def normalised_peaks(self):
+        if self._peak_source is not None:
+            self._load_peaks()
+        return self._normalised_peaks
+
+    @normalised_peaks.setter
+    def normalised_peaks(self, normalised_peaks):
+        if self._peak_source is not None:
+            self._load_peaks()
+        self._normalised_peaks = normalised_peaks
+
+    @property
+    def n_peaks(self):
+        if self._n_peaks is None:
+            self._load_peaks()
+        return self._n_peaks
+
+    @n_peaks.setter
+    def n_peaks(self, n_peaks):
+        self._n_peaks = n_peaks
+
+    @property
+    def max_ms2_intensity(self):
+        if self._max_ms2_intensity is None:
+            self._load_peaks()
+        return self._max_ms2_intensity
+
+    @max_ms2_intensity.setter
+    def max_ms2_intensity(self, max_ms2_intensity):
+        self._max_ms2_intensity = max_ms2_intensity
+
+    @property
+    def total_ms2_intensity(self):
+        if self._total_ms2_intensity is None:
+            self._load_peaks()
+        return self._total_ms2_intensity
+
+    @total_ms2_intensity.setter
+    def total_ms2_intensity(self, total_ms2_intensity):
+        self._total_ms2_intensity = total_ms2_intensity
+
+    @property
+    def metadata(self):
+        if self._metadata is _EMPTY_DICT:
+            self._metadata = {}
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, metadata):
+        self._metadata = metadata
+
+    @property
+    def edges(self):
+        if self._edges is _EMPTY_LIST:
+            self._edges = []
+        return self._edges
+
+    @edges.setter
+    def edges(self, edges):
+        self._edges = edges
+
+    @property
+    def growth_media(self):
+        if self._growth_media is _EMPTY_DICT:
+            self._growth_media = {}
+        return self._growth_media
+
+    @growth_media.setter
+    def growth_media(self, growth_media):
+        self._growth_media = growth_media
+
+    def _get_annotations(self):
+        # the annotations, without creating a new dict if there aren't any
+        if self._deferred_annotations is not None:
+            self._deferred_annotations.load()
+        return self._annotations
+
+    @property
+    def annotations(self):
+        if self._get_annotations() is _EMPTY_DICT:
+            self._annotations = {}
+        return self._annotations
+
+    @annotations.setter
+    def annotations(self, annotations):
+        if self._deferred_annotations is not None:
+            self._deferred_annotations.load()
+        self._annotations = annotations
+
+    @property
+    def gnps_id(self):
+        if self._deferred_annotations is not None:
+            self._deferred_annotations.load()
+        return self._gnps_id
+
+    @gnps_id.setter
+    def gnps_id(self, gnps_id):
+        self._gnps_id = gnps_id
+
     def add_strain(self, strain, growth_medium, peak_intensity):
-        # adds the strain to the StrainCollection if not already there
+        # adds the strain to the StrainSet if not already there
         self.strains.add(strain)
 
         if strain not in self.growth_media:
@@ -74,25 +242,35 @@ class Spectrum(object):
         
     @property
     def is_library(self):
-        return GNPS_KEY in self.annotations
+        return GNPS_KEY in self._get_annotations()
 
     def set_annotations(self, key, data):
         self.annotations[key] = data
 
+    def add_edge(self, edge):
+        self.edges.append(edge)
+
     @property
     def gnps_annotations(self):
-        if GNPS_KEY not in self.annotations:
+        annotations = self._get_annotations()
+        if GNPS_KEY not in annotations:
             return None
 
-        return self.annotations[GNPS_KEY][0]
+        return annotations[GNPS_KEY][0]
 
     def has_annotations(self):
-        return len(self.annotations) > 0
+        return len(self._get_annotations()) > 0
 
     def get_metadata_value(self, key):
-        val = self.metadata.get(key, None)
+        val = self._metadata.get(key, None)
         return val
 
+    def set_metadata_value(self, key, value):
+        self.metadata[key] = value
+
+    def update_metadata(self, metadata):
+        self.metadata.update(metadata)
+
     def has_strain(self, strain):
         return strain in self.strains
 
@@ -100,7 +278,7 @@ class Spectrum(object):
         if strain not in self.strains:
             return None
 
-        gms = self.growth_media[strain]
+        gms = self._growth_media[strain]
         return list(gms.keys())[0]
 
     def to_jcamp_str(self, force_refresh=False):
@@ -208,6 +386,9 @@ class Spectrum(object):
         return matched_losses
 
 class MolecularFamily(object):
+
+    __slots__ = ('id', 'family_id', 'spectra', 'family')
+
     def __init__(self, family_id):
         self.id = -1 
         self.family_id = family_id
@@ -241,6 +422,9 @@ class MolecularFamily(object):
         return self.id
 
 class SingletonFamily(MolecularFamily):
+
+    __slots__ = ()
+
     def __init__(self):
         super(SingletonFamily, self).__init__(-1)
 
@@ -296,6 +480,35 @@ def identify_gnps_format(filename, has_quant_table):
         # if we don't match any of the above cases then it's not a recognised format
         return GNPS_FORMAT_UNKNOWN
 
+class MGFPeaks(object):
+    """
+    The location of the peaks of a Spectrum in an MGF file, used when the peaks
+    aren't loaded along with the rest of the dataset (see Spectrum.set_peak_source)
+    """
+
+    __slots__ = ('mgf_file', 'offset')
+
+    def __init__(self, mgf_file, offset):
+        self.mgf_file = mgf_file
+        self.offset = offset
+
+    def load(self):
+        return LoadMGF(name_field='scans').read_peaks(self.mgf_file, self.offset)
+
+def _new_spectrum(id, peaks, name, metadata):
+    new_spectrum = Spectrum(id, peaks, int(name), metadata[name]['precursormass'], metadata[name]['parentmass'])
+    new_spectrum.metadata = metadata[name]
+    # add GNPS ID if in metadata under SPECTRUMID (this doesn't seem to be in regular MGF files
+    # from GNPS, but *is* in the rosetta mibig MGF)
+    # note: LoadMGF seems to lowercase (some) metadata keys?
+    if 'spectrumid' in new_spectrum.metadata:
+        # add an annotation for consistency, if not already there
+        if GNPS_KEY not in new_spectrum.annotations:
+            gnps_anno = {k: None for k in GNPS_DATA_COLUMNS}
+            gnps_anno['SpectrumID'] = new_spectrum.metadata['spectrumid']
+            create_gnps_annotation(new_spectrum, gnps_anno)
+    return new_spectrum
+
 def mols_to_spectra(ms2, metadata):
     ms2_dict = {}
     for m in ms2:
@@ -305,17 +518,50 @@ def mols_to_spectra(ms2, metadata):
     
     spectra = []
     for i, m in enumerate(ms2_dict.keys()):
-        new_spectrum = Spectrum(i, ms2_dict[m], int(m.name), metadata[m.name]['precursormass'], metadata[m.name]['parentmass'])
-        new_spectrum.metadata = metadata[m.name]
-        # add GNPS ID if in metadata under SPECTRUMID (this doesn't seem to be in regular MGF files
-        # from GNPS, but *is* in the rosetta mibig MGF)
-        # note: LoadMGF seems to lowercase (some) metadata keys?
-        if 'spectrumid' in new_spectrum.metadata:
-            # add an annotation for consistency, if not already there
-            if GNPS_KEY not in new_spectrum.annotations:
-                gnps_anno = {k: None for k in GNPS_DATA_COLUMNS}
-                gnps_anno['SpectrumID'] = new_spectrum.metadata['spectrumid']
-                create_gnps_annotation(new_spectrum, gnps_anno)
+        spectra.append(_new_spectrum(i, ms2_dict[m], m.name, metadata))
+
+    return spectra
+
+def arrays_to_spectra(ms1, metadata, peaks, offsets):
+    # the equivalent of mols_to_spectra for the output of LoadMGF.load_spectra_arrays,
+    # each spectrum only holds views of its rows of the peak arrays until its peaks 
+    # are first used
+    n_peaks = np.diff(offsets)
+    max_intensities = np.zeros(len(ms1), dtype=np.float64)
+    total_intensities = np.zeros(len(ms1), dtype=np.float64)
+    if len(peaks) > 0:
+        # (reduceat gives the value at the start offset for a spectrum with no peaks, 
+        # the parser doesn't create any but they're left at 0 here just in case. the
+        # totals can differ from the sums in Spectrum._set_peaks in the last few bits)
+        has_peaks = n_peaks > 0
+        starts = np.minimum(offsets[:-1], len(peaks) - 1)
+        max_intensities[has_peaks] = np.maximum.reduceat(peaks[:, 1], starts)[has_peaks]
+        total_intensities[has_peaks] = np.add.reduceat(peaks[:, 1], starts)[has_peaks]
+    normalised_peaks = sqrt_normalise_arrays(peaks, offsets, total_intensities)
+    n_peaks = n_peaks.tolist()
+    max_intensities = max_intensities.tolist()
+    total_intensities = total_intensities.tolist()
+    offsets = offsets.tolist()
+
+    spectra = []
+    for i, m in enumerate(ms1):
+        new_spectrum = _new_spectrum(i, [], m.name, metadata)
+        start, end = offsets[i], offsets[i + 1]
+        new_spectrum.set_peak_source((peaks[start:end], normalised_peaks[start:end]))
+        new_spectrum.n_peaks = n_peaks[i]
+        new_spectrum.max_ms2_intensity = max_intensities[i]
+        new_spectrum.total_ms2_intensity = total_intensities[i]
+        spectra.append(new_spectrum)
+
+    return spectra
+
+def index_to_spectra(mgf_file, ms1, metadata, offsets):
+    # the equivalent of mols_to_spectra for the output of LoadMGF.load_spectra_index,
+    # the peaks of each spectrum are only read from the MGF file when first used
+    spectra = []
+    for i, (m, offset) in enumerate(zip(ms1, offsets)):
+        new_spectrum = _new_spectrum(i, [], m.name, metadata)
+        new_spectrum.set_peak_source(MGFPeaks(mgf_file, offset))
         spectra.append(new_spectrum)
 
     return spectra
@@ -346,8 +592,8 @@ def load_edges(edges_file, spec_dict):
                 spec1.family_id = family
                 spec2.family_id = family
 
-                spec1.edges.append((spec2.id, spec2.spectrum_id, cosine))
-                spec2.edges.append((spec1.id, spec1.spectrum_id, cosine))
+                spec1.add_edge((spec2.id, spec2.spectrum_id, cosine))
+                spec2.add_edge((spec1.id, spec1.spectrum_id, cosine))
             else:
                 spec1.family_id = family
 
@@ -519,7 +765,7 @@ def load_clusterinfo_old(gnps_format, strains, filename, spec_dict):
                     spec_dict[clu_index].add_strain(strain, None, 1)
                 
                 # update metadata on Spectrum object
-                spec_dict[clu_index].metadata.update(metadata)
+                spec_dict[clu_index].update_metadata(metadata)
 
     if len(unknown_strains) > 0:
         logger.warning('{} unknown strains were detected a total of {} times'.format(len(unknown_strains), sum(unknown_strains.values())))
@@ -589,7 +835,7 @@ def load_clusterinfo_fbmn(strains, nodes_file, extra_nodes_file, md_table_file,
         # this is only for Carnegie atm, but should work for other datasets too?
         if 'ATTRIBUTE_SampleType' in spec_data:
             st = spec_data['ATTRIBUTE_SampleType'].split(',')
-            spectrum.metadata['ATTRIBUTE_SampleType'] = st
+            spectrum.set_metadata_value('ATTRIBUTE_SampleType', st)
 
         # TODO better way of filtering/converting all this stuff down to what's relevant?
         # could search for each strain ID in column title but would be slower?
@@ -613,19 +859,26 @@ def load_clusterinfo_fbmn(strains, nodes_file, extra_nodes_file, md_table_file,
                 strain = strains.lookup(strain_name)
                 spectrum.add_strain(strain, growth_medium, v)
 
-            spectrum.metadata[k] = v
+            spectrum.set_metadata_value(k, v)
 
     return spec_info, unknown_strains
 
-def load_dataset(strains, mgf_file, edges_file, nodes_file, quant_table_file=None, metadata_table_file=None):
+def load_dataset(strains, mgf_file, edges_file, nodes_file, quant_table_file=None, metadata_table_file=None, load_peaks=True, mgf_processes=1):
     # common steps to all formats of GNPS data:
     #   - parse the MGF file to create a set of Spectrum objects
     #   - parse the edges file and update the spectra with that data
 
-    # build a set of Spectrum objects by parsing the MGF file
-    ms1, ms2, metadata = LoadMGF(name_field='scans').load_spectra([mgf_file])
-    logger.info('{} molecules parsed from MGF file'.format(len(ms1)))
-    spectra = mols_to_spectra(ms2, metadata)
+    # build a set of Spectrum objects by parsing the MGF file (if load_peaks is False, 
+    # only the metadata of each spectrum is parsed and the peaks are read later if needed).
+    # large MGF files can be parsed on multiple processes, see LoadMGF.load_spectra_arrays
+    if load_peaks:
+        ms1, metadata, peaks, offsets = LoadMGF(name_field='scans').load_spectra_arrays(mgf_file, processes=mgf_processes)
+        logger.info('{} molecules parsed from MGF file'.format(len(ms1)))
+        spectra = arrays_to_spectra(ms1, metadata, peaks, offsets)
+    else:
+        ms1, metadata, offsets = LoadMGF(name_field='scans').load_spectra_index(mgf_file)
+        logger.info('{} molecules parsed from MGF file (without peaks)'.format(len(ms1)))
+        spectra = index_to_spectra(mgf_file, ms1, metadata, offsets)
     # above returns a list, create a dict indexed by spectrum_id to make
     # the rest of the parsing a bit simpler
     spec_dict = {spec.spectrum_id : spec for spec in spectra}
@@ -13,7 +13,7 @@ from .loader import DatasetLoader
 from .pickler import save_pickled_data
 
 from .scoring.methods import MetcalfScoring, RosettaScoring, TestScoring
-from .scoring.methods import LinkCollection
+from .scoring.methods import LinkCollection, ColumnarLinkCollection, SharedStrainBatch
 
 from .logconfig import LogConfig
 logger = LogConfig.getLogger(__file__)
@@ -224,7 +224,24 @@ class NPLinker(object):
         """Returns the current BiGSCAPE clustering cutoff value"""
         return self._loader._bigscape_cutoff
 
-    def load_data(self, new_bigscape_cutoff=None, met_only=False):
+    @property
+    def load_plan(self):
+        """Returns the LoadPlan used to load the current dataset"""
+        return self._loader.load_plan
+
+    def load_deferred(self, *components):
+        """Loads any parts of the dataset that weren't loaded by load_data.
+
+        Parts of the dataset not included in the load plan are loaded automatically
+        the first time they're used, this can be used to load them all at once instead.
+
+        Args:
+            components: the names of the components to load (see LoadPlan), or 
+                nothing to load everything
+        """
+        self._loader.load_deferred(*components)
+
+    def load_data(self, new_bigscape_cutoff=None, met_only=False, load_plan=None):
         """Loads the basic components of a dataset.
 
         This method is responsible for loading the various pieces of the supplied dataset into
@@ -232,6 +249,12 @@ class NPLinker(object):
         applications can access the lists of GCFs, Spectra, MolecularFamilies and strains 
         using the corresponding properties of the NPLinker class.
 
+        Args:
+            load_plan: the parts of the dataset to load up front, either a LoadPlan,
+                a list of component names or the name of a predefined plan (e.g. 
+                "metcalf"). Anything else is loaded the first time it's used. If not 
+                given, the load_plan value from the configuration is used (default "full")
+
         Returns:
             bool: True if successful, False otherwise
         """
@@ -240,7 +263,7 @@ class NPLinker(object):
             logger.debug('load_data (normal case, full load, met_only={})'.format(met_only))
             self._loader.validate()
 
-            if not self._loader.load(met_only=met_only):
+            if not self._loader.load(met_only=met_only, load_plan=load_plan):
                 return False
         else:
             logger.debug('load_data with new cutoff = {}'.format(new_bigscape_cutoff))
@@ -252,6 +275,9 @@ class NPLinker(object):
             self._loader._load_strain_mappings()
             # 3. reload the genomics data with the new cutoff applied
             self._loader._load_genomics()
+            # 4. scoring methods need to be set up again for the new GCFs (they can
+            # reuse any preprocessing of the metabolomics data)
+            self._scoring_methods_setup_complete = {name: False for name in self._scoring_methods.keys()}
 
         self._spectra = self._loader.spectra
         self._molfams = self._loader.molfams
@@ -285,7 +311,7 @@ class NPLinker(object):
         logger.debug('load_data: completed')
         return True
 
-    def get_links(self, input_objects, scoring_methods, and_mode=True):
+    def get_links(self, input_objects, scoring_methods, and_mode=True, lazy_shared_strains=False, columnar=False):
         """Find links for a set of input objects (BGCs/GCFs/Spectra/MolFams)
         
         The input objects can be any mix of the following NPLinker types:
@@ -307,6 +333,13 @@ class NPLinker(object):
                 are used and ``and_mode`` is True, the results will only contain
                 links found by ALL methods. If False, results will contain links
                 found by ANY method. 
+            lazy_shared_strains (bool): if True, the shared strains of the links are
+                only calculated (for all links at once) when the ``shared_strains``
+                of one of them is first accessed.
+            columnar (bool): if True, the results are stored in a 
+                ``ColumnarLinkCollection``, which stores links as arrays and 
+                only creates ``ObjectLink`` instances when they are accessed. This 
+                uses much less memory for large numbers of links.
 
         Returns:
             An instance of ``nplinker.scoring.methods.LinkCollection``
@@ -347,7 +380,7 @@ class NPLinker(object):
                     input_objects.append(input_objects[0])
                     logger.debug('Duplicating input object set')
 
-        link_collection = LinkCollection(and_mode)
+        link_collection = ColumnarLinkCollection(and_mode) if columnar else LinkCollection(and_mode)
 
         for i, method in enumerate(scoring_methods):
             # do any one-off initialisation required by this method
@@ -371,26 +404,21 @@ class NPLinker(object):
 
         # populate shared strain info
         logger.debug('Calculating shared strain information...')
-        # TODO more efficient version?
-        for source, link_data in link_collection.links.items():
-            if isinstance(source, BGC):
-                logger.debug('Cannot determine shared strains for BGC input!')
-                break
-
-            targets = list(filter(lambda x: not isinstance(x, BGC), link_data.keys()))
-            if len(targets) > 0:
-                shared_strains = self._datalinks.common_strains([source], targets, True)
-                for objpair in shared_strains.keys():
-                    shared_strains[objpair] = [self._strains.lookup_index(x) for x in shared_strains[objpair]]
-
-                if isinstance(source, GCF):
-                    for target, link in link_data.items():
-                        if (target, source) in shared_strains:
-                            link.shared_strains = shared_strains[(target, source)]
-                else:
-                    for target, link in link_data.items():
-                        if (source, target) in shared_strains:
-                            link.shared_strains = shared_strains[(source, target)]
+        if isinstance(link_collection, ColumnarLinkCollection):
+            # links which don't involve a GCF and a Spectrum/MolecularFamily are skipped
+            link_collection.set_shared_strains(self._datalinks, self._strains, lazy=lazy_shared_strains)
+        else:
+            links = []
+            for source, link_data in link_collection.links.items():
+                if isinstance(source, BGC):
+                    logger.debug('Cannot determine shared strains for BGC input!')
+                    continue
+
+                for target, link in link_data.items():
+                    if not isinstance(target, BGC):
+                        links.append(link)
+
+            SharedStrainBatch(self._datalinks, self._strains, links, lazy=lazy_shared_strains)
 
         logger.debug('Finished calculating shared strain information')
 
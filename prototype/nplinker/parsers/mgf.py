@@ -1,9 +1,19 @@
 # coding=utf8
 
 import os
+import array
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 
 PROTON_MASS = 1.00727645199076
 
+# size of the chunks LoadMGF.load_spectra_arrays reads MGF files in (bytes)
+MGF_CHUNK_SIZE = 16 * 1024 * 1024
+# the minimum size of the byte ranges an MGF file is split into when parsing it
+# with multiple processes (bytes)
+MGF_MIN_RANGE_SIZE = 4 * 1024 * 1024
+
 class MS1(object):
     def __init__(self, id, mz, rt, intensity, file_name, scan_number=None, single_charge_precursor_mass=None):
         self.id = id
@@ -381,6 +391,73 @@ class Loader(object):
 # A class to load spectra that sit in MGF files
 class LoadMGF(Loader):
 
+    def _parse_metadata_line(self, rline, temp_metadata):
+        # parse a KEY=value line from the current block into temp_metadata
+        key, val = rline.split("=", 1)
+        key = key.lower()
+
+        if len(val) == 0:
+            return
+
+        if key in ["featureid", "feature_id"]:
+            temp_metadata['featid'] = val
+
+        elif key == "rtinseconds":
+            # val = float(val) if isinstance(val, float) else None
+            try:
+                val = float(val)
+            except:
+                val = None
+            temp_metadata['parentrt'] = val
+
+        elif key == "pepmass":
+            # only mass exists
+            if " " not in val:
+                temp_metadata['precursormass'] = float(val)
+                temp_metadata['parentintensity'] = None
+
+            # mass and intensity exist
+            else:
+                parentmass, parentintensity = val.split(' ', 1)
+                temp_metadata['precursormass'] = float(parentmass)
+                temp_metadata['parentintensity'] = float(parentintensity)
+
+        else:
+            temp_metadata[key] = val
+
+    def _new_ms1(self, temp_metadata, ms1_id, file_name, metadata):
+        # called at the first peak of each block to create its MS1 object
+        # and store its metadata
+
+        # Following corrects parentmass according to charge
+        # if charge is known. This should lead to better computation of neutral losses
+        single_charge_precursor_mass = temp_metadata['precursormass']
+        precursor_mass = temp_metadata['precursormass']
+        parent_mass = temp_metadata['precursormass']
+
+        str_charge = temp_metadata.get('charge', '1')
+        int_charge = self._interpret_charge(str_charge)
+
+        parent_mass, single_charge_precursor_mass = self._ion_masses(precursor_mass, int_charge)
+
+        temp_metadata['parentmass'] = parent_mass
+        temp_metadata['singlechargeprecursormass'] = single_charge_precursor_mass
+        temp_metadata['charge'] = int_charge
+
+        new_ms1 = MS1(ms1_id, precursor_mass, temp_metadata.get('parentrt', None), temp_metadata.get('parentintensity', None), 
+                      file_name, single_charge_precursor_mass=single_charge_precursor_mass)
+
+        doc_name = temp_metadata.get(self.name_field.lower(), None)
+        if not doc_name:
+            if 'name' in temp_metadata:
+                doc_name = temp_metadata['name']
+            else:
+                doc_name = 'document_{}'.format(ms1_id + 1)
+        metadata[doc_name] = temp_metadata.copy()
+        # TODO this overrides the original format of MS1.name attribute?
+        new_ms1.name = doc_name
+        return new_ms1
+
     def load_spectra(self, input_set):
         ms1 = []
         ms2 = []
@@ -393,9 +470,6 @@ class LoadMGF(Loader):
             with open(input_file, 'r') as f:
                 temp_metadata = {}
                 in_doc = False
-                parentmass = None
-                parentintensity = None
-                parentrt = None
                 for line in f:
                     rline  = line.rstrip()
                     if not rline or rline == "BEGIN IONS":
@@ -404,87 +478,20 @@ class LoadMGF(Loader):
                         # finished doc, time to save
                         in_doc = False
                         temp_metadata = {}
-                        parentmass = None
-                        parentintensity = None
-                        parentrt = None
                         new_ms1 = None
                     else:
                         if "=" in rline:
-                            key, val = rline.split("=", 1)
-                            key = key.lower()
-
-                            if len(val) == 0:
-                                continue
-
-                            featid = None
-                            if key in ["featureid", "feature_id"]:
-                                featid = val
-                                temp_metadata['featid'] = val
-
-                            elif key == "rtinseconds":
-                                # val = float(val) if isinstance(val, float) else None
-                                try:
-                                    val = float(val)
-                                except:
-                                    val = None
-                                temp_metadata['parentrt'] = val
-                                parentrt = val
-
-                            elif key == "pepmass":
-                                # only mass exists
-                                if " " not in val:
-                                    temp_metadata['precursormass'] = float(val)
-                                    temp_metadata['parentintensity'] = None
-                                    parentmass = float(val)
-                                    parentintensity = None
-
-                                # mass and intensity exist
-                                else:
-                                    parentmass, parentintensity = val.split(' ', 1)
-                                    parentmass = float(parentmass)
-                                    parentintensity = float(parentintensity)
-                                    temp_metadata['precursormass'] = parentmass
-                                    temp_metadata['parentintensity'] = parentintensity
-
-                            else:
-                                temp_metadata[key] = val
+                            self._parse_metadata_line(rline, temp_metadata)
                         else:
                             if 'mslevel' in temp_metadata and temp_metadata['mslevel'] == '1':
                                 continue
 
                             if not in_doc:
                                 in_doc = True
-                                # Following corrects parentmass according to charge
-                                # if charge is known. This should lead to better computation of neutral losses
-                                single_charge_precursor_mass = temp_metadata['precursormass']
-                                precursor_mass = temp_metadata['precursormass']
-                                parent_mass = temp_metadata['precursormass']
-
-                                str_charge = temp_metadata.get('charge', '1')
-                                int_charge = self._interpret_charge(str_charge)
-
-                                parent_mass, single_charge_precursor_mass = self._ion_masses(precursor_mass, int_charge)
-
-
-                                temp_metadata['parentmass'] = parent_mass
-                                temp_metadata['singlechargeprecursormass'] = single_charge_precursor_mass
-                                temp_metadata['charge'] = int_charge
-
-                                new_ms1 = MS1(ms1_id, precursor_mass, parentrt, parentintensity, file_name, single_charge_precursor_mass=single_charge_precursor_mass)
+                                new_ms1 = self._new_ms1(temp_metadata, ms1_id, file_name, metadata)
                                 ms1_id += 1
-
-                                doc_name = temp_metadata.get(self.name_field.lower(), None)
-                                if not doc_name:
-                                    if 'name' in temp_metadata:
-                                        doc_name = temp_metadata['name']
-                                    else:
-                                        doc_name = 'document_{}'.format(ms1_id)
-                                metadata[doc_name] = temp_metadata.copy()
-                                # TODO this overrides the original format of MS1.name attribute?
-                                new_ms1.name = doc_name
                                 ms1.append(new_ms1)
 
-
                             tokens = rline.split()
                             if len(tokens) == 2:
                                 mz = float(tokens[0])
@@ -507,3 +514,282 @@ class LoadMGF(Loader):
         metadata = self.process_metadata(ms1, metadata)
 
         return ms1, ms2, metadata
+
+    def load_spectra_index(self, input_file):
+        """
+        Parse the metadata of the spectra in an MGF file without parsing their 
+        fragment peaks (see read_peaks). 
+        
+        Returns (ms1, metadata, offsets), where ms1 only contains the spectra which 
+        would have peaks in the output of load_spectra, and offsets gives the byte 
+        offset of the block in the file for each of them. The intensity filtering
+        and peaklist options are not supported.
+        """
+        if self.min_ms1_intensity > 0.0 or self.min_ms2_intensity > 0.0 or self.peaklist:
+            raise Exception('load_spectra_index does not support intensity filtering or peaklists')
+
+        ms1 = []
+        offsets = []
+        metadata = {}
+        ms1_id = 0
+        file_name = os.path.basename(input_file)
+        # (binary mode to keep track of the byte offsets)
+        with open(input_file, 'rb') as f:
+            temp_metadata = {}
+            in_doc = False
+            has_peaks = False
+            block_offset = offset = 0
+            for line in f:
+                line_offset = offset
+                offset += len(line)
+                rline = line.rstrip()
+                if not rline or rline == b"BEGIN IONS":
+                    continue
+                if rline == b"END IONS":
+                    if has_peaks:
+                        ms1.append(new_ms1)
+                        offsets.append(block_offset)
+                    in_doc = False
+                    has_peaks = False
+                    temp_metadata = {}
+                    new_ms1 = None
+                    block_offset = offset
+                elif b"=" in rline:
+                    self._parse_metadata_line(rline.decode(), temp_metadata)
+                elif has_peaks or temp_metadata.get('mslevel', None) == '1':
+                    # only need to know if a block has at least one peak
+                    continue
+                else:
+                    if not in_doc:
+                        in_doc = True
+                        new_ms1 = self._new_ms1(temp_metadata, ms1_id, file_name, metadata)
+                        ms1_id += 1
+
+                    tokens = rline.split()
+                    if len(tokens) == 2 and float(tokens[1]) != 0.0:
+                        has_peaks = True
+
+            # (a final block without an END IONS line)
+            if has_peaks:
+                ms1.append(new_ms1)
+                offsets.append(block_offset)
+
+        metadata = self.process_metadata(ms1, metadata)
+        return ms1, metadata, offsets
+
+    def read_peaks(self, input_file, offset):
+        """
+        Parse the fragment peaks of the block at <offset> in an MGF file (see 
+        load_spectra_index), returning a list of (mz, intensity) tuples
+        """
+        peaks = []
+        mslevel = None
+        with open(input_file, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                rline = line.rstrip()
+                if not rline or rline == b"BEGIN IONS":
+                    continue
+                if rline == b"END IONS":
+                    break
+                if b"=" in rline:
+                    key, val = rline.split(b"=", 1)
+                    if key.lower() == b"mslevel" and len(val) > 0:
+                        mslevel = val
+                    continue
+                if mslevel == b"1":
+                    continue
+
+                tokens = rline.split()
+                if len(tokens) == 2:
+                    mz = float(tokens[0])
+                    intensity = float(tokens[1])
+                    if intensity != 0.0:
+                        peaks.append((mz, intensity))
+        return peaks
+
+    def _split_blocks(self, data, final):
+        # split the text of an MGF file into the text of each block, i.e. everything
+        # up to the next END IONS line. returns (blocks, rest), where rest is the text 
+        # after the last complete block (unless final is True, the end of data is 
+        # not necessarily the end of a line)
+        blocks = []
+        start = pos = 0
+        while True:
+            pos = data.find(b"END IONS", pos)
+            if pos == -1:
+                break
+            line_end = data.find(b"\n", pos)
+            if line_end == -1:
+                if not final:
+                    break
+                line_end = len(data)
+            if (pos == 0 or data[pos - 1:pos] == b"\n") and data[pos:line_end].rstrip() == b"END IONS":
+                blocks.append(data[start:pos])
+                start = line_end + 1
+            pos = line_end
+
+        if final:
+            blocks.append(data[start:])
+            return blocks, b""
+        return blocks, data[start:]
+
+    def _parse_block(self, block):
+        # parse the text of one block, returning (metadata, peaks) where metadata is 
+        # None for blocks without any fragment peak lines (and for mslevel=1 blocks),
+        # and peaks is a (num_peaks x 2) array of the non-zero intensity (mz, intensity)
+        # peaks. the MS1 object for the block is created later (see _new_ms1), as its 
+        # ID depends on the blocks before it
+        lines = block.split(b"\n")
+        temp_metadata = {}
+        i = 0
+        for i, line in enumerate(lines):
+            rline = line.rstrip()
+            if not rline or rline == b"BEGIN IONS":
+                continue
+            if b"=" not in rline:
+                break
+            self._parse_metadata_line(rline.decode(), temp_metadata)
+        else:
+            # no peak lines
+            return None, None
+
+        if temp_metadata.get('mslevel', None) == '1':
+            return None, None
+
+        peak_lines = lines[i:]
+        peak_text = b"\n".join(peak_lines)
+        if b"=" in peak_text or b"BEGIN IONS" in peak_text:
+            # some metadata after the peaks (or a block without an END IONS line 
+            # followed by another one), need to go through it line by line 
+            values = []
+            mslevel = None
+            for line in peak_lines:
+                rline = line.rstrip()
+                if not rline or rline == b"BEGIN IONS":
+                    continue
+                if b"=" in rline:
+                    # (this is too late to be included in the metadata of the spectrum)
+                    key, val = rline.split(b"=", 1)
+                    if key.lower() == b"mslevel" and len(val) > 0:
+                        mslevel = val
+                    continue
+                if mslevel == b"1":
+                    continue
+                tokens = rline.split()
+                if len(tokens) == 2:
+                    values.extend(tokens)
+        else:
+            # the usual case, all of the peaks can be converted in one go
+            values = [token for tokens in map(bytes.split, peak_lines) if len(tokens) == 2 for token in tokens]
+
+        peaks = np.array(values, dtype=np.float64).reshape(-1, 2)
+        return temp_metadata, peaks[peaks[:, 1] != 0.0]
+
+    def _parse_range(self, input_file, start, end):
+        # parse the blocks in bytes start:end of an MGF file (which must be block 
+        # boundaries, see _range_boundaries). returns (block_metadata, counts, peaks)
+        # where block_metadata and counts are the metadata and number of peaks of 
+        # each block with fragment peak lines (the count can be 0), and peaks is the 
+        # (num_peaks x 2) array of all of their peaks, sorted by mz within each block
+        block_metadata = []
+        counts = []
+        values = array.array('d')
+        with open(input_file, 'rb') as f:
+            f.seek(start)
+            remaining = end - start
+            rest = b""
+            final = False
+            while not final:
+                chunk = f.read(min(MGF_CHUNK_SIZE, remaining))
+                remaining -= len(chunk)
+                final = len(chunk) == 0 or remaining == 0
+                blocks, rest = self._split_blocks(rest + chunk, final)
+                for block in blocks:
+                    temp_metadata, peaks = self._parse_block(block)
+                    if temp_metadata is not None:
+                        block_metadata.append(temp_metadata)
+                        counts.append(len(peaks))
+                        values.frombytes(peaks.tobytes())
+
+        peaks = np.frombuffer(values, dtype=np.float64).reshape(-1, 2)
+        # sort the peaks of each block by mz (lexsort is stable, so peaks with 
+        # the same mz stay in file order, the same as sorting them in Spectrum)
+        block_index = np.repeat(np.arange(len(counts)), counts)
+        peaks = peaks[np.lexsort((peaks[:, 0], block_index))]
+        return block_metadata, counts, peaks
+
+    def _range_boundaries(self, input_file, num_ranges):
+        # split an MGF file into (up to) num_ranges byte ranges of about the same size,
+        # each of them ending just after an END IONS line. returns the list of the 
+        # range boundaries, starting with 0 and ending with the size of the file
+        size = os.path.getsize(input_file)
+        boundaries = [0]
+        with open(input_file, 'rb') as f:
+            for i in range(1, num_ranges):
+                # go to the start of the first line after the split point, and 
+                # then to the end of the next END IONS line
+                f.seek(max(size * i // num_ranges, boundaries[-1] + 1) - 1)
+                f.readline()
+                while True:
+                    line = f.readline()
+                    if not line or line.rstrip() == b"END IONS":
+                        break
+                boundary = f.tell()
+                if boundary >= size:
+                    break
+                boundaries.append(boundary)
+        boundaries.append(size)
+        return boundaries
+
+    def load_spectra_arrays(self, input_file, processes=1):
+        """
+        Parse the spectra in an MGF file like load_spectra does, but without creating
+        a Python object for every fragment peak: the file is read in chunks and the
+        peaks of each block are streamed into a single buffer.
+
+        With processes > 1, large files are split into that many byte ranges at block
+        boundaries, which are parsed in parallel on a pool of worker processes. The
+        results are always exactly the same as when parsing in a single process.
+
+        Returns (ms1, metadata, peaks, offsets), where ms1 and metadata are as for
+        load_spectra_index, peaks is a (num_peaks x 2) array of the (mz, intensity)
+        values of all the fragment peaks, and the peaks of ms1[i] are the rows 
+        offsets[i]:offsets[i + 1] of it (sorted by mz). The intensity filtering and
+        peaklist options are not supported.
+        """
+        if self.min_ms1_intensity > 0.0 or self.min_ms2_intensity > 0.0 or self.peaklist:
+            raise Exception('load_spectra_arrays does not support intensity filtering or peaklists')
+
+        num_ranges = max(1, min(processes, os.path.getsize(input_file) // MGF_MIN_RANGE_SIZE))
+        boundaries = self._range_boundaries(input_file, num_ranges)
+        starts, ends = boundaries[:-1], boundaries[1:]
+        if len(starts) > 1:
+            with ProcessPoolExecutor(len(starts)) as pool:
+                results = list(pool.map(self._parse_range, [input_file] * len(starts), starts, ends))
+        else:
+            results = [self._parse_range(input_file, starts[0], ends[0])]
+
+        # the MS1 objects are created here so that their IDs (and default names) 
+        # are numbered through the whole file
+        ms1 = []
+        counts = []
+        metadata = {}
+        ms1_id = 0
+        file_name = os.path.basename(input_file)
+        for block_metadata, block_counts, _ in results:
+            for temp_metadata, count in zip(block_metadata, block_counts):
+                new_ms1 = self._new_ms1(temp_metadata, ms1_id, file_name, metadata)
+                ms1_id += 1
+                # as in load_spectra, blocks with no (non-zero intensity) peaks 
+                # don't produce a spectrum
+                if count > 0:
+                    ms1.append(new_ms1)
+                    counts.append(count)
+
+        peaks = results[0][2] if len(results) == 1 else np.concatenate([peaks for _, _, peaks in results])
+        offsets = np.zeros(len(ms1) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        metadata = self.process_metadata(ms1, metadata)
+        return ms1, metadata, peaks, offsets
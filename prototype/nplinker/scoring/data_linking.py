@@ -6,44 +6,97 @@
 # Naming:
 # M_*   stands for a matrix format
 # map_* stands for a simple mapping lookup table
+# csr_* stands for an OccurrenceCSR (object -> strain indices)
 # spec  stands for spectrum
 # fam   stands for molecular family
 
 # import packages
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from collections import Counter
 import pandas as pd
-from scipy.stats import hypergeom
-
-# import packages for plotting
-# TODO move plotting to separate module?
-try:
-    from matplotlib import pyplot as plt
-    import seaborn as sns
-except ImportError:
-    print('Warning: plotting functionality will not be available (missing matplotlib and/or seaborn)')
 
 from ..genomics import GCF
 from ..metabolomics import Spectrum
 from ..metabolomics import MolecularFamily
 
-from .data_linking_functions import calc_correlation_matrix, calc_likelihood_matrix
+from .data_linking_functions import calc_correlation_matrix, calc_likelihood_matrix, LIKELIHOOD_MATRICES
+from .data_linking_functions import calc_cooccurrence_matrix, ContingencyTable
+from .data_linking_functions import metcalf_expected_variance, select_rows, top_k_by_group, count_dtype
+from .data_linking_functions import hypergeom_sf_lookup, permutation_null_counts
+from .data_linking_functions import PackedStrainMatrix, pack_strain_matrix, unpack_strain_words, OccurrenceCSR
 from .data_linking_functions import pair_prob, pair_prob_hg, link_prob, pair_prob_approx
+from .data_linking_functions import pair_prob_hg_batch, pair_prob_approx_batch, link_prob_batch
+
+SCORING_METHODS = ['metcalf', 'likescore', 'hg', 'metcalf_std']
 
-SCORING_METHODS = ['metcalf', 'likescore', 'hg']
+# default weights for metcalf scoring, in order:
+# - both, type1 not gcf, gcf not type1, neither
+METCALF_WEIGHTS = (10, -10, 0, 1)
 
 from ..logconfig import LogConfig
 logger = LogConfig.getLogger(__file__)
 
+def _concat_rows(M_a, M_b):
+    # append the rows of occurrence matrix M_b (dense or packed) to those of M_a
+    if isinstance(M_a, PackedStrainMatrix):
+        return PackedStrainMatrix(np.concatenate([M_a.words, M_b.words]), M_a.num_strains)
+    return np.concatenate([M_a, M_b])
+
+def _select_block(M_type_cond, rows, cols):
+    # return the given rows and columns of an occurrence matrix (dense or packed) as a dense array
+    if isinstance(M_type_cond, PackedStrainMatrix):
+        return M_type_cond[rows][:, cols]
+    return M_type_cond[np.ix_(rows, cols)]
+
+def _concat_csr(csr_a, csr_b):
+    # append the rows of csr_b to those of csr_a
+    indptr = np.r_[csr_a.indptr, csr_b.indptr[1:] + csr_a.indptr[-1]]
+    return OccurrenceCSR(indptr, np.r_[csr_a.indices, csr_b.indices], csr_a.num_strains)
+
+def _merge_csr(csr_a, csr_b, offset):
+    # combine the strains of each row of csr_a with those of the same row in csr_b,
+    # where the strain indices of csr_b are shifted by offset (i.e. appended columns)
+    rows = np.r_[csr_a.row_ids(), csr_b.row_ids()]
+    indices = np.r_[csr_a.indices, csr_b.indices + offset]
+    order = np.lexsort((indices, rows))
+    indptr = np.zeros(len(csr_a) + 1, dtype=np.int64)
+    np.cumsum(csr_a.counts() + csr_b.counts(), out=indptr[1:])
+    return OccurrenceCSR(indptr, indices[order], csr_a.num_strains + csr_b.num_strains)
+
+# occurrence matrices etc used by permutation test worker processes (see 
+# LinkFinder.permutation_null), sent once per process instead of once per task
+_permutation_args = None
+
+def _init_permutation_worker(*args):
+    global _permutation_args
+    _permutation_args = args
+
+def _permutation_worker(seeds):
+    M_type1_cond, M_gcf_cond, method, weights, greater = _permutation_args
+    return permutation_null_counts(M_type1_cond, M_gcf_cond, seeds, method, weights, greater)
+
 class DataLinks(object):
     """ 
     DataLinks collects and structures co-occurence data
     1) Co-occurences of spectra, families, and GCFs with respect to strains
     2) Mappings: Lookup-tables that link different ids and categories
     3) Correlation matrices that show how often spectra/families and GCFs co-occur
+
+    If packed=True, the co-occurence matrices (M_gcf_strain, M_spec_strain and
+    M_fam_strain) are stored as bit-packed PackedStrainMatrix objects instead of
+    dense float arrays (1 bit per cell instead of 8 bytes).
+
+    The correlation matrices (M_spec_gcf, M_spec_notgcf, ...) hold strain counts
+    as the smallest signed integer type that can store the number of strains 
+    (see count_dtype), not as floats. Convert them to a wider type first if you
+    need to combine them into values outside that range.
     """
 
-    def __init__(self):
+    def __init__(self, packed=False):
+        self.packed = packed
+
         # matrices that store co-occurences with respect to strains
         # values = 1 where gcf/spec/fam occur in strain
         # values = 0 where gcf/spec/fam do not occur in strain
@@ -51,6 +104,12 @@ class DataLinks(object):
         self.M_spec_strain = []
         self.M_fam_strain = []
 
+        # the same occurrences as OccurrenceCSR objects (strain indices per gcf/spectrum),
+        # and the lookup from strain IDs/aliases to strain index used to build them
+        self.strain_index = {}
+        self.csr_gcf_strain = None
+        self.csr_spec_strain = None
+
         # mappings (lookup lists to map between different ids and categories
         self.mapping_spec = pd.DataFrame()
         self.mapping_gcf = pd.DataFrame()
@@ -86,8 +145,23 @@ class DataLinks(object):
         self.matrix_strain_gcf(gcf_list, strain_list)
         self.matrix_strain_spec(spectra, strain_list)
 
+    def update_genomics(self, gcf_list, strain_list):
+        """
+        Replace the GCFs, keeping everything derived from the spectra/families
+        (which must have been loaded with the same strain list) and recomputing
+        only the GCF-dependent mappings and correlation matrices
+        """
+        logger.debug("Update mappings and co-occurence matrices for gcfs.")
+        self.mapping_gcf = pd.DataFrame()
+        self.collect_mappings_gcf(gcf_list)
+        self.matrix_strain_gcf(gcf_list, strain_list)
+        self.correlation_matrices(type='spec-gcf')
+        if len(self.M_fam_strain) > 0:
+            self.correlation_matrices(type='fam-gcf')
+
     def find_correlations(self, include_singletons=False):
         # collect correlations/ co-occurences
+        self.include_singletons = include_singletons
         logger.debug("Create correlation matrices: spectra<->gcfs.")
         self.correlation_matrices(type='spec-gcf')
         logger.debug("Create correlation matrices: mol-families<->gcfs.")
@@ -95,6 +169,188 @@ class DataLinks(object):
         self.correlation_matrices(type='fam-gcf')
 
 
+    # Incremental updates
+    #
+    # The add_* methods extend an existing DataLinks object (load_data and 
+    # find_correlations must have been called) with new spectra, GCFs or strains.
+    # Only the new rows/columns of the co-occurence matrices are computed, and the
+    # correlation matrices are updated from the co-occurence counts of the affected
+    # blocks. New spectra/GCFs must have IDs following on from the existing ones 
+    # (their IDs are used as row/column indices), new strains are appended after 
+    # the existing ones. 
+    #
+    # Each method returns a dict describing the changes to the correlation matrices
+    # for each type ('spec-gcf', and 'fam-gcf' if the families have been found), 
+    # which can be passed to LinkFinder.update_scores to update the scores in the 
+    # same way. The values are (row_map, col_map) tuples where row_map[i] is the 
+    # old row index of row i (or -1 if it is new or has changed), and similarly for
+    # the columns. A value of None means all the counts have changed. 
+
+    def add_spectra(self, spectra):
+        """
+        Add new spectra (and any new molecular families they belong to)
+        """
+        num_old = self.M_spec_strain.shape[0]
+        new_links = DataLinks()
+        new_links.collect_mappings_spec(spectra)
+        new_links.mapping_spec["spec-id"] += num_old
+        csr = self.strain_indices(spectra)
+        new_links.mapping_spec["no of strains"] = csr.counts().astype(np.float64)
+
+        self.mapping_spec = pd.concat([self.mapping_spec, new_links.mapping_spec], ignore_index=True)
+        self.mapping_strain["no of spectra"] += np.bincount(csr.indices, minlength=len(self.strain_index))
+        self.csr_spec_strain = _concat_csr(self.csr_spec_strain, csr)
+        self.M_spec_strain = _concat_rows(self.M_spec_strain, self._store_occurrences(csr))
+
+        row_map = np.r_[np.arange(num_old), -np.ones(len(spectra), dtype=np.int64)]
+        col_map = np.arange(self.M_gcf_strain.shape[0])
+        self._update_correlations('spec-gcf', row_map, col_map)
+        changes = {'spec-gcf': (row_map, col_map)}
+        if self._has_families():
+            changes['fam-gcf'] = self._update_families()
+        return changes
+
+    def add_gcfs(self, gcf_list):
+        """
+        Add new GCFs
+        """
+        num_old = self.M_gcf_strain.shape[0]
+        new_links = DataLinks()
+        new_links.collect_mappings_gcf(gcf_list)
+        new_links.mapping_gcf["gcf-id"] += num_old
+        csr = self.strain_indices(gcf_list)
+        new_links.mapping_gcf["no of strains"] = csr.counts().astype(np.float64)
+
+        self.mapping_gcf = pd.concat([self.mapping_gcf, new_links.mapping_gcf], ignore_index=True)
+        self.mapping_strain["no of gcfs"] += np.bincount(csr.indices, minlength=len(self.strain_index))
+        self.csr_gcf_strain = _concat_csr(self.csr_gcf_strain, csr)
+        self.M_gcf_strain = _concat_rows(self.M_gcf_strain, self._store_occurrences(csr))
+
+        col_map = np.r_[np.arange(num_old), -np.ones(len(gcf_list), dtype=np.int64)]
+        changes = {}
+        types = [('spec-gcf', self.M_spec_strain)]
+        if self._has_families():
+            types.append(('fam-gcf', self.M_fam_strain))
+        for type_, M_type1_strain in types:
+            row_map = np.arange(M_type1_strain.shape[0])
+            self._update_correlations(type_, row_map, col_map)
+            changes[type_] = (row_map, col_map)
+        return changes
+
+    def add_strains(self, strain_list, spectra, gcf_list):
+        """
+        Add new strains (strain_list should contain only the new strains). spectra
+        and gcf_list are all the spectra and GCFs, some of which may now include the new
+        strains. Existing spectra/GCFs must not have changed otherwise.
+        """
+        num_old = len(self.strain_index)
+        for i, strain in enumerate(strain_list):
+            self.strain_index[strain.id] = num_old + i
+        num_strains = len(self.strain_index)
+        new_strains = np.arange(num_old, num_strains)
+
+        # only the objects which occur in the new strains need to be updated
+        new_links = DataLinks()
+        new_links.strain_index = {strain.id: i for i, strain in enumerate(strain_list)}
+        csr_spec = new_links.strain_indices(spectra)
+        csr_gcf = new_links.strain_indices(gcf_list)
+        
+        new_strain_mapping = pd.DataFrame()
+        new_strain_mapping["no of gcfs"] = np.bincount(csr_gcf.indices, minlength=len(strain_list)).astype(np.float64)
+        new_strain_mapping["no of spectra"] = np.bincount(csr_spec.indices, minlength=len(strain_list)).astype(np.float64)
+        new_strain_mapping["strain name"] = [str(s) for s in strain_list]
+        self.mapping_strain = pd.concat([self.mapping_strain, new_strain_mapping], ignore_index=True)
+        self.mapping_spec["no of strains"] += csr_spec.counts()
+        self.mapping_gcf["no of strains"] += csr_gcf.counts()
+
+        self.csr_spec_strain = _merge_csr(self.csr_spec_strain, csr_spec, num_old)
+        self.csr_gcf_strain = _merge_csr(self.csr_gcf_strain, csr_gcf, num_old)
+        self.M_spec_strain = self._store_occurrences(self.csr_spec_strain)
+        self.M_gcf_strain = self._store_occurrences(self.csr_gcf_strain)
+
+        # existing co-occurence counts only change by the counts for the new strains
+        row_map = np.arange(self.M_spec_strain.shape[0])
+        col_map = np.arange(self.M_gcf_strain.shape[0])
+        self._update_correlations('spec-gcf', row_map, col_map, new_strains)
+        changes = {'spec-gcf': None}
+        if self._has_families():
+            changes['fam-gcf'] = self._update_families(new_strains)
+        return changes
+
+    def _has_families(self):
+        # the family matrices only exist after find_correlations, until then
+        # there are no fam-gcf changes to make
+        return len(self.M_fam_strain) > 0
+
+    def _update_families(self, new_strains=None):
+        # recreate the family mapping and update the fam-gcf correlations for any 
+        # new families or families with a different set of strains
+        old_M_fam_strain = self.M_fam_strain
+        old_labels = list(self.mapping_fam["original family id"])
+        self.mapping_fam = pd.DataFrame()
+        self.data_family_mapping(include_singletons=getattr(self, 'include_singletons', False))
+        new_labels = list(self.mapping_fam["original family id"])
+
+        # families are matched up by their ID (singletons are always recalculated)
+        old_rows = {label: i for i, label in enumerate(old_labels) if label != -1}
+        row_map = np.array([old_rows.get(label, -1) for label in new_labels], dtype=np.int64)
+        kept = np.flatnonzero(row_map >= 0)
+        if len(kept) > 0:
+            num_old_strains = old_M_fam_strain.shape[1]
+            unchanged = np.all(np.asarray(self.M_fam_strain[kept])[:, :num_old_strains] 
+                               == np.asarray(old_M_fam_strain[row_map[kept]]), axis=1)
+            row_map[kept[~unchanged]] = -1
+
+        col_map = np.arange(self.M_gcf_strain.shape[0])
+        self._update_correlations('fam-gcf', row_map, col_map, new_strains)
+        return None if new_strains is not None else (row_map, col_map)
+
+    def _get_correlations(self, type):
+        if type == 'spec-gcf':
+            return self.M_spec_strain, self.M_spec_gcf
+        elif type == 'fam-gcf':
+            return self.M_fam_strain, self.M_fam_gcf
+        raise Exception("Wrong correlation 'type' given. Must be one of 'spec-gcf', 'fam-gcf', ...")
+
+    def _update_correlations(self, type, row_map, col_map, new_strains=None):
+        # update the co-occurence counts using the old counts where possible:
+        # - rows/columns with a map value of -1 are recalculated completely
+        # - for the others, the old count is reused (plus the count for any new strains)
+        M_type1_strain, M_type1_gcf_old = self._get_correlations(type)
+        num_strains = M_type1_strain.shape[1]
+        M_type1_gcf = np.zeros((len(row_map), len(col_map)), dtype=count_dtype(num_strains))
+
+        kept_rows, new_rows = np.flatnonzero(row_map >= 0), np.flatnonzero(row_map < 0)
+        kept_cols, new_cols = np.flatnonzero(col_map >= 0), np.flatnonzero(col_map < 0)
+        if len(kept_rows) > 0 and len(kept_cols) > 0:
+            M_type1_gcf[np.ix_(kept_rows, kept_cols)] = M_type1_gcf_old[np.ix_(row_map[kept_rows], col_map[kept_cols])]
+            if new_strains is not None and len(new_strains) > 0:
+                M_type1_gcf[np.ix_(kept_rows, kept_cols)] += calc_cooccurrence_matrix(
+                    _select_block(M_type1_strain, kept_rows, new_strains),
+                    _select_block(self.M_gcf_strain, kept_cols, new_strains)).astype(M_type1_gcf.dtype)
+        if len(new_rows) > 0:
+            M_type1_gcf[new_rows, :] = calc_cooccurrence_matrix(select_rows(M_type1_strain, new_rows), self.M_gcf_strain)
+        if len(new_cols) > 0 and len(kept_rows) > 0:
+            M_type1_gcf[np.ix_(kept_rows, new_cols)] = calc_cooccurrence_matrix(select_rows(M_type1_strain, kept_rows), 
+                                                                                select_rows(self.M_gcf_strain, new_cols))
+
+        dtype = M_type1_gcf.dtype
+        table = ContingencyTable(M_type1_gcf,
+                                 np.asarray(M_type1_strain.sum(axis=1)).astype(dtype),
+                                 np.asarray(self.M_gcf_strain.sum(axis=1)).astype(dtype),
+                                 num_strains)
+        M_type1_gcf, M_type1_notgcf, M_nottype1_gcf, M_nottype1_notgcf = table
+        if type == 'spec-gcf':
+            self.M_spec_gcf = M_type1_gcf
+            self.M_spec_notgcf = M_type1_notgcf
+            self.M_notspec_gcf = M_nottype1_gcf
+            self.M_notspec_notgcf = M_nottype1_notgcf
+        else:
+            self.M_fam_gcf = M_type1_gcf
+            self.M_fam_notgcf = M_type1_notgcf
+            self.M_notfam_gcf = M_nottype1_gcf
+            self.M_notfam_notgcf = M_nottype1_notgcf
+
     def collect_mappings_spec(self, spectra):
         # Collect most import mapping tables from input data
         mapping_spec = np.zeros((len(spectra),3))
@@ -155,87 +411,150 @@ class DataLinks(object):
         self.mapping_gcf["bgc class score"] = bigscape_guessscore
 
 
-    def matrix_strain_gcf(self, gcf_list, strain_list):
-        # Collect co-ocurences in M_spec_strain matrix
-        M_gcf_strain = np.zeros((len(gcf_list), len(strain_list)))
+    def collect_strain_index(self, strain_list):
+        """
+        Assign each strain an integer index (its position in strain_list).
 
-        for i, strain  in enumerate(strain_list):
-            for m, gcf in enumerate(gcf_list):
-                if gcf.has_strain(strain):
-                    M_gcf_strain[m,i] = 1
+        The lookup maps the ID of every strain to its index. Membership tests on
+        a StrainCollection also match aliases, so the strains of each object are 
+        resolved through their IDs and aliases (see strain_indices).
+        """
+        self.strain_index = {strain.id: i for i, strain in enumerate(strain_list)}
+        return self.strain_index
+
+    def content_hashes(self, spectra, gcf_list, strain_list):
+        """
+        Return hashes identifying the content of the data used to build the
+        co-occurence matrices, as a dict with keys:
+            'strains': the strain list (IDs and aliases, in order)
+            'metabolomics': the spectrum -> strain mapping and spectrum families
+            'genomics': the GCF -> strain mapping and GCF classes
+        If only the 'genomics' hash changes, the existing spectra/family matrices
+        can be reused (see update_genomics).
+        """
+        strains_hash = hashlib.sha1()
+        for strain in strain_list:
+            strains_hash.update(strain.id.encode('utf-8'))
+            strains_hash.update(','.join(sorted(strain.aliases)).encode('utf-8'))
+            strains_hash.update(b'\n')
+
+        self.collect_strain_index(strain_list)
+        mappings = DataLinks()
+        mappings.collect_mappings_spec(spectra)
+        mappings.collect_mappings_gcf(gcf_list)
+
+        metabolomics_hash = hashlib.sha1()
+        csr = self.strain_indices(spectra)
+        metabolomics_hash.update(csr.indptr.tobytes())
+        metabolomics_hash.update(csr.indices.tobytes())
+        metabolomics_hash.update(np.ascontiguousarray(mappings.mapping_spec.values, dtype=np.float64).tobytes())
+
+        genomics_hash = hashlib.sha1()
+        csr = self.strain_indices(gcf_list)
+        genomics_hash.update(csr.indptr.tobytes())
+        genomics_hash.update(csr.indices.tobytes())
+        genomics_hash.update(str(mappings.mapping_gcf.values.tolist()).encode('utf-8'))
+
+        return {'strains': strains_hash.hexdigest(),
+                'metabolomics': metabolomics_hash.hexdigest(),
+                'genomics': genomics_hash.hexdigest()}
+
+    def strain_indices(self, objects):
+        """
+        Return an OccurrenceCSR with the strain indices of each object (GCF/Spectrum),
+        equivalent to calling obj.has_strain(strain) for every strain in the strain list
+        """
+        strain_index = self.strain_index
+        index_lists = []
+        for obj in objects:
+            ids = []
+            for strain in obj.strains:
+                ids.append(strain.id)
+                ids.extend(strain.aliases)
+            index_lists.append([strain_index[x] for x in ids if x in strain_index])
+        return OccurrenceCSR.from_lists(index_lists, len(strain_index))
+
+    def matrix_strain_gcf(self, gcf_list, strain_list):
+        # Collect co-ocurences in M_gcf_strain matrix
+        self.collect_strain_index(strain_list)
+        self.csr_gcf_strain = self.strain_indices(gcf_list)
+        self.M_gcf_strain = self._store_occurrences(self.csr_gcf_strain)
 
-        self.M_gcf_strain = M_gcf_strain
         # extend mapping tables:
-        self.mapping_gcf["no of strains"] =  np.sum(self.M_gcf_strain, axis=1)
-        self.mapping_strain["no of gcfs"] =  np.sum(self.M_gcf_strain, axis=0)
+        self.mapping_gcf["no of strains"] = self.csr_gcf_strain.counts().astype(np.float64)
+        self.mapping_strain["no of gcfs"] = np.bincount(self.csr_gcf_strain.indices, minlength=len(strain_list)).astype(np.float64)
 
     def matrix_strain_spec(self, spectra, strain_list):
-        # Collect co-ocurences in M_strains_specs matrix
-
-        M_spec_strain = np.zeros((len(spectra), len(strain_list)))
-        for i, spectrum in enumerate(spectra):
-            for j, s in enumerate(strain_list):
-                if spectrum.has_strain(s):
-                    M_spec_strain[i,j] = 1
-        self.M_spec_strain = M_spec_strain
+        # Collect co-ocurences in M_spec_strain matrix
+        self.collect_strain_index(strain_list)
+        self.csr_spec_strain = self.strain_indices(spectra)
+        self.M_spec_strain = self._store_occurrences(self.csr_spec_strain)
 
         # extend mapping tables:
-        self.mapping_spec["no of strains"] =  np.sum(self.M_spec_strain, axis=1)
-        self.mapping_strain["no of spectra"] =  np.sum(self.M_spec_strain, axis=0)
+        self.mapping_spec["no of strains"] = self.csr_spec_strain.counts().astype(np.float64)
+        self.mapping_strain["no of spectra"] = np.bincount(self.csr_spec_strain.indices, minlength=len(strain_list)).astype(np.float64)
         self.mapping_strain["strain name"] = [str(s) for s in strain_list]
 
+    def _occurrence_dtype(self):
+        # dtype used while building the co-occurence matrices
+        return bool if self.packed else np.float64
+
+    def _store_occurrences(self, M_type_strain):
+        # convert a freshly built co-occurence matrix (dense or OccurrenceCSR) 
+        # to the configured storage format
+        if isinstance(M_type_strain, OccurrenceCSR):
+            if self.packed:
+                return M_type_strain.to_packed()
+            return M_type_strain.to_dense(self._occurrence_dtype())
+
+        if self.packed:
+            return pack_strain_matrix(M_type_strain)
+        return M_type_strain
+
     def data_family_mapping(self, include_singletons=False):
         # Create M_fam_strain matrix that gives co-occurences between mol. families and strains
         # matrix dimensions are: number of families  x  number of strains
+        #
+        # rows are the families (except singletons) in order of their family id, followed
+        # by one row for each singleton spectrum (family id -1) if include_singletons is set
+        
+        fam_ids = np.asarray(self.mapping_spec["fam-id"], dtype=np.int64)
 
-        family_ids = np.unique(self.mapping_spec["fam-id"]) # get unique family ids
+        # sort the (non-singleton) spectra by family, so the members of each family
+        # are contiguous and the family rows can be built in one go with reduceat
+        family_spectra = np.flatnonzero(fam_ids != -1)
+        family_spectra = family_spectra[np.argsort(fam_ids[family_spectra], kind='stable')]
+        sorted_ids = fam_ids[family_spectra]
+        starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]) if len(sorted_ids) > 0 else np.zeros(0, dtype=np.int64)
 
-        if include_singletons and np.where(self.mapping_spec["fam-id"] == -1)[0].shape[0] > 0:
-            num_of_singletons = np.where(self.mapping_spec["fam-id"] == -1)[0].shape[0]
-            num_unique_fams = num_of_singletons + len(family_ids) - 1
-        else:
-            num_of_singletons = 0
-            num_unique_fams = len(family_ids)
+        self.family_members = [(members, ) for members in np.split(family_spectra, starts[1:])] if len(starts) > 0 else []
+        strain_fam_labels = list(sorted_ids[starts])
 
-        M_fam_strain = np.zeros((num_unique_fams, self.M_spec_strain.shape[1]))
-        strain_fam_labels = []
-        strain_fam_index = []
-        
-        if num_of_singletons > 0:  # if singletons exist + included
-            M_fam_strain[(num_unique_fams-num_of_singletons):,
-                         :] = self.M_spec_strain[np.where(self.mapping_spec["fam-id"][:,0] == -1)[0],:]
+        singletons = np.flatnonzero(fam_ids == -1) if include_singletons else np.zeros(0, dtype=np.int64)
+        self.family_members.extend((np.array([x]), ) for x in singletons)
+        strain_fam_labels.extend([-1] * len(singletons))
 
-        # go through families (except singletons) and collect member strain occurences  
-        self.family_members = []
-        for i, fam_id in enumerate(family_ids[np.where(family_ids != -1)].astype(int)):
-            family_members = np.where(np.array(self.mapping_spec["fam-id"]) == fam_id)
-            self.family_members.append(family_members)
-            M_fam_strain[i,:] = np.sum(self.M_spec_strain[family_members,:], axis=1)
-            strain_fam_labels.append(fam_id)
-            strain_fam_index.append(i)
-
-        add_singleton_entries = -1 in family_ids
-        # TODO: i think this breaks stuff below due to mismatches in the number of rows
-        # in the dataframes and matrices if there are no -1 family ids. 
-        # discovered when trying to write some code to test scoring. is this ever
-        # likely to happen with a real dataset??
-        if add_singleton_entries:
-            strain_fam_labels.append([-1] * num_of_singletons)
-            strain_fam_index.append(i+1)
-        
         # only looking for co-occurence, hence only 1 or 0
-        M_fam_strain[M_fam_strain>1] = 1
+        if isinstance(self.M_spec_strain, PackedStrainMatrix):
+            num_strains = self.M_spec_strain.num_strains
+            words = self.M_spec_strain.words
+            fam_words = np.zeros((len(starts), words.shape[1]), dtype=words.dtype)
+            if len(starts) > 0:
+                fam_words = np.bitwise_or.reduceat(words[family_spectra], starts, axis=0)
+            M_fam_strain = PackedStrainMatrix(np.concatenate([fam_words, words[singletons]]), num_strains)
+        else:
+            M_spec_strain = np.asarray(self.M_spec_strain) != 0
+            M_fam_strain = np.zeros((len(starts), M_spec_strain.shape[1]), dtype=bool)
+            if len(starts) > 0:
+                M_fam_strain = np.logical_or.reduceat(M_spec_strain[family_spectra], starts, axis=0)
+            M_fam_strain = np.concatenate([M_fam_strain, M_spec_strain[singletons]]).astype(self._occurrence_dtype())
 
         self.M_fam_strain = M_fam_strain
         # extend mapping table:
-        self.mapping_fam["family id"] = strain_fam_index
+        self.mapping_fam["family id"] = np.arange(len(strain_fam_labels))
         self.mapping_fam["original family id"] = strain_fam_labels
         self.mapping_fam["no of strains"] =  np.sum(self.M_fam_strain, axis=1)
-        num_members = [x[0].shape[0] for x in self.family_members]
-        # see above
-        if add_singleton_entries:
-            num_members.append(num_of_singletons)
-        self.mapping_fam["no of members"] = num_members
+        self.mapping_fam["no of members"] = [x[0].shape[0] for x in self.family_members]
         return self.family_members
 
     def common_strains(self, objects_a, objects_b, filter_no_shared=False):
@@ -274,31 +593,87 @@ class DataLinks(object):
         if not is_list_b:
             objects_b = [objects_b]
 
-        # retrieve object IDs
-        ids_b = [gcf.id for gcf in objects_b]
-        ids_a = []
-        if type_a == Spectrum:
-            ids_a = [spec.id for spec in objects_a]
-        else:
-            # TODO similar treatment to Spectrum/GCF?
-            mapping_fam_id = self.mapping_fam["original family id"]
-            for fam in objects_a:
-                ids_a.append(np.where(mapping_fam_id == int(fam.family_id))[0][0])
-
-        data_a = self.M_spec_strain if type_a == Spectrum else self.M_fam_strain
-        data_b = self.M_gcf_strain
+        # calculate the shared strains of all pairs in one go
+        pairs = [(obj_a, obj_b) for obj_a in objects_a for obj_b in objects_b]
+        shared = self.shared_strains([a for a, b in pairs], [b for a, b in pairs])
 
         results = {}
-        for a, obj_a in enumerate(objects_a):
-            for b, obj_b in enumerate(objects_b):
-                # just AND both arrays and extract the indices with positive results
-                result = np.where(np.logical_and(data_a[ids_a[a]], data_b[ids_b[b]]))[0]
-                # if we want to exclude results with no shared strains
-                if (filter_no_shared and len(result) > 0) or not filter_no_shared:
-                    results[(obj_a, obj_b)] = result
+        for i, pair in enumerate(pairs):
+            result = shared.row(i)
+            # if we want to exclude results with no shared strains
+            if (filter_no_shared and len(result) > 0) or not filter_no_shared:
+                results[pair] = result
 
         return results
 
+    def type1_rows(self, objects):
+        """
+        Return the rows of M_spec_strain and M_fam_strain for a list of Spectrum/
+        MolecularFamily objects, as two arrays (-1 where an object isn't in that
+        matrix). Singleton families aren't necessarily in M_fam_strain, but have
+        the same strains as their spectrum, so their spectrum row is used instead.
+        """
+        spec_rows = np.full(len(objects), -1, dtype=np.int64)
+        fam_rows = np.full(len(objects), -1, dtype=np.int64)
+        fam_lookup = None
+        for i, obj in enumerate(objects):
+            if isinstance(obj, Spectrum):
+                spec_rows[i] = obj.id
+            elif int(obj.family_id) == -1:
+                if len(obj.spectra) == 1:
+                    spec_rows[i] = obj.spectra[0].id
+            else:
+                if fam_lookup is None:
+                    fam_lookup = {int(label): row for row, label in enumerate(self.mapping_fam["original family id"]) if label != -1}
+                fam_rows[i] = fam_lookup.get(int(obj.family_id), -1)
+        return spec_rows, fam_rows
+
+    def shared_strains(self, objects_a, objects_b, block_size=4096):
+        """
+        Find the strains shared by each pair of objects (objects_a[i], objects_b[i]), 
+        where objects_a are Spectrum/MolecularFamily objects and objects_b are GCFs.
+
+        Returns an OccurrenceCSR with one row per pair, containing the indices of 
+        the shared strains (which can be looked up in NPLinker.strains).
+        """
+        spec_rows, fam_rows = self.type1_rows(objects_a)
+        gcf_rows = np.array([gcf.id for gcf in objects_b], dtype=np.int64)
+        return self.shared_strain_rows(spec_rows, fam_rows, gcf_rows, block_size)
+
+    def shared_strain_rows(self, spec_rows, fam_rows, gcf_rows, block_size=4096):
+        """
+        Same as shared_strains, but for pairs given by row indices: pair i is 
+        either (M_spec_strain row spec_rows[i], M_gcf_strain row gcf_rows[i]) or 
+        (M_fam_strain row fam_rows[i], M_gcf_strain row gcf_rows[i]), whichever of
+        spec_rows[i] and fam_rows[i] is not -1. Pairs with neither have no shared strains.
+
+        The pairs are processed in blocks of block_size, intersecting the rows of
+        the occurrence matrices (the packed words if possible) for a whole block at 
+        once.
+        """
+        num_strains = self.M_gcf_strain.shape[1]
+
+        pair_ids, strain_ids = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        for M_type1_strain, rows in ((self.M_spec_strain, spec_rows), (self.M_fam_strain, fam_rows)):
+            pairs = np.flatnonzero(rows >= 0)
+            for start in range(0, len(pairs), block_size):
+                block = pairs[start:start + block_size]
+                if isinstance(M_type1_strain, PackedStrainMatrix) and isinstance(self.M_gcf_strain, PackedStrainMatrix):
+                    # AND the packed words directly, only unpacking the result
+                    shared = unpack_strain_words(M_type1_strain.words[rows[block]] & self.M_gcf_strain.words[gcf_rows[block]], num_strains)
+                else:
+                    shared = (M_type1_strain[rows[block]] != 0) & (self.M_gcf_strain[gcf_rows[block]] != 0)
+                block_pairs, block_strains = np.nonzero(shared)
+                pair_ids.append(block[block_pairs])
+                strain_ids.append(block_strains)
+
+        pair_ids = np.concatenate(pair_ids)
+        strain_ids = np.concatenate(strain_ids)
+        order = np.lexsort((strain_ids, pair_ids))
+        indptr = np.zeros(len(gcf_rows) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pair_ids, minlength=len(gcf_rows)), out=indptr[1:])
+        return OccurrenceCSR(indptr, strain_ids[order], num_strains)
+
     def correlation_matrices(self, type='spec-gcf'):
         """
         Collect co-occurrences accros strains:
@@ -369,7 +744,20 @@ class LinkLikelihood(object):
         self.P_gcf_not_fam = []
 
 
-    def calculate_likelihoods(self, data_links, type='spec-gcf'):
+    # names of the likelihood matrices for each type, in the order returned by 
+    # calc_likelihood_matrix (see LIKELIHOOD_MATRICES)
+    MATRIX_NAMES = {
+        'spec-gcf': ('P_gcf_given_spec', 'P_gcf_not_spec', 'P_spec_given_gcf', 'P_spec_not_gcf'),
+        'fam-gcf': ('P_gcf_given_fam', 'P_gcf_not_fam', 'P_fam_given_gcf', 'P_fam_not_gcf'),
+    }
+
+    # the matrices used by LinkFinder.likelihood_scoring
+    SCORING_MATRICES = {
+        'spec-gcf': ('P_gcf_given_spec', 'P_spec_not_gcf'),
+        'fam-gcf': ('P_gcf_given_fam', 'P_fam_not_gcf'),
+    }
+
+    def calculate_likelihoods(self, data_links, type='spec-gcf', matrices=None):
         """
         Calulate likelihoods from empirically found co-occurences in data
         
@@ -379,6 +767,10 @@ class LinkLikelihood(object):
         IF type='fam-gcf':
         P(GCF_x | fam_y), P(fam_y | GCF_x),
         P(GCF_x | not fam_y), P(fam_y | not GCF_x)
+
+        matrices can be used to only calculate some of these, e.g. 
+        matrices=LinkLikelihood.SCORING_MATRICES[type] gives just the ones needed
+        for likelihood scoring. The others are left unchanged.
         """
 
         # Make selection for scenario spec<->gcf or fam<->gcf
@@ -397,26 +789,70 @@ class LinkLikelihood(object):
         else:
             raise Exception("Wrong correlation 'type' given. Must be one of 'spec-gcf', 'fam-gcf'...")
 
-        logger.debug("Calculating likelihood matrices of type: {}".format(type))
+        names = self.MATRIX_NAMES[type]
+        if matrices is None:
+            matrices = names
+        for name in matrices:
+            if name not in names:
+                raise Exception('Unknown likelihood matrix "{}" for type {}'.format(name, type))
+        outputs = [generic for generic, name in zip(LIKELIHOOD_MATRICES, names) if name in matrices]
+
+        logger.debug("Calculating likelihood matrices of type: {} ({})".format(type, ', '.join(matrices)))
         # Calculate likelihood matrices using calc_likelihood_matrix()
-        P_type2_given_type1, P_type2_not_type1, P_type1_given_type2, \
-            P_type1_not_type2 = calc_likelihood_matrix(M_type1_cond,
-                                                                              data_links.M_gcf_strain,
-                                                                              M_type1_type2,
-                                                                              M_type1_nottype2,
-                                                                              M_nottype1_type2)
-        if type == 'spec-gcf':
-            self.P_gcf_given_spec = P_type2_given_type1
-            self.P_gcf_not_spec = P_type2_not_type1
-            self.P_spec_given_gcf = P_type1_given_type2
-            self.P_spec_not_gcf = P_type1_not_type2
-        elif type == 'fam-gcf':
-            self.P_gcf_given_fam = P_type2_given_type1
-            self.P_gcf_not_fam = P_type2_not_type1
-            self.P_fam_given_gcf = P_type1_given_type2
-            self.P_fam_not_gcf = P_type1_not_type2
-        else:
-            raise Exception("No correct likelihood matrices were created.")
+        results = calc_likelihood_matrix(M_type1_cond,
+                                         data_links.M_gcf_strain,
+                                         M_type1_type2,
+                                         M_type1_nottype2,
+                                         M_nottype1_type2,
+                                         outputs=outputs)
+        for name, P in zip(names, results):
+            if P is not None:
+                setattr(self, name, P)
+
+
+class PermutationNull(object):
+    """
+    Summary of the scores found for all links when strain labels are randomly 
+    permuted (see LinkFinder.permutation_null). Rows are spectra/families, 
+    columns are GCFs, as in the score matrices.
+    """
+
+    def __init__(self, exceed, extremes, method, greater):
+        # exceed[x, y]: number of permutations scoring link (x, y) at least as 
+        # extreme as the real score
+        self.exceed = exceed
+        # extremes[i, y]: highest (lowest if not greater) score of GCF y in permutation i
+        self.extremes = extremes
+        self.method = method
+        self.greater = greater
+
+    @property
+    def num_permutations(self):
+        return self.extremes.shape[0]
+
+    def p_values(self):
+        """
+        Empirical p-values for all links: (exceed + 1) / (num_permutations + 1)
+        """
+        return (self.exceed + 1.0) / (self.num_permutations + 1)
+
+    def gcf_thresholds(self, p_threshold=0.95):
+        """
+        Per-GCF score thresholds: the p_threshold percentile of the best random 
+        score per GCF (the lower percentile if low scores are significant)
+        """
+        q = p_threshold if self.greater else 1 - p_threshold
+        return np.percentile(self.extremes, 100 * q, axis=0)
+
+    def significant_links(self, scores, p_threshold=0.95):
+        """
+        Return a 0/1 matrix of the links in scores which pass the GCF threshold 
+        (like process_output.get_sig_links)
+        """
+        thresholds = self.gcf_thresholds(p_threshold)[None, :]
+        if self.greater:
+            return (scores >= thresholds).astype(np.float64)
+        return (scores <= thresholds).astype(np.float64)
 
 
 class LinkFinder(object):
@@ -430,6 +866,9 @@ class LinkFinder(object):
     3) Create output plots and tables
     """
 
+    # number of candidates processed at a time in select_link_candidates
+    CANDIDATE_BLOCK_SIZE = 4096
+
     def __init__(self):
         """
         Create tables of prospective link candidates.
@@ -441,6 +880,10 @@ class LinkFinder(object):
         self.metcalf_spec_gcf = []
         self.metcalf_fam_gcf = []
 
+        # standardised metcalf scores (optional, see standardised_metcalf_scoring)
+        self.metcalf_std_spec_gcf = []
+        self.metcalf_std_fam_gcf = []
+
         # likelihood scores
         self.likescores_spec_gcf = []
         self.likescores_fam_gcf = []
@@ -454,6 +897,7 @@ class LinkFinder(object):
         self.link_candidates_gcf_fam = []
 
         # metcalf caching
+        self.metcalf_weights = METCALF_WEIGHTS
         self.metcalf_expected = None
         self.metcalf_variance = None
 
@@ -473,9 +917,97 @@ class LinkFinder(object):
                 return self.hg_spec_gcf
             elif type_ == 'fam-gcf':
                 return self.hg_fam_gcf
+        elif method == 'metcalf_std':
+            if type_ == 'spec-gcf':
+                return self.metcalf_std_spec_gcf
+            elif type_ == 'fam-gcf':
+                return self.metcalf_std_fam_gcf
 
         raise Exception('Unknown method or type (method="{}", type="{}")'.format(method, type_))
 
+    def _set_scores(self, method, type_, scores):
+        if method == 'metcalf':
+            if type_ == 'spec-gcf':
+                self.metcalf_spec_gcf = scores
+            else:
+                self.metcalf_fam_gcf = scores
+        elif method == 'likescore':
+            if type_ == 'spec-gcf':
+                self.likescores_spec_gcf = scores
+            else:
+                self.likescores_fam_gcf = scores
+        elif method == 'hg':
+            if type_ == 'spec-gcf':
+                self.hg_spec_gcf = scores
+            else:
+                self.hg_fam_gcf = scores
+        elif method == 'metcalf_std':
+            if type_ == 'spec-gcf':
+                self.metcalf_std_spec_gcf = scores
+            else:
+                self.metcalf_std_fam_gcf = scores
+
+    def _scores_from_counts(self, data_links, method, type_, rows, cols):
+        # calculate scores for a block of the correlation matrices (elementwise, 
+        # the co-occurence counts in data_links must be up to date)
+        if type_ == 'spec-gcf':
+            counts = [data_links.M_spec_gcf, data_links.M_spec_notgcf, data_links.M_notspec_gcf, data_links.M_notspec_notgcf]
+        else:
+            counts = [data_links.M_fam_gcf, data_links.M_fam_notgcf, data_links.M_notfam_gcf, data_links.M_notfam_notgcf]
+        M_type1_gcf, M_type1_notgcf, M_nottype1_gcf, M_nottype1_notgcf = [M[np.ix_(rows, cols)].astype(np.float64) for M in counts]
+        num_strains = data_links.M_gcf_strain.shape[1]
+        type1_counts = (M_type1_gcf + M_type1_notgcf).astype(np.int64)
+        gcf_counts = (M_type1_gcf + M_nottype1_gcf).astype(np.int64)
+
+        if method == 'hg':
+            return hypergeom_sf_lookup(M_type1_gcf, num_strains, type1_counts, gcf_counts)
+
+        both, type1_not_gcf, gcf_not_type1, not_type1_not_gcf = self.metcalf_weights
+        scores = (M_type1_gcf * both + M_type1_notgcf * type1_not_gcf
+                  + M_nottype1_gcf * gcf_not_type1 + M_nottype1_notgcf * not_type1_not_gcf)
+        if method == 'metcalf_std':
+            scores = (scores - self.metcalf_expected[type1_counts, gcf_counts]) / self.metcalf_variance_sqrt[type1_counts, gcf_counts]
+        return scores
+
+    def update_scores(self, data_links, changes):
+        """
+        Update the metcalf, standardised metcalf and hg scores after adding objects
+        or strains to data_links, using the changes returned by DataLinks.add_spectra, 
+        add_gcfs or add_strains. Only the scores for changed rows/columns are calculated.
+
+        Likelihood scores depend on a LinkLikelihood object and are discarded, they 
+        need to be recalculated with likelihood_scoring.
+        """
+        num_strains = data_links.M_gcf_strain.shape[1]
+        if self.metcalf_expected is not None and self.metcalf_expected.shape[0] != num_strains + 1:
+            self.metcalf_expected, self.metcalf_variance = metcalf_expected_variance(num_strains, *self.metcalf_weights)
+            self.metcalf_variance_sqrt = np.sqrt(self.metcalf_variance)
+
+        for type_, change in changes.items():
+            M_type1_gcf = data_links.M_spec_gcf if type_ == 'spec-gcf' else data_links.M_fam_gcf
+            all_rows, all_cols = np.arange(M_type1_gcf.shape[0]), np.arange(M_type1_gcf.shape[1])
+            if len(self.get_scores('likescore', type_)) > 0:
+                logger.debug('Discarding likelihood scores of type {}'.format(type_))
+                self._set_scores('likescore', type_, [])
+
+            for method in ['metcalf', 'hg', 'metcalf_std']:
+                old_scores = self.get_scores(method, type_)
+                if len(old_scores) == 0:
+                    continue
+
+                if change is None:
+                    self._set_scores(method, type_, self._scores_from_counts(data_links, method, type_, all_rows, all_cols))
+                    continue
+
+                row_map, col_map = change
+                kept_rows, new_rows = np.flatnonzero(row_map >= 0), np.flatnonzero(row_map < 0)
+                kept_cols, new_cols = np.flatnonzero(col_map >= 0), np.flatnonzero(col_map < 0)
+                scores = np.zeros(M_type1_gcf.shape)
+                scores[np.ix_(kept_rows, kept_cols)] = old_scores[np.ix_(row_map[kept_rows], col_map[kept_cols])]
+                scores[new_rows, :] = self._scores_from_counts(data_links, method, type_, new_rows, all_cols)
+                scores[np.ix_(kept_rows, new_cols)] = self._scores_from_counts(data_links, method, type_, kept_rows, new_cols)
+                self._set_scores(method, type_, scores)
+
     def metcalf_scoring(self, data_links,
                         both=10,
                         type1_not_gcf=-10,
@@ -489,33 +1021,13 @@ class LinkFinder(object):
         # Compute the expected values for all possible values of spec and gcf strains
         # we need the total number of strains
         _ ,n_strains = data_links.M_gcf_strain.shape
+        self.metcalf_weights = (both, type1_not_gcf, gcf_not_type1, not_type1_not_gcf)
         if self.metcalf_expected is None:
-            sz = (n_strains + 1, n_strains + 1)
-            self.metcalf_expected = np.zeros(sz)
-            self.metcalf_variance = np.zeros(sz)
-
-            for n in range(n_strains+1):
-                for m in range(n_strains+1):
-                    max_overlap = min(n, m)
-                    min_overlap = max(0, n + m - n_strains) # minimum possible strain overlap
-                    expected_value = 0
-                    expected_sq = 0
-                    for o in range(min_overlap, max_overlap + 1):
-                        o_prob = hypergeom.pmf(o, n_strains, n, m)
-                        # compute metcalf for n strains in type 1 and m in gcf
-                        score = o * both
-                        score += type1_not_gcf * (n - o)
-                        score += gcf_not_type1 * (m - o)
-                        score += not_type1_not_gcf * (n_strains - (n + m - o))
-                        expected_value += o_prob * score
-                        expected_sq += o_prob * (score ** 2)
-
-                    self.metcalf_expected[n, m] = expected_value
-                    expected_sq = expected_sq - expected_value ** 2
-                    if expected_sq < 1e-09:
-                        expected_sq = 1
-                    self.metcalf_variance[n, m] = expected_sq
-
+            self.metcalf_expected, self.metcalf_variance = metcalf_expected_variance(n_strains,
+                                                                                     both,
+                                                                                     type1_not_gcf,
+                                                                                     gcf_not_type1,
+                                                                                     not_type1_not_gcf)
             self.metcalf_variance_sqrt = np.sqrt(self.metcalf_variance)
 
         # now, we would like an option to take any actual score an subtract the 
@@ -525,26 +1037,74 @@ class LinkFinder(object):
         # at expected_metcalf[3,6] and sqrt of the variance in the same position
 
         if type == 'spec-gcf':
-            metcalf_scores = np.zeros(data_links.M_spec_gcf.shape)
-            metcalf_scores = (data_links.M_spec_gcf * both
-                              + data_links.M_spec_notgcf * type1_not_gcf
-                              + data_links.M_notspec_gcf * gcf_not_type1
-                              + data_links.M_notspec_notgcf * not_type1_not_gcf)
+            # (the co-occurence counts are small ints, so use float weights)
+            metcalf_scores = (data_links.M_spec_gcf * float(both)
+                              + data_links.M_spec_notgcf * float(type1_not_gcf)
+                              + data_links.M_notspec_gcf * float(gcf_not_type1)
+                              + data_links.M_notspec_notgcf * float(not_type1_not_gcf))
             self.metcalf_spec_gcf = metcalf_scores
 
         elif type == 'fam-gcf':
-            metcalf_scores = np.zeros(data_links.M_fam_gcf.shape)
-            metcalf_scores = (data_links.M_fam_gcf * both
-                              + data_links.M_fam_notgcf * type1_not_gcf
-                              + data_links.M_notfam_gcf * gcf_not_type1
-                              + data_links.M_notfam_notgcf * not_type1_not_gcf)
+            metcalf_scores = (data_links.M_fam_gcf * float(both)
+                              + data_links.M_fam_notgcf * float(type1_not_gcf)
+                              + data_links.M_notfam_gcf * float(gcf_not_type1)
+                              + data_links.M_notfam_notgcf * float(not_type1_not_gcf))
             
             self.metcalf_fam_gcf = metcalf_scores
         return metcalf_scores
 
+    def metcalf_strain_counts(self, data_links, type='spec-gcf'):
+        """
+        Return the number of strains for each spectrum/family and each GCF,
+        as used to index the metcalf_expected/metcalf_variance tables
+        """
+        if type == 'spec-gcf':
+            M_type1_strain = data_links.M_spec_strain
+        elif type == 'fam-gcf':
+            M_type1_strain = data_links.M_fam_strain
+        else:
+            raise Exception("Wrong correlation 'type' given. Must be one of 'spec-gcf', 'fam-gcf'...")
+
+        type1_counts = np.asarray(M_type1_strain.sum(axis=1)).astype(np.int64)
+        gcf_counts = np.asarray(data_links.M_gcf_strain.sum(axis=1)).astype(np.int64)
+        return type1_counts, gcf_counts
+
+    def standardise_metcalf(self, data_links, type1_ids, gcf_ids, scores, type='spec-gcf'):
+        """
+        Standardise a set of metcalf scores, where scores[i] is the score for the
+        pair (type1_ids[i], gcf_ids[i]): subtract the expected score and divide by 
+        the standard deviation for the given numbers of strains. 
+
+        Requires the metcalf_expected and metcalf_variance tables, which are
+        calculated by metcalf_scoring.
+        """
+        type1_counts, gcf_counts = self.metcalf_strain_counts(data_links, type)
+        type1_counts = type1_counts[np.asarray(type1_ids, dtype=np.int64)]
+        gcf_counts = gcf_counts[np.asarray(gcf_ids, dtype=np.int64)]
+
+        expected = self.metcalf_expected[type1_counts, gcf_counts]
+        variance_sqrt = self.metcalf_variance_sqrt[type1_counts, gcf_counts]
+        return (scores - expected) / variance_sqrt
+
+    def standardised_metcalf_scoring(self, data_links, type='spec-gcf'):
+        """
+        Calculate the full matrix of standardised metcalf scores (requires 
+        metcalf_scoring to have been run for the same type)
+        """
+        type1_counts, gcf_counts = self.metcalf_strain_counts(data_links, type)
+        expected = self.metcalf_expected[type1_counts[:, None], gcf_counts[None, :]]
+        variance_sqrt = self.metcalf_variance_sqrt[type1_counts[:, None], gcf_counts[None, :]]
+        metcalf_std = (self.get_scores('metcalf', type) - expected) / variance_sqrt
+
+        if type == 'spec-gcf':
+            self.metcalf_std_spec_gcf = metcalf_std
+        elif type == 'fam-gcf':
+            self.metcalf_std_fam_gcf = metcalf_std
+        return metcalf_std
+
     def hg_scoring(self, data_links, type='spec-gcf'):
         """
-        Calculate metcalf scores from DataLinks() co-occurence matrices
+        Calculate hypergeometric p-value scores from DataLinks() co-occurence matrices
         """
 
         # NOTE:can't use the correlation matrices directly for this scoring method because
@@ -555,26 +1115,30 @@ class LinkFinder(object):
         # M_spec_gcf will correctly contain "1", but M_type1_notgcf will contain "2" instead
         # of "3", because the spectrum only has 2 distinct strains vs the GCF.
         # To fix this the M_spec_gcf/M_fam_gcf matrix can just be added onto the others to give
-        # the correct totals.
-
-
+        # the correct totals, which are simply the number of strains of each object.
+        # (the p-values are looked up in a table which is cached between calls, see
+        # hypergeom_sf_table)
+        type1_counts, gcf_counts = self.metcalf_strain_counts(data_links, type)
+        num_strains = data_links.M_gcf_strain.shape[1]
         if type == 'spec-gcf':
-            num_strains = np.ones(data_links.M_spec_gcf.shape) * data_links.M_gcf_strain.shape[1]
-            overlap_counts = data_links.M_spec_gcf
-            gcf_counts = overlap_counts + data_links.M_notspec_gcf
-            spec_counts = overlap_counts + data_links.M_spec_notgcf
-            hg_scores = hypergeom.sf(overlap_counts, num_strains, gcf_counts, spec_counts, loc=1)
+            hg_scores = hypergeom_sf_lookup(data_links.M_spec_gcf, num_strains, type1_counts[:, None], gcf_counts[None, :])
             self.hg_spec_gcf = hg_scores
-        elif type == 'fam-gcf':
-            num_strains = np.ones(data_links.M_fam_gcf.shape) * data_links.M_gcf_strain.shape[1]
-            overlap_counts = data_links.M_fam_gcf
-            gcf_counts = overlap_counts + data_links.M_notfam_gcf
-            fam_counts = overlap_counts + data_links.M_fam_notgcf
-            hg_scores = hypergeom.sf(overlap_counts, num_strains, gcf_counts, fam_counts, loc=1)
+        else:
+            hg_scores = hypergeom_sf_lookup(data_links.M_fam_gcf, num_strains, type1_counts[:, None], gcf_counts[None, :])
             self.hg_fam_gcf = hg_scores
 
         return hg_scores
 
+    def _likelihood_scores(self, P_gcf_given_type1, P_type1_not_gcf, M_type1_gcf, alpha_weighing):
+        # P_gcf_given_type1 * (1 - P_type1_not_gcf) * (1 - exp(-alpha_weighing * M_type1_gcf)),
+        # calculated in place in the output array to avoid more full-size temporaries
+        scores = np.multiply(M_type1_gcf, -alpha_weighing, dtype=np.float64)
+        np.expm1(scores, out=scores)
+        np.negative(scores, out=scores)
+        scores *= P_gcf_given_type1
+        scores *= 1 - P_type1_not_gcf
+        return scores
+
     def likelihood_scoring(self, data_links, likelihoods,
                         alpha_weighing=0.5,
                         type='spec-gcf'):
@@ -597,20 +1161,18 @@ class LinkFinder(object):
         """
         
         if type == 'spec-gcf':
-            likelihood_scores = np.zeros(data_links.M_spec_gcf.shape)
-            likelihood_scores = (likelihoods.P_gcf_given_spec
-                                 * (1 - likelihoods.P_spec_not_gcf)
-                                 * (1 - np.exp(-alpha_weighing * data_links.M_spec_gcf))
-                                 )
+            likelihood_scores = self._likelihood_scores(likelihoods.P_gcf_given_spec,
+                                                        likelihoods.P_spec_not_gcf,
+                                                        data_links.M_spec_gcf,
+                                                        alpha_weighing)
             
             self.likescores_spec_gcf = likelihood_scores
             
         elif type == 'fam-gcf':
-            likelihood_scores = np.zeros(data_links.M_fam_gcf.shape)
-            likelihood_scores = (likelihoods.P_gcf_given_fam
-                                 * (1 - likelihoods.P_fam_not_gcf)
-                                 * (1 - np.exp(-alpha_weighing * data_links.M_fam_gcf))
-                                 )
+            likelihood_scores = self._likelihood_scores(likelihoods.P_gcf_given_fam,
+                                                        likelihoods.P_fam_not_gcf,
+                                                        data_links.M_fam_gcf,
+                                                        alpha_weighing)
             
             self.likescores_fam_gcf = likelihood_scores
         return likelihood_scores
@@ -687,8 +1249,8 @@ class LinkFinder(object):
         else:
             raise Exception('Wrong scoring type given. Must be one of: {}'.format(SCORING_METHODS))
             
-        logger.debug(candidate_ids[0].shape[0], " candidates selected with ",
-              index_names[2], " >= ", P_cutoff, " and a link score >= ", score_cutoff, ".")
+        logger.debug('{} candidates selected with {} >= {} and a link score >= {}.'.format(
+              candidate_ids[0].shape[0], index_names[2], P_cutoff, score_cutoff))
         
         link_candidates = np.zeros((12, candidate_ids[0].shape[0]))
         link_candidates[0, :] = candidate_ids[0]  # spectrum/fam number
@@ -702,45 +1264,44 @@ class LinkFinder(object):
         link_candidates[8, :] = likescores[candidate_ids]
         
         # Calculate probability to find similar link by chance
-        Nx_list = data_links.mapping_gcf["no of strains"]
+        Nx_list = np.asarray(data_links.mapping_gcf["no of strains"], dtype=np.float64)
         if type == 'spec-gcf':
-            Ny_list = data_links.mapping_spec["no of strains"]
+            Ny_list = np.asarray(data_links.mapping_spec["no of strains"], dtype=np.float64)
+            M_type1_strain = data_links.M_spec_strain
         elif type == 'fam-gcf':
-            Ny_list = data_links.mapping_fam["no of strains"]
+            Ny_list = np.asarray(data_links.mapping_fam["no of strains"], dtype=np.float64)
+            M_type1_strain = data_links.M_fam_strain
         
         # Calculate probabilities of finding a spectrum in a certain strain
         P_str = np.array(data_links.mapping_strain["no of spectra"])
         P_str = P_str/np.sum(P_str)
+        # strains with P_str == 0 are counted separately, as log(0) would give NaNs below
+        log_P_str = np.log(np.where(P_str > 0, P_str, 1))
             
         num_strains = data_links.M_gcf_strain.shape[1]
-        
+        type1_ids, gcf_ids = candidate_ids
+        Nx = Nx_list[gcf_ids]
+        Ny = Ny_list[type1_ids]
+        hits = link_candidates[6, :]
+
         # Calculate the hypergeometric probability (as before)
-        for i in range(link_candidates.shape[1]):
-             link_candidates[9, i] = pair_prob_hg(link_candidates[6,i],
-                                                            num_strains,
-                                                            Nx_list[link_candidates[1,i]],
-                                                            Ny_list[int(link_candidates[0,i])])
+        link_candidates[9, :] = pair_prob_hg_batch(hits, num_strains, Nx, Ny)
+
+        # the GCF and link specific probabilities need sums over the strains in 
+        # which the GCF (and the spectrum/family) occur, so collect those in blocks
+        P_str_sum = np.zeros(len(gcf_ids))
+        log_P_shared = np.zeros(len(gcf_ids))
+        for start in range(0, len(gcf_ids), self.CANDIDATE_BLOCK_SIZE):
+            block = slice(start, start + self.CANDIDATE_BLOCK_SIZE)
+            gcf_strains = data_links.M_gcf_strain[gcf_ids[block]] == 1
+            shared_strains = gcf_strains & (M_type1_strain[type1_ids[block]] == 1)
+            P_str_sum[block] = gcf_strains @ P_str
+            log_P_shared[block] = np.where(shared_strains @ (P_str == 0) > 0, -np.inf, shared_strains @ log_P_str)
 
         # Calculate the GCF specific probability
-        for i in range(link_candidates.shape[1]):
-            id_spec = int(link_candidates[0,i])
-            id_gcf = int(link_candidates[1,i])
-            
-            # find set of strains which contain GCF with id link_candidates[1,i] 
-            XG = np.where(data_links.M_gcf_strain[id_gcf , :] == 1)[0]
-                                                           
-            link_candidates[10,i] = pair_prob_approx(P_str, XG,
-                                                            int(Ny_list[id_spec]),
-                                                            int(link_candidates[6,i]))
-            # Calculate the link specific probability
-            # Find strains where GCF and spectra/family co-occur
-            if type == 'spec-gcf':
-                XGS = np.where((data_links.M_gcf_strain[id_gcf, :] == 1) & (data_links.M_spec_strain[id_spec, :] == 1))[0]
-            elif type == 'fam-gcf':
-                XGS = np.where((data_links.M_gcf_strain[id_gcf, :] == 1) & (data_links.M_fam_strain[id_spec, :] == 1))[0]
-            link_candidates[11,i] = link_prob(P_str, XGS,
-                                                           int(Nx_list[id_gcf]),
-                                                           int(Ny_list[id_spec]), num_strains)
+        link_candidates[10, :] = pair_prob_approx_batch(P_str_sum, Nx, Ny, hits, num_strains)
+        # Calculate the link specific probability
+        link_candidates[11, :] = link_prob_batch(log_P_shared, Nx, Ny, hits, num_strains)
             
         # Transform into pandas Dataframe (to avoid index confusions):
         link_candidates_pd = pd.DataFrame(link_candidates.transpose(1,0), columns = index_names)
@@ -776,7 +1337,7 @@ class LinkFinder(object):
         input_objects: object()
             Object or list of objects of either class: spectra, families, or GCFs
         main_score: str
-            Which main score to use ('metcalf', 'likescore')
+            Which main score to use ('metcalf', 'likescore', 'hg', 'metcalf_std')
         score_cutoff:
             Thresholds to conly consider candidates for which:
             score >= score_cutoff
@@ -785,91 +1346,26 @@ class LinkFinder(object):
         if main_score not in SCORING_METHODS:
             raise Exception('Wrong scoring type given. Must be one of: {}'.format(SCORING_METHODS))
 
-        # Check if input is list:
-        if isinstance(input_object, list):
-            query_size = len(input_object)
-        else:
-            input_object = [input_object]
-            query_size = 1
+        input_type, input_ids, link_levels = self._query_ids(data_links, input_object)
+        query_size = len(input_ids)
 
-        # Check type of input_object:
-        # If GCF:
-        if isinstance(input_object[0], GCF):
-            input_type = "gcf"
-            link_levels = [0, 1]
-            
-            # Get necessary ids
-            input_ids = np.array([gcf.id for gcf in input_object], dtype=np.int32)
-            
-            if main_score == 'likescore':
-                likescores = [self.likescores_spec_gcf[:, input_ids],
-                          self.likescores_fam_gcf[:, input_ids]]
-            elif main_score == 'metcalf':
-                metcalf_scores = [self.metcalf_spec_gcf[:, input_ids],
-                              self.metcalf_fam_gcf[:, input_ids]]
-            elif main_score == 'hg':
-                hg_scores = [self.hg_spec_gcf[:, input_ids],
-                         self.hg_fam_gcf[:, input_ids]]
-
-        # If Spectrum:
-        elif isinstance(input_object[0], Spectrum):
-            # Get necessary ids
-            input_ids = np.array([spec.id for spec in input_object], dtype=np.int32)
-
-            input_type = "spec"
-            link_levels = [0]
-            if main_score == 'likescore':
-                likescores = [self.likescores_spec_gcf[input_ids, :],
-                              []]
-            elif main_score == 'metcalf':
-                metcalf_scores = [self.metcalf_spec_gcf[input_ids, :],
-                                  []]
-            elif main_score == 'hg':
-                hg_scores = [self.hg_spec_gcf[input_ids, :],
-                             []]
-        # If MolecularFamily:                     
-        elif isinstance(input_object[0], MolecularFamily):
-            
-            # Get necessary ids
-            # TODO: include Singletons, maybe optinal
-            input_ids = np.zeros(query_size)
-            mapping_fam_id = data_links.mapping_fam["original family id"]
-            for i, family in enumerate(input_object):
-                input_ids[i] = np.where(mapping_fam_id == int(family.family_id))[0]
-            input_ids =  input_ids.astype(int)
-            
-            input_type = "fam"
-            link_levels = [1]
-            if main_score == 'likescore':
-                likescores = [[],
-                              self.likescores_fam_gcf[input_ids, :]]
-            elif main_score == 'metcalf':
-                metcalf_scores = [[],
-                                  self.metcalf_fam_gcf[input_ids, :]]
-            elif main_score == 'hg':
-                hg_scores = [[],
-                             self.hg_fam_gcf[input_ids, :]]
+        if input_type == 'gcf':
+            scores = [self.get_scores(main_score, 'spec-gcf')[:, input_ids],
+                      self.get_scores(main_score, 'fam-gcf')[:, input_ids]]
+        elif input_type == 'spec':
+            scores = [self.get_scores(main_score, 'spec-gcf')[input_ids, :],
+                      []]
         else:
-            raise Exception("Input_object must be Spectrum, MolecularFamily, or GCF object (single or list).")
+            scores = [[],
+                      self.get_scores(main_score, 'fam-gcf')[input_ids, :]]
 
         links = []
         for linklevel in link_levels:
             if score_cutoff is not None:
-                if main_score == 'likescore':
-                    candidate_ids = np.where(likescores[linklevel] >= score_cutoff)
-                elif main_score == 'metcalf':
-                    candidate_ids = np.where(metcalf_scores[linklevel] >= score_cutoff)
-                elif main_score == 'hg':
-                    candidate_ids = np.where(hg_scores[linklevel] >= score_cutoff)
-                else:
-                    # should never happen
-                    raise Exception('Unknown scoring type! "{}"'.format(main_score))
+                candidate_ids = np.where(scores[linklevel] >= score_cutoff)
             else:
-                # TODO is this best way to get same output as above code?
-                # to keep the remainder of the method identical in the case of no cutoff
-                # being supplied, while still returning all the candidate links, I'm
-                # currently abusing np.where like this
-                candidate_ids = np.where(metcalf_scores[linklevel] != np.nan)
+                # no cutoff, so return all the candidate links (in the same format)
+                candidate_ids = np.nonzero(np.ones(scores[linklevel].shape, dtype=bool))
 
             link_candidates = np.zeros((3, candidate_ids[0].shape[0]))
             
@@ -903,13 +1399,240 @@ class LinkFinder(object):
                     link_candidates[1, :] = candidate_ids[1].astype(int)
             
             # finally, copy in the actual scores too
-            if main_score == 'likescore':
-                link_candidates[2, :] = likescores[linklevel][candidate_ids]
-            elif main_score == 'metcalf':
-                link_candidates[2, :] = metcalf_scores[linklevel][candidate_ids]
-            elif main_score == 'hg':
-                link_candidates[2, :] = hg_scores[linklevel][candidate_ids]
+            link_candidates[2, :] = scores[linklevel][candidate_ids]
+
+            links.append(link_candidates)
+
+        return links
 
+    def _query_ids(self, data_links, input_object):
+        """
+        Return the input type ('gcf', 'spec' or 'fam'), the row/column indices of the
+        input objects in the score matrices and the link levels to search
+        (0 = spec-gcf, 1 = fam-gcf) for get_links/query_links
+        """
+        # Check if input is list:
+        if not isinstance(input_object, list):
+            input_object = [input_object]
+
+        # Check type of input_object:
+        # If GCF:
+        if isinstance(input_object[0], GCF):
+            input_ids = np.array([gcf.id for gcf in input_object], dtype=np.int32)
+            return 'gcf', input_ids, [0, 1]
+
+        # If Spectrum:
+        elif isinstance(input_object[0], Spectrum):
+            input_ids = np.array([spec.id for spec in input_object], dtype=np.int32)
+            return 'spec', input_ids, [0]
+
+        # If MolecularFamily:                     
+        elif isinstance(input_object[0], MolecularFamily):
+            # TODO: include Singletons, maybe optinal
+            input_ids = np.zeros(len(input_object))
+            mapping_fam_id = data_links.mapping_fam["original family id"]
+            for i, family in enumerate(input_object):
+                input_ids[i] = np.where(mapping_fam_id == int(family.family_id))[0][0]
+            return 'fam', input_ids.astype(int), [1]
+
+        raise Exception("Input_object must be Spectrum, MolecularFamily, or GCF object (single or list).")
+
+    def permutation_null(self, data_links, type='spec-gcf', 
+                         main_score='metcalf',
+                         num_permutations=100,
+                         seed=None,
+                         processes=1,
+                         batch_size=10):
+        """
+        Estimate how significant the scores are by repeatedly permuting the strain
+        labels of the spectra/families and recomputing all scores.
+
+        The permutations are split into batches of batch_size, which are run on a 
+        pool of <processes> worker processes (processes=1 runs everything in this
+        process). Each permutation gets its own random generator derived from seed,
+        so the results only depend on seed and num_permutations, not on the number 
+        of processes or the batch size.
+
+        Parameters
+        ----------
+        main_score: str
+            'metcalf' or 'hg' (for hg, low p-values are significant)
+
+        Returns a PermutationNull object with empirical p-values and per-GCF thresholds
+        """
+        if type == 'spec-gcf':
+            M_type1_strain = data_links.M_spec_strain
+        elif type == 'fam-gcf':
+            M_type1_strain = data_links.M_fam_strain
+        else:
+            raise Exception("Wrong correlation 'type' given. Must be one of 'spec-gcf', 'fam-gcf'...")
+        if main_score not in ['metcalf', 'hg']:
+            raise Exception('Permutation tests are only supported for metcalf and hg scores')
+
+        # the columns have to be shuffled, so use dense matrices here
+        M_type1_strain, M_gcf_strain = [M.toarray() if isinstance(M, PackedStrainMatrix) else np.asarray(M) 
+                                        for M in (M_type1_strain, data_links.M_gcf_strain)]
+        weights = getattr(self, 'metcalf_weights', METCALF_WEIGHTS)
+        greater = main_score != 'hg'
+        args = (M_type1_strain, M_gcf_strain, main_score, weights, greater)
+
+        seeds = np.random.SeedSequence(seed).spawn(num_permutations)
+        batches = [seeds[i:i + batch_size] for i in range(0, num_permutations, batch_size)]
+
+        logger.debug('Running {} permutations of {} scores in {} batches ({} processes)'.format(
+                     num_permutations, main_score, len(batches), processes))
+        if processes > 1:
+            with ProcessPoolExecutor(processes, initializer=_init_permutation_worker, initargs=args) as pool:
+                results = list(pool.map(_permutation_worker, batches))
+        else:
+            results = [permutation_null_counts(M_type1_strain, M_gcf_strain, batch, main_score, weights, greater) 
+                       for batch in batches]
+
+        exceed = np.zeros((M_type1_strain.shape[0], M_gcf_strain.shape[0]), dtype=np.int32)
+        for batch_exceed, _ in results:
+            exceed += batch_exceed
+        extremes = np.concatenate([np.zeros((0, M_gcf_strain.shape[0]))] + [x for _, x in results])
+        return PermutationNull(exceed, extremes, main_score, greater)
+
+    def score_block(self, data_links, type1_ids, gcf_ids,
+                    main_score='metcalf',
+                    type='spec-gcf',
+                    alpha_weighing=0.5):
+        """
+        Calculate scores for a block of spectra/families (type1_ids) and GCFs (gcf_ids)
+        directly from the DataLinks() co-occurence matrices, without using the full
+        score matrices. The result is a len(type1_ids) x len(gcf_ids) matrix equal to
+        the corresponding block of the matrix produced by metcalf_scoring, 
+        standardised_metcalf_scoring, hg_scoring or likelihood_scoring.
+        """
+        if type == 'spec-gcf':
+            M_type1_strain = data_links.M_spec_strain
+        elif type == 'fam-gcf':
+            M_type1_strain = data_links.M_fam_strain
+        else:
+            raise Exception("Wrong correlation 'type' given. Must be one of 'spec-gcf', 'fam-gcf'...")
+
+        table = calc_correlation_matrix(select_rows(M_type1_strain, type1_ids),
+                                        select_rows(data_links.M_gcf_strain, gcf_ids),
+                                        lazy=True)
+        num_strains = table.num_conditions
+        overlap_counts = table.both.astype(np.float64)
+        type1_counts = table.sum_type1[:, None]
+        gcf_counts = table.sum_type2[None, :]
+
+        if main_score == 'metcalf' or main_score == 'metcalf_std':
+            weights = getattr(self, 'metcalf_weights', METCALF_WEIGHTS)
+            scores = table.metcalf(*weights)
+            if main_score == 'metcalf_std':
+                if self.metcalf_expected is None:
+                    self.metcalf_expected, self.metcalf_variance = metcalf_expected_variance(num_strains, *weights)
+                    self.metcalf_variance_sqrt = np.sqrt(self.metcalf_variance)
+                scores -= self.metcalf_expected[type1_counts, gcf_counts]
+                scores /= self.metcalf_variance_sqrt[type1_counts, gcf_counts]
+        elif main_score == 'hg':
+            scores = hypergeom_sf_lookup(table.both, num_strains, type1_counts, gcf_counts)
+        elif main_score == 'likescore':
+            # same as calc_likelihood_matrix + likelihood_scoring, including treating
+            # objects with no strains as having 1 to avoid dividing by 0. P(type1|not gcf)
+            # is still undefined (nan) for GCFs that are found in every strain
+            P_gcf_given_type1 = overlap_counts / np.maximum(type1_counts, 1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                P_type1_not_gcf = (type1_counts - overlap_counts) / (num_strains - np.maximum(gcf_counts, 1).astype(np.float64))
+            scores = (P_gcf_given_type1
+                      * (1 - P_type1_not_gcf) 
+                      * (1 - np.exp(-alpha_weighing * overlap_counts)))
+        else:
+            raise Exception('Wrong scoring type given. Must be one of: {}'.format(SCORING_METHODS))
+
+        return scores
+
+    def query_links(self, data_links, input_object,
+                    main_score='metcalf',
+                    score_cutoff=None,
+                    top_k=None,
+                    block_size=1024):
+        """
+        Output likely links for 'input_object', like get_links, but calculate the
+        scores in blocks of block_size spectra/families at a time instead of using
+        the full score matrices (which don't have to exist). Only the links 
+        with score >= score_cutoff and/or the top_k links per input object are kept,
+        so memory use is limited by block_size and the number of links returned. 
+        
+        Parameters
+        ----------
+        input_objects: object()
+            Object or list of objects of either class: spectra, families, or GCFs
+        main_score: str
+            Which main score to use ('metcalf', 'likescore', 'hg', 'metcalf_std')
+        score_cutoff:
+            Thresholds to conly consider candidates for which:
+            score >= score_cutoff (None to return all candidates)
+        top_k:
+            Maximum number of links to return for each input object (None for no limit)
+        block_size:
+            Number of spectra/families to calculate scores for at a time
+
+        Returns a list of (3, x) arrays in the same format as get_links
+        """
+
+        if main_score not in SCORING_METHODS:
+            raise Exception('Wrong scoring type given. Must be one of: {}'.format(SCORING_METHODS))
+
+        input_type, input_ids, link_levels = self._query_ids(data_links, input_object)
+        num_gcfs = data_links.M_gcf_strain.shape[0]
+        links = []
+        for linklevel in link_levels:
+            type_ = 'spec-gcf' if linklevel == 0 else 'fam-gcf'
+            if input_type == 'gcf':
+                # all spectra/families (in blocks) against the input GCFs, the input
+                # objects are the columns of each block
+                num_type1 = (data_links.M_spec_strain if linklevel == 0 else data_links.M_fam_strain).shape[0]
+                type1_ids = np.arange(num_type1)
+                gcf_ids = input_ids
+            else:
+                # the input spectra/families (in blocks) against all GCFs, the input
+                # objects are the rows of each block
+                type1_ids = input_ids
+                gcf_ids = np.arange(num_gcfs)
+
+            sources, targets, link_scores = [], [], []
+            for start in range(0, len(type1_ids), block_size):
+                block_rows = np.arange(start, min(start + block_size, len(type1_ids)))
+                scores = self.score_block(data_links, type1_ids[block_rows], gcf_ids, main_score, type_)
+
+                if score_cutoff is not None:
+                    rows, cols = np.nonzero(scores >= score_cutoff)
+                else:
+                    rows, cols = np.nonzero(np.ones(scores.shape, dtype=bool))
+
+                # positions of the source (input object) and target for each link
+                if input_type == 'gcf':
+                    source, target = cols, type1_ids[block_rows[rows]]
+                else:
+                    source, target = block_rows[rows], gcf_ids[cols]
+                block_scores = scores[rows, cols]
+
+                if top_k is not None:
+                    keep = top_k_by_group(source, block_scores, top_k)
+                    source, target, block_scores = source[keep], target[keep], block_scores[keep]
+
+                sources.append(source)
+                targets.append(target)
+                link_scores.append(block_scores)
+
+            source = np.concatenate(sources) if len(sources) > 0 else np.zeros(0, dtype=np.int64)
+            target = np.concatenate(targets) if len(targets) > 0 else np.zeros(0, dtype=np.int64)
+            block_scores = np.concatenate(link_scores) if len(link_scores) > 0 else np.zeros(0)
+            if top_k is not None and input_type == 'gcf':
+                # the links for each input GCF are spread over all the blocks
+                keep = top_k_by_group(source, block_scores, top_k)
+                source, target, block_scores = source[keep], target[keep], block_scores[keep]
+
+            # same (3, x) format as get_links: input object IDs, linked object IDs, scores
+            link_candidates = np.zeros((3, len(source)))
+            link_candidates[0, :] = input_ids[source]
+            link_candidates[1, :] = target
+            link_candidates[2, :] = block_scores
             links.append(link_candidates)
 
         return links
@@ -1004,6 +1727,12 @@ class LinkFinder(object):
         Plot best rated correlations between gcfs and spectra/families
         plot in form of seaborn clustermap
         """
+        # TODO move plotting to separate module?
+        try:
+            from matplotlib import pyplot as plt
+            import seaborn as sns
+        except ImportError:
+            raise Exception('Plotting functionality is not available (missing matplotlib and/or seaborn)')
         
         # Select score type
         if score_type == 'metcalf':
@@ -3,40 +3,678 @@
 import numpy as np
 import math
 
-def calc_correlation_matrix(M_type1_cond, M_type2_cond):
+# Bit-packed occurrence matrices
+#
+# The strain occurrence matrices (M_gcf_strain etc) only ever contain 0/1 values.
+# Instead of storing a float64 per cell they can be stored as single bits, packed
+# into uint64 words (one word per 64 strains). Co-occurrence counts between two
+# such matrices are then simply AND + popcount over the packed words.
+
+# number of set bits in each possible byte value (used if np.bitwise_count is missing)
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+# approximate size (in bytes) of the temporary arrays used when counting co-occurences
+_PACKED_BLOCK_BYTES = 64 * 1024 * 1024
+
+def popcount(words):
+    """
+    Return the number of set bits in each element of an array of uint64 words
+    (as a uint8 array with the same shape)
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+
+    words = np.ascontiguousarray(words)
+    bytecounts = _POPCOUNT_TABLE[words.view(np.uint8)]
+    return bytecounts.reshape(words.shape + (words.itemsize, )).sum(axis=-1, dtype=np.uint8)
+
+def count_dtype(max_count):
+    """
+    Return the smallest (signed) integer type able to hold counts up to max_count.
+    The type is signed so that differences between count matrices can't wrap around
+    """
+    return np.min_scalar_type(-(max(int(max_count), 1) + 1))
+
+def pack_strain_matrix(M_type_cond):
+    """
+    Pack a dense 0/1 occurrence matrix (objects x strains) into a PackedStrainMatrix
+    """
+    M_type_cond = np.asarray(M_type_cond) != 0
+    num_objects, num_strains = M_type_cond.shape
+    num_words = (num_strains + 63) // 64
+    
+    packed_bytes = np.packbits(M_type_cond, axis=1, bitorder='little')
+    words = np.zeros((num_objects, num_words * 8), dtype=np.uint8)
+    words[:, :packed_bytes.shape[1]] = packed_bytes
+    return PackedStrainMatrix(words.view('<u8'), num_strains)
+
+def unpack_strain_words(words, num_strains):
+    """
+    Unpack uint64 strain words (..., num_words) into a boolean array (..., num_strains)
+    """
+    words = np.ascontiguousarray(words, dtype='<u8')
+    bits = np.unpackbits(words.view(np.uint8), axis=-1, count=num_strains, bitorder='little')
+    return bits.view(bool)
+
+def packed_cooccurrence(words1, words2, dtype=None):
+    """
+    Count co-occurences between all rows of two packed strain matrices.
+
+    Returns a len(words1) x len(words2) matrix where (x,y) is the number of strains
+    set in both words1[x] and words2[y] (i.e. the popcount of their bitwise AND).
+    """
+    num1, num_words = words1.shape
+    num2 = words2.shape[0]
+    if dtype is None:
+        dtype = count_dtype(num_words * 64)
+    counts = np.zeros((num1, num2), dtype=dtype)
+
+    # process blocks of rows from words1 to limit the size of the temporaries
+    block_size = max(1, _PACKED_BLOCK_BYTES // max(1, num2 * 8))
+    for start in range(0, num1, block_size):
+        block = words1[start:start + block_size]
+        for w in range(num_words):
+            counts[start:start + block_size] += popcount(block[:, w, None] & words2[None, :, w])
+
+    return counts
+
+class PackedStrainMatrix(object):
+    """
+    Bit-packed version of a 0/1 occurrence matrix (objects x strains).
+
+    Each row is stored as ceil(num_strains / 64) uint64 words, where bit (s % 64)
+    of word (s // 64) is set if the object occurs in strain s. The class supports
+    the small subset of the numpy API used on the dense matrices (shape, row 
+    indexing, sum) so it can mostly be used in their place.
+    """
+
+    def __init__(self, words, num_strains):
+        self.words = words
+        self.num_strains = num_strains
+
+    @property
+    def shape(self):
+        return (self.words.shape[0], self.num_strains)
+
+    @property
+    def nbytes(self):
+        return self.words.nbytes
+
+    def __len__(self):
+        return self.words.shape[0]
+
+    def __getitem__(self, key):
+        # unpack only the selected rows, then apply any column index to them
+        if isinstance(key, tuple):
+            rows, cols = key[0], key[1:]
+        else:
+            rows, cols = key, ()
+
+        if isinstance(rows, tuple):
+            # e.g. the output from np.where
+            rows = np.asarray(rows)
+
+        dense = unpack_strain_words(self.words[rows], self.num_strains)
+        if len(cols) > 0:
+            dense = dense[(Ellipsis, ) + cols]
+        return dense
+
+    def sum(self, axis=None, dtype=None, out=None, **kwargs):
+        if axis == 1 or axis == -1:
+            row_counts = popcount(self.words).sum(axis=1, dtype=dtype or count_dtype(self.num_strains))
+            return row_counts
+        
+        # column sums require unpacking, do it in blocks of rows
+        col_counts = np.zeros(self.num_strains, dtype=dtype or np.int64)
+        block_size = max(1, _PACKED_BLOCK_BYTES // max(1, self.num_strains))
+        for start in range(0, len(self), block_size):
+            col_counts += unpack_strain_words(self.words[start:start + block_size], self.num_strains).sum(axis=0, dtype=col_counts.dtype)
+
+        if axis is None:
+            return col_counts.sum()
+        return col_counts
+
+    def toarray(self, dtype=np.float64):
+        """
+        Return the equivalent dense matrix
+        """
+        return unpack_strain_words(self.words, self.num_strains).astype(dtype)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.toarray(dtype or np.float64)
+
+    def cooccurrence(self, other):
+        """
+        Return the matrix of co-occurence counts between rows of self and other
+        """
+        return packed_cooccurrence(self.words, other.words, count_dtype(self.num_strains))
+
+    def common_indices(self, row, other, other_row):
+        """
+        Return the indices of strains set in both self[row] and other[other_row]
+        """
+        return np.flatnonzero(unpack_strain_words(self.words[row] & other.words[other_row], self.num_strains))
+
+    def __repr__(self):
+        return 'PackedStrainMatrix(objects={}, strains={})'.format(*self.shape)
+
+def select_rows(M_type_cond, rows):
+    """
+    Return the given rows of a dense, packed or CSR occurrence matrix, in the same format
+    """
+    if isinstance(M_type_cond, PackedStrainMatrix):
+        return PackedStrainMatrix(M_type_cond.words[rows], M_type_cond.num_strains)
+    if isinstance(M_type_cond, OccurrenceCSR):
+        rows = np.arange(len(M_type_cond))[rows]
+        counts = M_type_cond.counts()[rows]
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        # position of each selected entry in the original indices array
+        positions = np.repeat(M_type_cond.indptr[rows] - indptr[:-1], counts) + np.arange(indptr[-1])
+        return OccurrenceCSR(indptr, M_type_cond.indices[positions], M_type_cond.num_strains)
+    return M_type_cond[rows]
+
+def top_k_by_group(groups, scores, k):
+    """
+    Return the indices of the (at most) k highest scores for each group, where
+    groups[i] is the group of scores[i]. The indices are ordered by group and
+    then by decreasing score (NaN scores come last).
+    """
+    order = np.lexsort((-scores, groups))
+    sorted_groups = groups[order]
+    # rank of each entry within its group = position - position of first group member
+    group_start = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    group_sizes = np.diff(np.r_[group_start, len(order)])
+    ranks = np.arange(len(order)) - np.repeat(group_start, group_sizes)
+    return order[ranks < k]
+
+def top_k_indices(values, k=None, reverse=True):
+    """
+    Return the indices of the k largest values (smallest if reverse is False), 
+    in the same order as a stable sort of all the values would give them. NaN 
+    values come last. If k is None all the indices are returned.
+    """
+    keys = -values if reverse else values
+    if k is None or k >= len(keys):
+        return np.argsort(keys, kind='stable')
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # only the values up to the k-th smallest key need to be sorted
+    kth = np.partition(keys, k - 1)[k - 1]
+    if np.isnan(kth):
+        return np.argsort(keys, kind='stable')[:k]
+    candidates = np.flatnonzero(keys <= kth)
+    return candidates[np.argsort(keys[candidates], kind='stable')][:k]
+
+def group_by_key(keys):
+    """
+    Group the entries of an array of integer keys, keeping the order in which
+    the keys first appear. Returns a tuple (unique_keys, rows, bounds), where
+    rows[bounds[i]:bounds[i + 1]] are the (increasing) indices of the entries 
+    equal to unique_keys[i].
+    """
+    unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+    key_positions = position[inverse.ravel()]
+    rows = np.argsort(key_positions, kind='stable')
+    bounds = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(key_positions, minlength=len(order)), out=bounds[1:])
+    return unique_keys[order], rows, bounds
+
+def merge_link_keys(source_keys, target_keys, and_mode=True):
+    """
+    Merge several sets of links, each given as an array of integer source keys and
+    an array of target keys (source_keys[i], target_keys[i] for set i).
+
+    If and_mode is True the result contains the links found in every set, otherwise
+    the links found in any set, ordered by first appearance (i.e. the links of
+    the first set, then any new links from the second set, and so on).
+
+    Returns a tuple (sources, targets, rows), where rows[i, j] is the index of
+    link j in set i, or -1 if it's not in that set.
+    """
+    sizes = [len(keys) for keys in source_keys]
+    all_sources = np.concatenate([np.asarray(keys, dtype=np.int64) for keys in source_keys])
+    all_targets = np.concatenate([np.asarray(keys, dtype=np.int64) for keys in target_keys])
+    if len(all_sources) == 0:
+        return all_sources, all_targets, np.zeros((len(sizes), 0), dtype=np.int64)
+
+    # replace each (source, target) pair by a single integer so the sets can
+    # be joined by sorting them all together
+    _, source_codes = np.unique(all_sources, return_inverse=True)
+    unique_targets, target_codes = np.unique(all_targets, return_inverse=True)
+    pair_codes = source_codes.ravel() * len(unique_targets) + target_codes.ravel()
+    _, first, inverse = np.unique(pair_codes, return_index=True, return_inverse=True)
+
+    # number the distinct links in order of first appearance
+    order = np.argsort(first)
+    position = np.empty(len(order), dtype=np.int64)
+    position[order] = np.arange(len(order))
+    link_index = position[inverse.ravel()]
+
+    rows = np.full((len(sizes), len(order)), -1, dtype=np.int64)
+    offsets = np.r_[0, np.cumsum(sizes)]
+    for i in range(len(sizes)):
+        rows[i, link_index[offsets[i]:offsets[i + 1]]] = np.arange(sizes[i])
+
+    first = first[order]
+    if and_mode:
+        keep = np.all(rows >= 0, axis=0)
+        rows = rows[:, keep]
+        first = first[keep]
+    return all_sources[first], all_targets[first], rows
+
+class OccurrenceCSR(object):
+    """
+    Compressed sparse row (CSR) form of an object -> strain occurrence matrix.
+
+    The strain indices of object i are indices[indptr[i]:indptr[i+1]] (sorted,
+    without duplicates). This is built once from the object/strain relations and 
+    can then be turned into a dense or bit-packed occurrence matrix in bulk.
+    """
+
+    def __init__(self, indptr, indices, num_strains):
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.num_strains = num_strains
+
+    @staticmethod
+    def from_lists(index_lists, num_strains):
+        """
+        Build from a sequence containing one iterable of strain indices per object
+        """
+        rows = [np.unique(np.fromiter(x, dtype=np.int64)) for x in index_lists]
+        lengths = np.array([len(x) for x in rows], dtype=np.int64)
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        indices = np.concatenate(rows) if len(rows) > 0 else np.zeros(0, dtype=np.int64)
+        return OccurrenceCSR(indptr, indices, num_strains)
+
+    @property
+    def shape(self):
+        return (len(self), self.num_strains)
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def row(self, i):
+        """
+        Return the strain indices for object i
+        """
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def counts(self):
+        """
+        Return the number of strains for each object
+        """
+        return np.diff(self.indptr)
+
+    def row_ids(self):
+        """
+        Return the object (row) index for each entry in self.indices
+        """
+        return np.repeat(np.arange(len(self)), self.counts())
+
+    def to_dense(self, dtype=np.float64):
+        """
+        Return the dense 0/1 occurrence matrix (objects x strains)
+        """
+        M_type_cond = np.zeros(self.shape, dtype=dtype)
+        M_type_cond[self.row_ids(), self.indices] = 1
+        return M_type_cond
+
+    def to_packed(self):
+        """
+        Return the occurrence matrix as a PackedStrainMatrix, without building the dense version
+        """
+        words = np.zeros((len(self), (self.num_strains + 63) // 64), dtype=np.uint64)
+        bits = np.left_shift(np.uint64(1), (self.indices % 64).astype(np.uint64))
+        np.bitwise_or.at(words, (self.row_ids(), self.indices // 64), bits)
+        return PackedStrainMatrix(words, self.num_strains)
+
+    def __repr__(self):
+        return 'OccurrenceCSR(objects={}, strains={}, entries={})'.format(len(self), self.num_strains, len(self.indices))
+
+# float32 can represent every integer count exactly up to 2**24
+_FLOAT32_EXACT_COUNT = 2 ** 24
+
+class ContingencyTable(object):
+    """
+    Lazy version of the four co-occurence matrices returned by calc_correlation_matrix.
+
+    Only the matrix of co-occurences (type1 AND type2) is stored, together with the 
+    number of conditions each object is observed under and the total number of
+    conditions. The other three matrices follow directly from those:
+        type1 AND NOT type2 = sum_type1 - both
+        NOT type1 AND type2 = sum_type2 - both
+        NOT type1 AND NOT type2 = num_conditions - sum_type1 - sum_type2 + both
+    and are only computed when accessed. Iterating over the object yields all four 
+    matrices in the same order as calc_correlation_matrix.
+    """
+
+    def __init__(self, both, sum_type1, sum_type2, num_conditions):
+        self.both = both
+        self.sum_type1 = sum_type1
+        self.sum_type2 = sum_type2
+        self.num_conditions = num_conditions
+
+    @property
+    def shape(self):
+        return self.both.shape
+
+    @property
+    def type1_not_type2(self):
+        return self.sum_type1[:, None] - self.both
+
+    @property
+    def not_type1_type2(self):
+        return self.sum_type2[None, :] - self.both
+
+    @property
+    def not_type1_not_type2(self):
+        # (N - sum_type1) - (sum_type2 - both) keeps every intermediate value >= 0
+        # (and <= N, so it fits in the count type)
+        not_type1 = (self.num_conditions - self.sum_type1).astype(self.both.dtype)
+        return not_type1[:, None] - self.not_type1_type2
+
+    def __iter__(self):
+        yield self.both
+        yield self.type1_not_type2
+        yield self.not_type1_type2
+        yield self.not_type1_not_type2
+
+    def metcalf(self, both=10, type1_not_type2=-10, type2_not_type1=0, not_type1_not_type2=1):
+        """
+        Calculate the (float64) Metcalf score matrix directly from the co-occurence counts,
+        without creating the other three matrices
+        """
+        # score = w1*A + w2*(s1-A) + w3*(s2-A) + w4*(N-s1-s2+A), grouped by term
+        sum_type1 = self.sum_type1.astype(np.float64)[:, None]
+        sum_type2 = self.sum_type2.astype(np.float64)[None, :]
+        scores = self.both * float(both - type1_not_type2 - type2_not_type1 + not_type1_not_type2)
+        scores += sum_type1 * (type1_not_type2 - not_type1_not_type2)
+        scores += sum_type2 * (type2_not_type1 - not_type1_not_type2)
+        scores += self.num_conditions * not_type1_not_type2
+        return scores
+
+    def __repr__(self):
+        return 'ContingencyTable(shape={}, conditions={})'.format(self.shape, self.num_conditions)
+
+def calc_cooccurrence_matrix(M_type1_cond, M_type2_cond):
+    """
+    Calculate the number of conditions where type1_x and type2_y co-occur as a
+    matrix of the smallest signed integer type that can hold the counts.
+    """
+    if isinstance(M_type1_cond, PackedStrainMatrix) and isinstance(M_type2_cond, PackedStrainMatrix):
+        return M_type1_cond.cooccurrence(M_type2_cond)
+
+    num_conditions = M_type1_cond.shape[1]
+    # a single BLAS product, in float32 wherever that is still exact
+    float_type = np.float32 if num_conditions < _FLOAT32_EXACT_COUNT else np.float64
+    M_type1_cond = np.asarray(M_type1_cond, dtype=float_type)
+    M_type2_cond = np.asarray(M_type2_cond, dtype=float_type)
+    return np.dot(M_type1_cond, M_type2_cond.T).astype(count_dtype(num_conditions))
+
+def calc_correlation_matrix(M_type1_cond, M_type2_cond, lazy=False):
     """ 
     Calculate correlation matrices from co-occurence matrices
     Input:
     M_type1_cond(x,y) is 1 if type1_x IS observed under condition_y
     M_type1_cond(x,y) is 0 if type1_x IS NOT observed under condition_y
     
-    Outputs three correlation matrices:
+    Outputs four correlation matrices:
     M_type1_type2(x,y) --- number of conditions where type1_x and type2_y co-occur
     M_type1_nottype2(x,y) --- number of conditions where type1_x and NOT-type2_y co-occur
     M_nottype1_type2(x,y) --- number of conditions where NOT-type1_x and type2_y co-occur 
+    M_nottype1_nottype2(x,y) --- number of conditions where neither type1_x nor type2_y occur
+
+    Only M_type1_type2 is computed as a matrix product, the others are derived from it
+    and the number of conditions per object (see ContingencyTable). The matrices use 
+    the smallest signed integer type that can hold the number of conditions.
+
+    If lazy=True a ContingencyTable is returned instead, which only computes the
+    three derived matrices when they are accessed.
+
+    If both inputs are PackedStrainMatrix objects the co-occurences are counted
+    with AND + popcount on the packed words.
     """
-          
-    # Quick computation of sum both present
-    testA = np.dot(M_type1_cond,M_type2_cond.T)
-    # Present in type1 and not in type 2
-    testB = np.dot(M_type1_cond,1-M_type2_cond.T)
-    # Not in type 1 and in type 2
-    testC = np.dot(1-M_type1_cond,M_type2_cond.T)
-    # Not in either
-    testD = np.dot(1-M_type1_cond,1-M_type2_cond.T)
-    # print(np.abs((testA - M_type1_type2)).sum())
-    # print(np.abs((testB - M_type1_nottype2)).sum())
-    # print(np.abs((testC - M_nottype1_type2)).sum())
-    M_type1_type2 = testA
-    M_type1_nottype2 = testB
-    M_nottype1_type2 = testC
-    M_nottype1_nottype2 = testD
+
+    num_conditions = M_type1_cond.shape[1]
+    dtype = count_dtype(num_conditions)
+    sum_type1 = np.asarray(M_type1_cond.sum(axis=1)).astype(dtype)
+    sum_type2 = np.asarray(M_type2_cond.sum(axis=1)).astype(dtype)
+    M_type1_type2 = calc_cooccurrence_matrix(M_type1_cond, M_type2_cond).astype(dtype, copy=False)
+
+    table = ContingencyTable(M_type1_type2, sum_type1, sum_type2, num_conditions)
+    if lazy:
+        return table
+
+    M_type1_type2, M_type1_nottype2, M_nottype1_type2, M_nottype1_nottype2 = table
     return M_type1_type2, M_type1_nottype2, M_nottype1_type2 , M_nottype1_nottype2
 
 
+# cache of tables returned by metcalf_expected_variance, keyed by (n_strains, weights)
+_METCALF_TABLE_CACHE = {}
+_METCALF_TABLE_CACHE_SIZE = 4
+
+def metcalf_expected_variance(n_strains, both=10, type1_not_gcf=-10, gcf_not_type1=0, not_type1_not_gcf=1):
+    """
+    Calculate the expected value and variance of the Metcalf score for every
+    possible pair of strain counts (n strains for type1, m strains for the GCF),
+    if the overlap between both sets of strains is random.
+
+    The overlap o then follows a hypergeometric distribution, with
+        E[o] = n*m/N and Var[o] = n*m*(N-n)*(N-m) / (N^2 * (N-1)),
+    and since the Metcalf score is a linear function of the overlap:
+        score = o * (both - type1_not_gcf - gcf_not_type1 + not_type1_not_gcf)
+                + n * type1_not_gcf + m * gcf_not_type1 + (N - n - m) * not_type1_not_gcf
+    the expected value and variance of the score follow directly from these.
+    Variances below 1e-9 (e.g. if n or m is 0 or N) are set to 1.
+
+    Output:
+    Two (n_strains + 1) x (n_strains + 1) arrays: expected[n, m], variance[n, m]
+    The results are cached, so the returned arrays are read-only.
+    """
+    key = (n_strains, both, type1_not_gcf, gcf_not_type1, not_type1_not_gcf)
+    if key in _METCALF_TABLE_CACHE:
+        return _METCALF_TABLE_CACHE[key]
+
+    N = float(n_strains)
+    n = np.arange(n_strains + 1, dtype=np.float64)[:, None]
+    m = np.arange(n_strains + 1, dtype=np.float64)[None, :]
+
+    overlap_weight = both - type1_not_gcf - gcf_not_type1 + not_type1_not_gcf
+    overlap_mean = n * m / max(N, 1)
+    overlap_var = n * m * (N - n) * (N - m) / (max(N, 1) ** 2 * max(N - 1, 1))
+
+    expected = (overlap_weight * overlap_mean + type1_not_gcf * n + gcf_not_type1 * m 
+                + not_type1_not_gcf * (N - n - m))
+    variance = overlap_weight ** 2 * overlap_var
+    variance[variance < 1e-09] = 1
+
+    expected.flags.writeable = False
+    variance.flags.writeable = False
+    if len(_METCALF_TABLE_CACHE) >= _METCALF_TABLE_CACHE_SIZE:
+        _METCALF_TABLE_CACHE.pop(next(iter(_METCALF_TABLE_CACHE)))
+    _METCALF_TABLE_CACHE[key] = (expected, variance)
+    return expected, variance
+
+# cache of tables returned by hypergeom_sf_table, keyed by n_strains
+_HYPERGEOM_TABLE_CACHE = {}
+_HYPERGEOM_TABLE_CACHE_SIZE = 4
+
+# maximum number of elements in the temporary arrays used to fill in a HypergeomSFTable
+_HYPERGEOM_BLOCK_SIZE = 1024 * 1024
+
+class HypergeomSFTable(object):
+    """
+    The hypergeometric p-value P(overlap >= k) of finding at least k shared strains
+    between an object found in n strains and a GCF found in m strains (out of
+    n_strains in total), if the overlap is random. This is the same as 
+    hypergeom.sf(k, n_strains, m, n, loc=1).
+
+    The p-value only depends on (k, n, m), so rather than evaluating it for every
+    link it's calculated once per (n, m) pair and then looked up. The values for 
+    each pair are only calculated when a pair is first looked up, and only for 
+    the possible overlaps k = 0..min(n, m) (the p-value is symmetric in n and m, 
+    so each pair is stored once, as (min(n, m), max(n, m))). They are stored one 
+    pair after another in a single array, the values for a pair start at the 
+    offset stored for its key n * (n_strains + 1) + m.
+    """
+
+    def __init__(self, n_strains):
+        self.n_strains = n_strains
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.offsets = np.zeros(0, dtype=np.int64)
+        self.values = np.zeros(0, dtype=np.float64)
+        self._log_factorial = None
+
+    def _log_comb(self, n, k):
+        # log(comb(n, k)) for integer arrays with 0 <= k <= n (other values are
+        # only used where the pmf is 0, they just have to be valid indices)
+        log_factorial = self._log_factorial
+        return log_factorial[n] - log_factorial[np.minimum(k, n)] - log_factorial[np.maximum(n - k, 0)]
+
+    def _calculate(self, n, m):
+        # the p-values for the pairs (n[i], m[i]) with n[i] <= m[i]. returns the
+        # values of all pairs in a single array, and the offset of each pair in it
+        if self._log_factorial is None:
+            from scipy.special import gammaln
+            self._log_factorial = gammaln(np.arange(1, self.n_strains + 2, dtype=np.float64))
+        lengths = n + 1
+        # (in order of the number of values, in blocks which limit the size of the
+        # temporary arrays)
+        order = np.argsort(lengths, kind='stable')
+        sorted_lengths = lengths[order]
+        offsets = np.zeros(len(n), dtype=np.int64)
+        offsets[order] = np.cumsum(sorted_lengths) - sorted_lengths
+
+        n_strains = self.n_strains
+        values = []
+        start = 0
+        while start < len(order):
+            block_sizes = np.arange(1, len(order) - start + 1) * sorted_lengths[start:]
+            end = start + max(1, int(np.searchsorted(block_sizes, _HYPERGEOM_BLOCK_SIZE, side='right')))
+            block = order[start:end]
+            block_n = n[block][:, None]
+            block_m = m[block][:, None]
+            k = np.arange(sorted_lengths[end - 1])[None, :]
+            # pmf of the overlap, comb(m, k) * comb(N - m, n - k) / comb(N, n), then sum
+            # from the tail (avoids cancellation in 1 - cdf). the pmf is 0 for k > n, 
+            # so the sums of the shorter rows aren't affected
+            n_k = np.maximum(block_n - k, 0)
+            log_pmf = (self._log_comb(block_m, k) + self._log_comb(n_strains - block_m, n_k) 
+                       - self._log_comb(n_strains, block_n))
+            pmf = np.exp(np.where((k <= block_n) & (n_k <= n_strains - block_m), log_pmf, -np.inf))
+            sf = np.minimum(np.cumsum(pmf[:, ::-1], axis=1)[:, ::-1], 1)
+            values.append(sf[k <= block_n])
+            start = end
+        return offsets, np.concatenate(values)
+
+    def _pair_offsets(self, type1_values, gcf_values):
+        # the offsets in self.values of all pairs of the given (distinct) type1 
+        # and GCF counts, calculating the p-values of any pairs not in the table yet
+        n = np.minimum(type1_values[:, None], gcf_values[None, :])
+        m = np.maximum(type1_values[:, None], gcf_values[None, :])
+        unique_keys, inverse = np.unique(n * (self.n_strains + 1) + m, return_inverse=True)
+        pos = np.minimum(np.searchsorted(self.keys, unique_keys), max(len(self.keys) - 1, 0))
+        missing = unique_keys if len(self.keys) == 0 else unique_keys[self.keys[pos] != unique_keys]
+        if len(missing) > 0:
+            offsets, values = self._calculate(missing // (self.n_strains + 1), missing % (self.n_strains + 1))
+            keys = np.concatenate([self.keys, missing])
+            order = np.argsort(keys, kind='stable')
+            self.keys = keys[order]
+            self.offsets = np.concatenate([self.offsets, offsets + len(self.values)])[order]
+            self.values = np.concatenate([self.values, values])
+            pos = np.searchsorted(self.keys, unique_keys)
+        return self.offsets[pos][inverse.reshape(-1)].reshape(n.shape)
+
+    def lookup(self, overlap_counts, type1_counts, gcf_counts):
+        """
+        P-values for (broadcastable) arrays of overlap counts and strain counts
+        of type1 objects and GCFs
+        """
+        type1_values, type1_index = np.unique(np.asarray(type1_counts, dtype=np.int64), return_inverse=True)
+        gcf_values, gcf_index = np.unique(np.asarray(gcf_counts, dtype=np.int64), return_inverse=True)
+        offsets = self._pair_offsets(type1_values, gcf_values)
+        type1_index = type1_index.reshape(np.shape(type1_counts))
+        gcf_index = gcf_index.reshape(np.shape(gcf_counts))
+        index = offsets[type1_index, gcf_index]
+        index += np.asarray(overlap_counts).astype(np.int64, copy=False)
+        return self.values[index]
+
+def hypergeom_sf_table(n_strains):
+    """
+    Return the (cached) HypergeomSFTable for n_strains strains
+    """
+    table = _HYPERGEOM_TABLE_CACHE.get(n_strains, None)
+    if table is None:
+        if len(_HYPERGEOM_TABLE_CACHE) >= _HYPERGEOM_TABLE_CACHE_SIZE:
+            _HYPERGEOM_TABLE_CACHE.pop(next(iter(_HYPERGEOM_TABLE_CACHE)))
+        table = _HYPERGEOM_TABLE_CACHE[n_strains] = HypergeomSFTable(n_strains)
+    return table
+
+def hypergeom_sf_lookup(overlap_counts, n_strains, type1_counts, gcf_counts):
+    """
+    Hypergeometric p-values for (broadcastable) arrays of overlap counts and 
+    strain counts of type1 objects and GCFs, looked up in hypergeom_sf_table
+    """
+    return hypergeom_sf_table(n_strains).lookup(overlap_counts, type1_counts, gcf_counts)
+
+def _null_scores(M_type1_cond, M_type2_cond, method, weights):
+    table = calc_correlation_matrix(M_type1_cond, M_type2_cond, lazy=True)
+    if method == 'metcalf':
+        return table.metcalf(*weights)
+    elif method == 'hg':
+        return hypergeom_sf_lookup(table.both, table.num_conditions, 
+                                   table.sum_type1[:, None], table.sum_type2[None, :])
+    raise Exception('Permutation tests are only supported for metcalf and hg scores')
+
+def permutation_null_counts(M_type1_cond, M_type2_cond, seeds, 
+                            method='metcalf', weights=(10, -10, 0, 1), greater=True):
+    """
+    Compare link scores with scores obtained after randomly shuffling the conditions
+    (strain labels) of the type1 objects, which breaks any real co-occurence while
+    keeping the number of strains of every object the same.
+
+    Input:
+    M_type1_cond, M_type2_cond: dense 0/1 occurrence matrices
+    seeds: one seed (anything accepted by np.random.default_rng) per permutation
+    method: 'metcalf' or 'hg' (using weights for metcalf scores)
+    greater: if True high scores are significant, otherwise low scores (e.g. for 
+             hg p-values)
+
+    Output:
+    exceed[x, y] --- number of permutations where the score of (x, y) was at least as
+                     extreme as the real score, i.e. >= (or <= if not greater)
+    extremes[i, y] --- highest (or lowest) score of type2_y in permutation i
+
+    Only these are kept, so memory use doesn't grow with the number of permutations.
+    """
+    observed = _null_scores(M_type1_cond, M_type2_cond, method, weights)
+    exceed = np.zeros(observed.shape, dtype=np.int32)
+    extremes = np.zeros((len(seeds), M_type2_cond.shape[0]))
+    for i, seed in enumerate(seeds):
+        order = np.random.default_rng(seed).permutation(M_type1_cond.shape[1])
+        scores = _null_scores(M_type1_cond[:, order], M_type2_cond, method, weights)
+        if greater:
+            exceed += scores >= observed
+            extremes[i] = scores.max(axis=0, initial=-np.inf)
+        else:
+            exceed += scores <= observed
+            extremes[i] = scores.min(axis=0, initial=np.inf)
+    return exceed, extremes
+
+
+# names of the matrices returned by calc_likelihood_matrix (in order)
+LIKELIHOOD_MATRICES = ('P_type2_given_type1', 'P_type2_not_type1', 'P_type1_given_type2', 'P_type1_not_type2')
 
 def calc_likelihood_matrix(M_type1_cond, M_type2_cond, 
-                           M_type1_type2, M_type1_nottype2, M_nottype1_type2):
+                           M_type1_type2, M_type1_nottype2, M_nottype1_type2,
+                           outputs=LIKELIHOOD_MATRICES):
     """ 
     Calculate correlation matrices from co-occurence matrices
     Input:
@@ -45,37 +683,42 @@ def calc_likelihood_matrix(M_type1_cond, M_type2_cond,
     M_type1_type2(x,y) --- number of conditions where type1_x and type2_y co-occur
     M_type1_nottype2(x,y) --- number of conditions where type1_x and NOT-type2_y co-occur
     M_nottype1_type2(x,y) --- number of conditions where NOT-type1_x and type2_y co-occur
+    outputs --- names (from LIKELIHOOD_MATRICES) of the matrices to calculate,
+                any others are returned as None (and their inputs can be None too)
 
     Output:
     Four likelihood matrices of size len(type1) x len(type2):
     P_type2_given_type1, P_type2_not_type1, P_type1_given_type2, P_type1_not_type2
     """
     
-    dim1, dim2 = M_type1_type2.shape
     num_conditions = M_type2_cond.shape[1]
 
-    P_type2_given_type1 = np.zeros((dim1, dim2))
-    P_type2_not_type1 = np.zeros((dim1, dim2))
-    P_type1_given_type2 = np.zeros((dim1, dim2))
-    P_type1_not_type2 = np.zeros((dim1, dim2))
+    # the counts are divided by the row/column sums through broadcasting, so 
+    # the only full-size arrays allocated are the requested output matrices
+    P_sum_type1 = np.sum(M_type1_cond, axis=1).astype(np.float64)
+    P_sum_type1[P_sum_type1 < 1] = 1 #avoid later division by 0
+    P_sum_type2 = np.sum(M_type2_cond, axis=1).astype(np.float64)
+    P_sum_type2[P_sum_type2 < 1] = 1 #avoid later division by 0
+
+    P_type2_given_type1 = P_type2_not_type1 = P_type1_given_type2 = P_type1_not_type2 = None
 
     # Calculate P_type2_given_type1 matrix
-    P_sum_type1 = np.sum(M_type1_cond, axis=1)
-    P_sum_type1[P_sum_type1 < 1] = 1 #avoid later division by 0
-    P_type2_given_type1 = M_type1_type2/np.tile(P_sum_type1, (dim2, 1)).transpose(1, 0)
+    if 'P_type2_given_type1' in outputs:
+        P_type2_given_type1 = np.divide(M_type1_type2, P_sum_type1[:, None], dtype=np.float64)
 
     # Calculate P_type1_given_type2 matrix
-    P_sum_type2 = np.sum(M_type2_cond, axis=1)
-    P_sum_type2[P_sum_type2 < 1] = 1 #avoid later division by 0
-    P_type1_given_type2 = M_type1_type2/np.tile(P_sum_type2, (dim1, 1))
+    if 'P_type1_given_type2' in outputs:
+        P_type1_given_type2 = np.divide(M_type1_type2, P_sum_type2[None, :], dtype=np.float64)
 
     # Calculate P_type2_not_type1 matrix
-    P_sum_not_type1 = num_conditions - P_sum_type1
-    P_type2_not_type1 = M_nottype1_type2/np.tile(P_sum_not_type1, (dim2, 1)).transpose(1, 0)
+    if 'P_type2_not_type1' in outputs:
+        P_sum_not_type1 = num_conditions - P_sum_type1
+        P_type2_not_type1 = np.divide(M_nottype1_type2, P_sum_not_type1[:, None], dtype=np.float64)
 
     # Calculate P_type1_not_type2 matrix
-    P_sum_not_type2 = num_conditions - P_sum_type2  
-    P_type1_not_type2 = M_type1_nottype2/np.tile(P_sum_not_type2, (dim1, 1))
+    if 'P_type1_not_type2' in outputs:
+        P_sum_not_type2 = num_conditions - P_sum_type2  
+        P_type1_not_type2 = np.divide(M_type1_nottype2, P_sum_not_type2[None, :], dtype=np.float64)
     
     return P_type2_given_type1, P_type2_not_type1, P_type1_given_type2, P_type1_not_type2
         
@@ -183,6 +826,107 @@ def pair_prob_hg(k, N, Nx, Ny):
     return term1 * term2 / term3 
     
 
+# Batched versions of pair_prob_hg, pair_prob_approx and link_prob
+#
+# These compute the same values for arrays of candidate links at once. All
+# factorial ratios and running products are evaluated in log space (via gammaln), 
+# so they don't overflow for large numbers of strains.
+
+def _log_falling_factorial(n, k):
+    # log(n * (n-1) * ... * (n-k+1)), or -inf if one of the factors is 0
+    # (scipy is imported here rather than at the top of the module because it's slow to import)
+    from scipy.special import gammaln
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = gammaln(n + 1) - gammaln(n - k + 1)
+    return np.where(n - k + 1 > 0, result, -np.inf)
+
+def _log_comb(n, k):
+    from scipy.special import gammaln
+    with np.errstate(invalid='ignore'):
+        result = gammaln(n + 1) - gammaln(k + 1) - gammaln(n - k + 1)
+    return np.where((k >= 0) & (k <= n), result, -np.inf)
+
+def _log_nonhit_prod(Nstr, Nx, Ny, hits):
+    # log of the "product of all non-hits" and "product of probability updates" 
+    # terms with p_mean = 1/Nstr:
+    #   prod_{i<Ny-hits} (Nstr-Nx-i)/Nstr * prod_{j<Ny} Nstr/(Nstr-j)
+    log_prod1 = _log_falling_factorial(Nstr - Nx, Ny - hits) - (Ny - hits) * np.log(Nstr)
+    log_prod2 = Ny * np.log(Nstr) - _log_falling_factorial(Nstr, Ny)
+    return log_prod1 + log_prod2
+
+def pair_prob_hg_batch(k, N, Nx, Ny):
+    """
+    Array version of pair_prob_hg: hypergeometric probability to draw k times 
+    type(Ny) out of N elements (whereof Ny type(Ny)s), when drawing Nx times in total.
+    All arguments can be arrays (or scalars) of the same shape.
+    """
+    k, Nx, Ny = [np.asarray(x, dtype=np.float64) for x in (k, Nx, Ny)]
+    return np.exp(_log_comb(Ny, k) + _log_comb(N - Ny, Nx - k) - _log_comb(N, Nx))
+
+def pair_prob_approx_batch(P_str_sum, Nx, Ny, hits, Nstr):
+    """
+    Array version of pair_prob_approx.
+
+    Parameters
+    ----------
+    P_str_sum: numpy array
+        For each candidate, the sum of P_str over the strains where the GCF occurs
+        (i.e. np.sum(P_str[XG])).
+    Nx: numpy array
+        Number of strains that contain the GCF of each candidate.
+    Ny: numpy array
+        Number of strains that contain the spectrum/family of each candidate.
+    hits: numpy array
+        Number of hits for each candidate.
+    Nstr: int
+        Number of strains.
+    """
+    from scipy.special import gammaln, gammasgn, xlogy
+    P_str_sum, Nx, Ny, hits = [np.asarray(x, dtype=np.float64) for x in (P_str_sum, Nx, Ny, hits)]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        p_hit_mean = P_str_sum / Nx
+        p_nohit_mean = (1 - P_str_sum) / (Nstr - Nx)
+        p_mean = (hits * p_hit_mean + (Ny - hits) * p_nohit_mean) / Ny
+
+        # product of all hits: p_hit_mean^hits * Nx!/(Nx-hits)!
+        log_prod0 = xlogy(hits, p_hit_mean) + _log_falling_factorial(Nx, hits)
+        log_prod1 = _log_falling_factorial(Nstr - Nx, Ny - hits) - (Ny - hits) * np.log(Nstr)
+
+        # product of probability updates: prod_{j<Ny} 1/(1 - j*p_mean)
+        #   = 1 / (p_mean^Ny * gamma(1/p_mean + 1) / gamma(1/p_mean - Ny + 1))
+        # the gamma function can be negative here, so keep track of the sign
+        inv_p = 1 / p_mean
+        log_prod2 = -(xlogy(Ny, p_mean) + gammaln(inv_p + 1) - gammaln(inv_p - Ny + 1))
+        sign = gammasgn(inv_p + 1) * gammasgn(inv_p - Ny + 1)
+        no_update = (Ny <= 1) | (p_mean == 0)
+        log_prod2 = np.where(no_update, 0, log_prod2)
+        sign = np.where(no_update, 1, sign)
+
+        return sign * np.exp(_log_comb(Ny, hits) + log_prod0 + log_prod1 + log_prod2)
+
+def link_prob_batch(log_P_shared, Nx, Ny, hits, Nstr):
+    """
+    Array version of link_prob.
+
+    Parameters
+    ----------
+    log_P_shared: numpy array
+        For each candidate, the sum of log(P_str) over the strains where the GCF 
+        and the spectrum/family co-occur (i.e. np.log(np.prod(P_str[XGS]))).
+    Nx: numpy array
+        Number of strains that contain the GCF of each candidate.
+    Ny: numpy array
+        Number of strains that contain the spectrum/family of each candidate.
+    hits: numpy array
+        Number of strains where GCF and spectrum/family co-occur (len(XGS)).
+    Nstr: int
+        Number of strains.
+    """
+    log_P_shared, Nx, Ny, hits = [np.asarray(x, dtype=np.float64) for x in (log_P_shared, Nx, Ny, hits)]
+    return np.exp(_log_falling_factorial(Ny, hits) + log_P_shared + _log_nonhit_prod(Nstr, Nx, Ny, hits))
+
+
 def hit_prob_dist(N, Nx, Ny, nys):
     
     import math
@@ -1,14 +1,15 @@
+import heapq
 import itertools
 import random
 import os
+from collections.abc import Mapping
 
 import numpy as np
 
-from .data_linking import DataLinks, LinkFinder
+from .data_linking_functions import select_rows, group_by_key, merge_link_keys, top_k_indices
 from ..genomics import BGC, GCF
 from ..metabolomics import Spectrum, MolecularFamily
-from ..scoring.rosetta.rosetta import Rosetta
-from ..pickler import load_pickled_data, save_pickled_data
+from ..arraystore import load_store, load_store_metadata, save_store
 
 from ..logconfig import LogConfig
 logger = LogConfig.getLogger(__file__)
@@ -31,6 +32,12 @@ class LinkCollection(object):
         self._link_data = {}
         self._targets = {}
         self._and_mode = and_mode
+        # cached results of get_sorted_links, see _changed
+        self._sorted_links = {}
+
+    def _changed(self):
+        # called whenever the set of links changes
+        self._sorted_links = {}
 
     def _add_links_from_method(self, method, object_links):
         if method in self._methods:
@@ -54,6 +61,7 @@ class LinkCollection(object):
                 self._merge_and_mode(object_links)
 
         self._methods.add(method)
+        self._changed()
 
     def _merge_and_mode(self, object_links):
         # set of ObjectLinks common to existing + new results 
@@ -105,6 +113,7 @@ class LinkCollection(object):
     def filter_sources(self, callable_obj):
         len_before = len(self._link_data)
         self._link_data = {k: v for k, v in self._link_data.items() if callable_obj(k)}
+        self._changed()
         logger.debug('filter_sources: {} => {}'.format(len_before, len(self._link_data)))
 
     def filter_targets(self, callable_obj, sources=None):
@@ -118,6 +127,7 @@ class LinkCollection(object):
 
         for source in to_remove:
             del self._link_data[source]
+        self._changed()
 
     def filter_links(self, callable_obj, sources=None):
         to_remove = []
@@ -130,8 +140,18 @@ class LinkCollection(object):
 
         for source in to_remove:
             del self._link_data[source]
-
-    def get_sorted_links(self, method, source, reverse=True, strict=False):
+        self._changed()
+
+    def filter(self, *filters):
+        """
+        Keep only the links accepted by all of the given LinkFilters 
+        (e.g. ScoreFilter, SharedStrainsFilter)
+        """
+        len_before = len(self)
+        self.filter_links(lambda link: all(f(link) for f in filters))
+        logger.debug('filter: {} => {}'.format(len_before, len(self)))
+
+    def get_sorted_links(self, method, source, reverse=True, strict=False, top_k=None):
         # This method allows for the sorting of a set of links according to the 
         # sorting implemented by a specific method. However because there may be
         # links from multiple methods present in the collection, it isn't as simple
@@ -142,13 +162,29 @@ class LinkCollection(object):
         # of the total collection if multiple methods were used to generate it. If 
         # set to False, it will return a list consisting of the sorted links for
         # the given method, with any remaining links appended in arbitrary order.
+        #
+        # If top_k is set, only the first top_k links are returned. For methods 
+        # with a sort_key these are found with a heap instead of sorting all the 
+        # links. The sorted links are cached until the collection is changed.
+
+        cache_key = (method, source, reverse)
+        sorted_links_for_method, sorted_count = self._sorted_links.get(cache_key, (None, None))
+        if sorted_links_for_method is None or (sorted_count is not None and (top_k is None or top_k > sorted_count)):
+            links = [link for link in self._link_data[source].values() if method in link.methods]
+            if top_k is not None and top_k < len(links) and method.sort_key is not None:
+                select = heapq.nlargest if reverse else heapq.nsmallest
+                sorted_links_for_method, sorted_count = select(top_k, links, key=method.sort_key), top_k
+            else:
+                # run <method>.sort on the links found by that method
+                sorted_links_for_method, sorted_count = method.sort(links, reverse), None
+            self._sorted_links[cache_key] = (sorted_links_for_method, sorted_count)
 
-        # run <method>.sort on the links found by that method
-        sorted_links_for_method = method.sort([link for link in self._link_data[source].values() if method in link.methods], reverse)
+        sorted_links_for_method = sorted_links_for_method[:top_k]
 
-        if not strict:
+        if not strict and (top_k is None or len(sorted_links_for_method) < top_k):
             # append any remaining links 
-            sorted_links_for_method.extend([link for link in self._link_data[source].values() if method not in link.methods])
+            remaining = [link for link in self._link_data[source].values() if method not in link.methods]
+            sorted_links_for_method.extend(remaining if top_k is None else remaining[:top_k - len(sorted_links_for_method)])
 
         return sorted_links_for_method
 
@@ -196,12 +232,28 @@ class ObjectLink(object):
      - a (possibly empty) list of Strain objects shared between source and target
      - the output of the scoring method(s) used for this link (e.g. a metcalf score)
     """
+    __slots__ = ('source', 'target', '_shared_strains', '_shared_strains_batch', '_method_data')
+
     def __init__(self, source, target, method, data=None, shared_strains=[]):
         self.source = source
         self.target = target
-        self.shared_strains = shared_strains
+        self._shared_strains = shared_strains
+        # SharedStrainBatch which will fill in the shared strains when they're first
+        # accessed (or None if they're already known)
+        self._shared_strains_batch = None
         self._method_data = {method: data}
 
+    @property
+    def shared_strains(self):
+        if self._shared_strains_batch is not None:
+            self._shared_strains_batch.resolve()
+        return self._shared_strains
+
+    @shared_strains.setter
+    def shared_strains(self, shared_strains):
+        self._shared_strains = shared_strains
+        self._shared_strains_batch = None
+
     def _merge(self, other_link):
         self._method_data.update(other_link._method_data)
         return self
@@ -236,6 +288,606 @@ class ObjectLink(object):
     def __repr__(self):
         return str(self)
 
+class SharedStrainBatch(object):
+    """
+    Calculates the shared strains for a set of ObjectLinks between Spectrum/
+    MolecularFamily objects and GCFs in a single pass (see DataLinks.shared_strains).
+
+    If lazy is True this is deferred until the shared_strains of one of the links
+    is first accessed, and then done for all of them.
+    """
+
+    def __init__(self, datalinks, strains, links, lazy=False):
+        self.datalinks = datalinks
+        self.strains = strains
+        self.links = list(links)
+        if lazy:
+            for link in self.links:
+                link._shared_strains_batch = self
+        else:
+            self.resolve()
+
+    def resolve(self):
+        links, self.links = self.links, []
+        if len(links) == 0:
+            return
+
+        # the metabolomic object is always the first of the pair
+        pairs = [(link.target, link.source) if isinstance(link.source, GCF) else (link.source, link.target) for link in links]
+        shared = self.datalinks.shared_strains([a for a, b in pairs], [b for a, b in pairs])
+
+        # map strain indices to Strain objects with a single lookup table
+        strain_lookup = np.empty(shared.num_strains, dtype=object)
+        strain_lookup[:] = [self.strains.lookup_index(i) for i in range(shared.num_strains)]
+        for i, link in enumerate(links):
+            link.shared_strains = list(strain_lookup[shared.row(i)])
+
+# the objects in a ColumnarLinkCollection are identified by integer keys, 
+# combining the index of their type in _KEY_TYPES with their ID:
+#   key = (type index << _KEY_SHIFT) | object.id
+_KEY_TYPES = (Spectrum, MolecularFamily, GCF, BGC)
+_KEY_SHIFT = 32
+_KEY_ID_MASK = (1 << _KEY_SHIFT) - 1
+_KEY_SPECTRUM, _KEY_MOLFAM, _KEY_GCF, _KEY_BGC = range(len(_KEY_TYPES))
+
+def _type_index(obj):
+    for i, cls in enumerate(_KEY_TYPES):
+        if isinstance(obj, cls):
+            return i
+    raise Exception('Unsupported object type in link collection: {}'.format(type(obj)))
+
+def _object_key(obj):
+    return (_type_index(obj) << _KEY_SHIFT) | obj.id
+
+def _data_column(data):
+    # numeric method data (e.g. scores) is stored as float64, anything else as objects
+    if all(isinstance(x, (int, float, np.number)) for x in data):
+        return np.asarray(data, dtype=np.float64)
+    column = np.empty(len(data), dtype=object)
+    for i, x in enumerate(data):
+        column[i] = x
+    return column
+
+def _missing_column(column, length):
+    # column of the same type as <column> for links not found by a method
+    if column.dtype == object:
+        return np.full(length, None, dtype=object)
+    if column.dtype == bool:
+        return np.zeros(length, dtype=bool)
+    return np.full(length, np.nan, dtype=column.dtype)
+
+def _gather_column(column, rows):
+    # column[rows], with missing values where rows is -1
+    gathered = _missing_column(column, len(rows))
+    found = rows >= 0
+    gathered[found] = column[rows[found]]
+    return gathered
+
+class ColumnarLinkCollection(LinkCollection):
+    """
+    Alternative LinkCollection which stores the links as NumPy arrays rather
+    than as one ObjectLink per link:
+     - the source and target of each link (as integer keys, see _object_key)
+     - one data column per method (e.g. the scores), and a mask of the links 
+       each method has found
+     - the shared strains of each link (as an OccurrenceCSR)
+
+    The interface is the same as LinkCollection. The .links property behaves 
+    like the {source: {target: ObjectLink}} dict, but ObjectLinks are only 
+    created when they are accessed. They are snapshots of the data in the 
+    collection, so any changes made to them are not stored.
+    """
+
+    def __init__(self, and_mode=True):
+        super(ColumnarLinkCollection, self).__init__(and_mode)
+        # methods in the order they were added (self._methods is a set)
+        self._method_list = []
+        # {key: object} for every source/target
+        self._objects = {}
+        self._source_keys = np.zeros(0, dtype=np.int64)
+        self._target_keys = np.zeros(0, dtype=np.int64)
+        self._data = {}
+        self._found = {}
+        self._shared_strains = None
+        self._shared_strains_source = None
+        self._strain_lookup = None
+        self._index = None
+        # results of methods which haven't been merged yet (see _merge_pending)
+        self._pending = []
+
+    def _object_keys(self, objects, ids):
+        # return the keys of objects[ids] (e.g. objects=NPLinker.spectra), where 
+        # all the objects are of the same type
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return ids
+        type_index = _type_index(objects[int(ids[0])])
+        unique_ids, inverse = np.unique(ids, return_inverse=True)
+        keys = np.zeros(len(unique_ids), dtype=np.int64)
+        for j, i in enumerate(unique_ids.tolist()):
+            keys[j] = (type_index << _KEY_SHIFT) | objects[i].id
+            self._objects.setdefault(int(keys[j]), objects[i])
+        return keys[inverse.ravel()]
+
+    def _keys_for(self, objects):
+        keys = np.array([_object_key(obj) for obj in objects], dtype=np.int64)
+        for key, obj in zip(keys.tolist(), objects):
+            self._objects.setdefault(key, obj)
+        return keys
+
+    def _add_links_from_method(self, method, object_links):
+        # convert the {source: {target: ObjectLink}} results to columns
+        sources, targets, data = [], [], []
+        for source, links in object_links.items():
+            for target, link in links.items():
+                sources.append(source)
+                targets.append(target)
+                data.append(link.data(method))
+        self._add_link_arrays(method, self._keys_for(sources), self._keys_for(targets), data)
+
+    def _add_link_arrays(self, method, source_keys, target_keys, data):
+        """
+        Add the results of a method as arrays of source keys, target keys and 
+        the data for each link (see _object_keys). 
+
+        The results are merged with the existing links the next time the 
+        collection is used, so the results of several methods are merged 
+        in a single pass.
+        """
+        if method in self._methods:
+            # this is probably an error...
+            raise Exception('Duplicate method found in LinkCollection: {}'.format(method.name))
+
+        self._methods.add(method)
+        self._pending.append((method, np.asarray(source_keys, dtype=np.int64), np.asarray(target_keys, dtype=np.int64), _data_column(data)))
+
+    def _merge_pending(self):
+        if len(self._pending) == 0:
+            return
+
+        # group each set of results by source first, so the sources (and the 
+        # targets of each source) end up in the order they were first added
+        pending = []
+        for method, source_keys, target_keys, data in self._pending:
+            rows = group_by_key(source_keys)[1]
+            pending.append((method, source_keys[rows], target_keys[rows], data[rows]))
+        self._pending = []
+        source_keys = [keys for _, keys, _, _ in pending]
+        target_keys = [keys for _, _, keys, _ in pending]
+        if len(self._method_list) > 0:
+            # the existing links are merged as if they were another method
+            source_keys.insert(0, self._source_keys)
+            target_keys.insert(0, self._target_keys)
+        logger.debug('Merging results from {} methods in {} mode'.format(len(source_keys), 'AND' if self._and_mode else 'OR'))
+
+        # the first method's results are always kept, even in AND mode
+        and_mode = self._and_mode and len(source_keys) > 1
+        self._source_keys, self._target_keys, rows = merge_link_keys(source_keys, target_keys, and_mode)
+
+        if len(self._method_list) > 0:
+            existing_rows, rows = rows[0], rows[1:]
+            for method in self._method_list:
+                self._data[method] = _gather_column(self._data[method], existing_rows)
+                self._found[method] = _gather_column(self._found[method], existing_rows)
+            if self._shared_strains is not None and np.all(existing_rows >= 0):
+                self._shared_strains = select_rows(self._shared_strains, existing_rows)
+            else:
+                self._shared_strains = None
+
+        for (method, _, _, data), method_rows in zip(pending, rows):
+            self._data[method] = _gather_column(data, method_rows)
+            self._found[method] = method_rows >= 0
+            self._method_list.append(method)
+
+        self._changed()
+        # keep the links grouped by source, so the order of the sources doesn't 
+        # change when links are removed later
+        self._select(self._get_index()[2])
+
+    def _select(self, keep):
+        # keep only the links where keep is True (or the links given by an index array)
+        self._source_keys = self._source_keys[keep]
+        self._target_keys = self._target_keys[keep]
+        for method in self._data:
+            self._data[method] = self._data[method][keep]
+            self._found[method] = self._found[method][keep]
+        if self._shared_strains is not None:
+            self._shared_strains = select_rows(self._shared_strains, keep)
+        self._changed()
+
+    def _changed(self):
+        super(ColumnarLinkCollection, self)._changed()
+        self._index = None
+
+    def _get_index(self):
+        # the source keys (in order of first appearance) and the rows of the links for 
+        # each source: rows[bounds[i]:bounds[i + 1]] are the links of source_keys[i]
+        self._merge_pending()
+        if self._index is None:
+            source_keys, rows, bounds = group_by_key(self._source_keys)
+            lookup = {key: i for i, key in enumerate(source_keys.tolist())}
+            self._index = (source_keys, lookup, rows, bounds)
+        return self._index
+
+    def _source_rows(self, source):
+        source_keys, lookup, rows, bounds = self._get_index()
+        i = lookup[_object_key(source)]
+        return rows[bounds[i]:bounds[i + 1]]
+
+    def _scope_mask(self, sources):
+        # mask of the links of the given sources (all links if sources is None)
+        self._merge_pending()
+        if sources is None:
+            return np.ones(len(self._source_keys), dtype=bool)
+        return np.isin(self._source_keys, self._keys_for(list(sources)))
+
+    def set_shared_strains(self, datalinks, strains, lazy=False):
+        """
+        Calculate the shared strains of all links between Spectrum/MolecularFamily
+        objects and GCFs in one go (see DataLinks.shared_strain_rows), using
+        strains (a StrainCollection) to look up the Strain objects. If lazy is True
+        this only happens when they are first needed.
+        """
+        self._shared_strains_source = (datalinks, strains)
+        self._shared_strains = None
+        if not lazy:
+            self._resolve_shared_strains()
+
+    def _resolve_shared_strains(self):
+        self._merge_pending()
+        if self._shared_strains is not None or self._shared_strains_source is None:
+            return
+
+        datalinks, strains = self._shared_strains_source
+        source_is_gcf = (self._source_keys >> _KEY_SHIFT) == _KEY_GCF
+        type1_keys = np.where(source_is_gcf, self._target_keys, self._source_keys)
+        gcf_keys = np.where(source_is_gcf, self._source_keys, self._target_keys)
+        valid = ((gcf_keys >> _KEY_SHIFT) == _KEY_GCF) & np.isin(type1_keys >> _KEY_SHIFT, [_KEY_SPECTRUM, _KEY_MOLFAM])
+
+        # find the matrix rows once per distinct spectrum/family
+        unique_keys, inverse = np.unique(type1_keys[valid], return_inverse=True)
+        unique_spec_rows, unique_fam_rows = datalinks.type1_rows([self._objects[key] for key in unique_keys.tolist()])
+        spec_rows = np.full(len(valid), -1, dtype=np.int64)
+        fam_rows = np.full(len(valid), -1, dtype=np.int64)
+        spec_rows[valid] = unique_spec_rows[inverse]
+        fam_rows[valid] = unique_fam_rows[inverse]
+        gcf_rows = np.where(valid, gcf_keys & _KEY_ID_MASK, 0)
+
+        self._shared_strains = datalinks.shared_strain_rows(spec_rows, fam_rows, gcf_rows)
+        if self._strain_lookup is None or len(self._strain_lookup) != self._shared_strains.num_strains:
+            self._strain_lookup = np.empty(self._shared_strains.num_strains, dtype=object)
+            self._strain_lookup[:] = [strains.lookup_index(i) for i in range(self._shared_strains.num_strains)]
+
+    def shared_strain_counts(self):
+        """
+        Return the number of shared strains of each link (0 if they haven't been set)
+        """
+        self._resolve_shared_strains()
+        if self._shared_strains is None:
+            return np.zeros(len(self._source_keys), dtype=np.int64)
+        return self._shared_strains.counts()
+
+    def _link(self, row):
+        # create an ObjectLink for a single link
+        source = self._objects[int(self._source_keys[row])]
+        target = self._objects[int(self._target_keys[row])]
+        methods = [method for method in self._method_list if self._found[method][row]]
+        link = ObjectLink(source, target, methods[0], self._data[methods[0]][row])
+        for method in methods[1:]:
+            link.set_data(method, self._data[method][row])
+        self._resolve_shared_strains()
+        if self._shared_strains is not None:
+            link.shared_strains = list(self._strain_lookup[self._shared_strains.row(row)])
+        return link
+
+    def filter_no_shared_strains(self):
+        len_before = len(self)
+        self._select(self.shared_strain_counts() > 0)
+        logger.debug('filter_no_shared_strains: {} => {}'.format(len_before, len(self)))
+
+    def filter(self, *filters):
+        len_before = len(self)
+        self._merge_pending()
+        keep = np.ones(len(self._source_keys), dtype=bool)
+        for link_filter in filters:
+            keep &= link_filter.mask(self)
+        self._select(keep)
+        logger.debug('filter: {} => {}'.format(len_before, len(self)))
+
+    def filter_sources(self, callable_obj):
+        len_before = len(self)
+        source_keys = self._get_index()[0]
+        keep_keys = [key for key in source_keys.tolist() if callable_obj(self._objects[key])]
+        self._select(np.isin(self._source_keys, keep_keys))
+        logger.debug('filter_sources: {} => {}'.format(len_before, len(self)))
+
+    def filter_targets(self, callable_obj, sources=None):
+        scope = self._scope_mask(sources)
+        target_keys = np.unique(self._target_keys[scope])
+        remove_keys = [key for key in target_keys.tolist() if not callable_obj(self._objects[key])]
+        self._select(~(scope & np.isin(self._target_keys, remove_keys)))
+
+    def filter_links(self, callable_obj, sources=None):
+        scope = self._scope_mask(sources)
+        keep = np.ones(len(self._source_keys), dtype=bool)
+        for row in np.flatnonzero(scope):
+            keep[row] = callable_obj(self._link(row))
+        self._select(keep)
+
+    def get_sorted_links(self, method, source, reverse=True, strict=False, top_k=None):
+        rows = self._source_rows(source)
+        found = self._found[method][rows]
+
+        # the sorted rows are cached until the collection is changed
+        cache_key = (method, _object_key(source), reverse)
+        sorted_rows, sorted_count = self._sorted_links.get(cache_key, (None, None))
+        if sorted_rows is None or (sorted_count is not None and (top_k is None or top_k > sorted_count)):
+            method_rows = rows[found]
+            data = self._data[method][method_rows]
+            sorted_count = top_k if top_k is not None and top_k < len(method_rows) else None
+            if data.dtype != object:
+                # numeric data can be sorted directly (stable, like sorted())
+                sorted_rows = method_rows[top_k_indices(data, top_k, reverse)]
+            else:
+                links = [self._link(row) for row in method_rows]
+                link_rows = {id(link): row for link, row in zip(links, method_rows.tolist())}
+                sorted_rows = np.array([link_rows[id(link)] for link in method.sort(links, reverse)], dtype=np.int64)
+                sorted_count = None
+            self._sorted_links[cache_key] = (sorted_rows, sorted_count)
+
+        sorted_rows = sorted_rows[:top_k]
+        if not strict:
+            # append any remaining links 
+            sorted_rows = np.r_[sorted_rows, rows[~found]][:top_k]
+
+        return [self._link(row) for row in sorted_rows.tolist()]
+
+    def get_all_targets(self):
+        self._merge_pending()
+        return [self._objects[key] for key in np.unique(self._target_keys).tolist()]
+
+    @property
+    def sources(self):
+        return [self._objects[key] for key in self._get_index()[0].tolist()]
+
+    @property
+    def links(self):
+        return _ColumnarLinks(self)
+
+    @property
+    def source_count(self):
+        return len(self)
+
+    @property
+    def link_count(self):
+        self._merge_pending()
+        return len(self._source_keys)
+
+    def __len__(self):
+        return len(self._get_index()[0])
+
+class _ColumnarLinks(Mapping):
+    # {source: {target: ObjectLink}} view of a ColumnarLinkCollection
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getitem__(self, source):
+        try:
+            rows = self._collection._source_rows(source)
+        except Exception:
+            raise KeyError(source)
+        return _ColumnarTargets(self._collection, rows)
+
+    def __iter__(self):
+        return iter(self._collection.sources)
+
+    def __len__(self):
+        return len(self._collection)
+
+class _ColumnarTargets(Mapping):
+    # {target: ObjectLink} view of the links of one source in a ColumnarLinkCollection
+
+    def __init__(self, collection, rows):
+        self._collection = collection
+        self._rows = rows
+        self._lookup = None
+
+    def __getitem__(self, target):
+        if self._lookup is None:
+            self._lookup = dict(zip(self._collection._target_keys[self._rows].tolist(), self._rows.tolist()))
+        try:
+            row = self._lookup[_object_key(target)]
+        except Exception:
+            raise KeyError(target)
+        return self._collection._link(row)
+
+    def __iter__(self):
+        objects = self._collection._objects
+        return (objects[key] for key in self._collection._target_keys[self._rows].tolist())
+
+    def __len__(self):
+        return len(self._rows)
+
+    def values(self):
+        return [self._collection._link(row) for row in self._rows]
+
+    def items(self):
+        return [(link.target, link) for link in self.values()]
+
+class LinkFilter(object):
+    """
+    Base class for declarative link filters, used with LinkCollection.filter.
+
+    A filter decides whether a single ObjectLink should be kept (__call__). 
+    Filters can also compute a boolean mask over all the links of a 
+    ColumnarLinkCollection at once (mask), which is much faster than calling 
+    them for each link. The default mask just calls the filter on each link.
+
+    Filters can be combined with & (both), | (either) and ~ (not).
+    """
+
+    def __call__(self, link):
+        raise NotImplementedError()
+
+    def mask(self, collection):
+        return np.array([self(collection._link(row)) for row in range(collection.link_count)], dtype=bool)
+
+    def __and__(self, other):
+        return _CombinedFilter(np.logical_and, all, [self, other])
+
+    def __or__(self, other):
+        return _CombinedFilter(np.logical_or, any, [self, other])
+
+    def __invert__(self):
+        return _NotFilter(self)
+
+class _CombinedFilter(LinkFilter):
+
+    def __init__(self, ufunc, func, filters):
+        self.ufunc = ufunc
+        self.func = func
+        self.filters = filters
+
+    def __call__(self, link):
+        return self.func(f(link) for f in self.filters)
+
+    def mask(self, collection):
+        return self.ufunc.reduce([f.mask(collection) for f in self.filters])
+
+class _NotFilter(LinkFilter):
+
+    def __init__(self, link_filter):
+        self.link_filter = link_filter
+
+    def __call__(self, link):
+        return not self.link_filter(link)
+
+    def mask(self, collection):
+        return ~self.link_filter.mask(collection)
+
+class ScoreFilter(LinkFilter):
+    """
+    Keeps links found by <method> with a score >= min_score and/or <= max_score
+    (links not found by the method are removed). Only for methods where the 
+    data for each link is a single number (e.g. MetcalfScoring).
+    """
+
+    def __init__(self, method, min_score=None, max_score=None):
+        self.method = method
+        self.min_score = min_score
+        self.max_score = max_score
+
+    def _in_range(self, scores):
+        keep = np.ones(np.shape(scores), dtype=bool)
+        if self.min_score is not None:
+            keep &= scores >= self.min_score
+        if self.max_score is not None:
+            keep &= scores <= self.max_score
+        return keep
+
+    def __call__(self, link):
+        return self.method in link.methods and bool(self._in_range(link.data(self.method)))
+
+    def mask(self, collection):
+        if self.method not in collection._found:
+            return np.zeros(collection.link_count, dtype=bool)
+        scores = collection._data[self.method]
+        if scores.dtype == object:
+            return super(ScoreFilter, self).mask(collection)
+        found = collection._found[self.method]
+        with np.errstate(invalid='ignore'):
+            return found & self._in_range(scores)
+
+class SharedStrainsFilter(LinkFilter):
+    """
+    Keeps links with at least min_count shared strains
+    """
+
+    def __init__(self, min_count=1):
+        self.min_count = min_count
+
+    def __call__(self, link):
+        return len(link.shared_strains) >= self.min_count
+
+    def mask(self, collection):
+        return collection.shared_strain_counts() >= self.min_count
+
+class TargetTypeFilter(LinkFilter):
+    """
+    Keeps links where the target is an instance of one of the given types
+    (e.g. TargetTypeFilter(Spectrum) for GCF input)
+    """
+
+    def __init__(self, *types):
+        self.types = types
+
+    def __call__(self, link):
+        return isinstance(link.target, self.types)
+
+    def mask(self, collection):
+        type_indexes = [i for i, cls in enumerate(_KEY_TYPES) if issubclass(cls, self.types)]
+        return np.isin(collection._target_keys >> _KEY_SHIFT, type_indexes)
+
+class TargetFilter(LinkFilter):
+    """
+    Keeps links where the target is one of the given objects
+    """
+
+    def __init__(self, objects):
+        # objects of different types can have the same ID (and compare equal), 
+        # so they're looked up by their link collection keys instead
+        self.keys = set(_object_key(obj) for obj in objects)
+
+    def __call__(self, link):
+        return _object_key(link.target) in self.keys
+
+    def mask(self, collection):
+        return np.isin(collection._target_keys, list(self.keys))
+
+class _GenomicsClassFilter(LinkFilter):
+    # base class for filters on the class(es) of the GCF or BGC in each link,
+    # which is the source or the target. Links without a GCF or BGC are removed
+
+    def __init__(self, *classes):
+        self.classes = set(classes)
+
+    def _object_classes(self, obj):
+        raise NotImplementedError()
+
+    def _accept(self, obj):
+        return isinstance(obj, (GCF, BGC)) and len(self._object_classes(obj) & self.classes) > 0
+
+    def __call__(self, link):
+        return self._accept(link.source) or self._accept(link.target)
+
+    def mask(self, collection):
+        # only check each distinct object once
+        keep = np.zeros(collection.link_count, dtype=bool)
+        for keys in (collection._source_keys, collection._target_keys):
+            unique_keys, inverse = np.unique(keys, return_inverse=True)
+            accepted = np.array([self._accept(collection._objects[key]) for key in unique_keys.tolist()], dtype=bool)
+            keep |= accepted[inverse.ravel()]
+        return keep
+
+class ProductClassFilter(_GenomicsClassFilter):
+    """
+    Keeps links where the product type of the GCF (or the product prediction 
+    of the BGC) is one of the given classes
+    """
+
+    def _object_classes(self, obj):
+        return {obj.product_type if isinstance(obj, GCF) else obj.product_prediction}
+
+class BGCClassFilter(_GenomicsClassFilter):
+    """
+    Keeps links where the BiG-SCAPE class of the BGC (or any of the classes of 
+    the BGCs in the GCF) is one of the given classes
+    """
+
+    def _object_classes(self, obj):
+        return obj.classes if isinstance(obj, GCF) else {obj.bigscape_class}
+
 class ScoringMethod(object):
 
     NAME = 'ScoringMethod'
@@ -261,6 +913,11 @@ class ScoringMethod(object):
         """Given a list of objects, return them sorted by link score"""
         return objects
 
+    # methods which sort links by a single value per link can implement 
+    # sort_key(self, link), returning that value. This allows the best links to
+    # be found without sorting all of them (see LinkCollection.get_sorted_links)
+    sort_key = None
+
 class TestScoring(ScoringMethod):
 
     NAME = 'testscore'
@@ -310,6 +967,8 @@ class RosettaScoring(ScoringMethod):
 
     @staticmethod
     def setup(npl):
+        # (imported here so that importing nplinker doesn't pull in the Rosetta code)
+        from ..scoring.rosetta.rosetta import Rosetta
         logger.info('RosettaScoring setup')
         RosettaScoring.ROSETTA_OBJ = Rosetta(npl, ignore_genomic_cache=False)
         ms1_tol = Rosetta.DEF_MS1_TOL
@@ -411,51 +1070,113 @@ class MetcalfScoring(ScoringMethod):
     # - R_SCORE: the score for the link between a pair of objects
     R_SRC_ID, R_DST_ID, R_SCORE = range(3)
 
+    # default values for the optional [scoring.metcalf] config file section
+    DEF_PACKED_STRAINS = False
+    DEF_PRECOMPUTE_STANDARDISED = False
+    DEF_BLOCK_SIZE = 0
+
+    # if > 0, scores are calculated in blocks of this many spectra/families at query
+    # time (LinkFinder.query_links) instead of being stored as full matrices
+    BLOCK_SIZE = DEF_BLOCK_SIZE
+
     def __init__(self, npl):
         super(MetcalfScoring, self).__init__(npl)
         self.cutoff = 1.0
         self.standardised = True
+        # if set, only return the top_k highest scoring links for each input object
+        self.top_k = None
 
     @staticmethod
     def setup(npl):
+        # (imported here because data_linking needs pandas, which is slow to import)
+        from .data_linking import DataLinks, LinkFinder
         logger.info('MetcalfScoring.setup (bgcs={}, gcfs={}, spectra={}, molfams={}, strains={})'.format(len(npl.bgcs), len(npl.gcfs), len(npl.spectra), len(npl.molfams), len(npl.strains)))
 
+        # allow overriding params via config file
+        packed_strains = MetcalfScoring.DEF_PACKED_STRAINS
+        precompute_standardised = MetcalfScoring.DEF_PRECOMPUTE_STANDARDISED
+        block_size = MetcalfScoring.DEF_BLOCK_SIZE
+        config = npl.config
+        if 'scoring' in config and 'metcalf' in config['scoring']:
+            mc = config['scoring']['metcalf']
+            packed_strains = mc.get('packed_strains', MetcalfScoring.DEF_PACKED_STRAINS)
+            precompute_standardised = mc.get('precompute_standardised', MetcalfScoring.DEF_PRECOMPUTE_STANDARDISED)
+            block_size = mc.get('block_size', MetcalfScoring.DEF_BLOCK_SIZE)
+        MetcalfScoring.BLOCK_SIZE = block_size
+        streaming = block_size > 0
+
         cache_dir = os.path.join(npl.root_dir, 'metcalf')
-        cache_file = os.path.join(cache_dir, 'metcalf_scores.pckl')
+        store_dir = os.path.join(cache_dir, 'store')
         os.makedirs(cache_dir, exist_ok=True)
 
         # the metcalf preprocessing can take a long time for large datasets, so it's 
-        # better to cache as the data won't change unless the number of objects does
-
-        dataset_counts = [len(npl.bgcs), len(npl.gcfs), len(npl.spectra), len(npl.molfams), len(npl.strains)]
-        datalinks, linkfinder = None, None
-        if os.path.exists(cache_file):
-            logger.debug('MetcalfScoring.setup loading cached data')
-            cache_data = load_pickled_data(npl, cache_file)
-            cache_ok = True
-            if cache_data is not None:
-                (counts, datalinks, linkfinder) = cache_data
-                # need to invalidate this if dataset appears to have changed
-                for i in range(len(counts)):
-                    if counts[i] != dataset_counts[i]:
-                        logger.info('MetcalfScoring.setup invalidating cached data!')
-                        cache_ok = False
-                        break
-
-            if cache_ok:
-                MetcalfScoring.DATALINKS = datalinks
-                MetcalfScoring.LINKFINDER = linkfinder
+        # better to cache it. the cache is identified by hashes of the strain list and
+        # the spectrum/GCF -> strain mappings. if only the GCFs have changed (e.g. 
+        # after load_data(new_bigscape_cutoff=...)) the spectra/families matrices are
+        # reused and only the GCF-dependent matrices are recomputed. the cached 
+        # matrices are memory-mapped from the store when loaded, so this is fast and
+        # the data is only read from disk as it's used (see arraystore.py)
+
+        datalinks = DataLinks(packed=packed_strains)
+        hashes = datalinks.content_hashes(npl._spectra, npl._gcfs, npl._strains)
+        MetcalfScoring.DATALINKS, MetcalfScoring.LINKFINDER = None, None
+        metadata = load_store_metadata(store_dir)
+        if metadata is not None:
+            cached_hashes = metadata.get('hashes', {})
+            same_metabolomics = all(cached_hashes.get(k, None) == hashes[k] for k in ['strains', 'metabolomics'])
+            same_genomics = cached_hashes.get('genomics', None) == hashes['genomics']
+
+            if metadata.get('packed_strains', None) != packed_strains:
+                # the storage format of the co-occurence matrices has changed
+                logger.info('MetcalfScoring.setup invalidating cached data (packed_strains={})'.format(packed_strains))
+            elif not same_metabolomics:
+                logger.info('MetcalfScoring.setup invalidating cached data!')
+            else:
+                logger.debug('MetcalfScoring.setup loading cached data')
+                metadata, objects = load_store(npl, store_dir, {'datalinks': DataLinks, 'linkfinder': LinkFinder})
+                if objects is not None and same_genomics:
+                    MetcalfScoring.DATALINKS = objects['datalinks']
+                    MetcalfScoring.LINKFINDER = objects['linkfinder']
+                elif objects is not None:
+                    logger.info('MetcalfScoring.setup updating cached data for changed GCFs')
+                    MetcalfScoring.DATALINKS = objects['datalinks']
+                    MetcalfScoring.DATALINKS.update_genomics(npl._gcfs, npl._strains)
 
         if MetcalfScoring.DATALINKS is None:
             logger.info('MetcalfScoring.setup preprocessing dataset (this may take some time)')
-            MetcalfScoring.DATALINKS = DataLinks()
+            MetcalfScoring.DATALINKS = datalinks
             MetcalfScoring.DATALINKS.load_data(npl._spectra, npl._gcfs, npl._strains)
             MetcalfScoring.DATALINKS.find_correlations()
+
+        if MetcalfScoring.LINKFINDER is None:
             MetcalfScoring.LINKFINDER = LinkFinder()
-            MetcalfScoring.LINKFINDER.metcalf_scoring(MetcalfScoring.DATALINKS, type='spec-gcf')
-            MetcalfScoring.LINKFINDER.metcalf_scoring(MetcalfScoring.DATALINKS, type='fam-gcf')
+            if not streaming:
+                MetcalfScoring.LINKFINDER.metcalf_scoring(MetcalfScoring.DATALINKS, type='spec-gcf')
+                MetcalfScoring.LINKFINDER.metcalf_scoring(MetcalfScoring.DATALINKS, type='fam-gcf')
             logger.debug('MetcalfScoring.setup caching results')
-            save_pickled_data((dataset_counts, MetcalfScoring.DATALINKS, MetcalfScoring.LINKFINDER), cache_file)
+            metadata = {'hashes': hashes, 'packed_strains': packed_strains}
+            save_store(store_dir, metadata, {'datalinks': MetcalfScoring.DATALINKS, 'linkfinder': MetcalfScoring.LINKFINDER})
+
+        # optionally compute the full matrix of standardised scores up front, so that
+        # get_links can just select from it. Otherwise only the scores that are 
+        # actually requested get standardised (in get_links)
+        linkfinder = MetcalfScoring.LINKFINDER
+        if not streaming and len(linkfinder.metcalf_spec_gcf) == 0:
+            # cached data was created with block_size > 0, so the score matrices are missing
+            linkfinder.metcalf_scoring(MetcalfScoring.DATALINKS, type='spec-gcf')
+            linkfinder.metcalf_scoring(MetcalfScoring.DATALINKS, type='fam-gcf')
+
+        if streaming:
+            # the full score matrices are never needed in this case
+            linkfinder.metcalf_std_spec_gcf = []
+            linkfinder.metcalf_std_fam_gcf = []
+        elif precompute_standardised and len(getattr(linkfinder, 'metcalf_std_spec_gcf', [])) == 0:
+            logger.debug('MetcalfScoring.setup precomputing standardised scores')
+            linkfinder.standardised_metcalf_scoring(MetcalfScoring.DATALINKS, type='spec-gcf')
+            linkfinder.standardised_metcalf_scoring(MetcalfScoring.DATALINKS, type='fam-gcf')
+        elif not precompute_standardised:
+            linkfinder.metcalf_std_spec_gcf = []
+            linkfinder.metcalf_std_fam_gcf = []
 
         logger.info('MetcalfScoring.setup completed')
 
@@ -476,11 +1197,25 @@ class MetcalfScoring(ScoringMethod):
         linkfinder = MetcalfScoring.LINKFINDER
         input_type = type(objects[0])
 
-        logger.debug('MetcalfScoring: standardised = {}'.format(self.standardised))
-        if not self.standardised:
+        logger.debug('MetcalfScoring: standardised = {}, top_k = {}'.format(self.standardised, self.top_k))
+        if MetcalfScoring.BLOCK_SIZE > 0 or self.top_k is not None:
+            # calculate the scores in blocks, keeping only links that pass the cutoff/top_k
+            block_size = MetcalfScoring.BLOCK_SIZE if MetcalfScoring.BLOCK_SIZE > 0 else 1024
+            main_score = 'metcalf_std' if self.standardised else self.name
+            results = linkfinder.query_links(datalinks, objects, main_score, self.cutoff, self.top_k, block_size)
+            if self.standardised and input_type == GCF:
+                # TODO molfam...
+                results[1] = np.zeros((3, 0))
+        elif not self.standardised:
             results = linkfinder.get_links(datalinks, objects, self.name, self.cutoff)
+        elif len(linkfinder.metcalf_std_spec_gcf) > 0:
+            # the full matrix of standardised scores was precomputed during setup
+            results = linkfinder.get_links(datalinks, objects, 'metcalf_std', self.cutoff)
+            if input_type == GCF:
+                # TODO molfam...
+                results[1] = np.zeros((3, 0))
         else:
-             # get the basic Metcalf scores BUT ignore the cutoff value here as it should only be applied to 
+            # get the basic Metcalf scores BUT ignore the cutoff value here as it should only be applied to 
             # the final scores, not the original ones
             results = linkfinder.get_links(datalinks, objects, self.name, None)
 
@@ -489,63 +1224,33 @@ class MetcalfScoring(ScoringMethod):
             # results is a (3, x) array for spec/molfam input, where (1, :) gives src obj ID, (2, :) gives
             # dst obj ID, and (3, :) gives scores
             # for GCFs you get [spec, molfam] with above substructure
-
-            # NOTE: need to use sets here because if the "else" cases are executed 
-            # can get lots of duplicate object IDs which messes everything up
-
-            spectra_input = (input_type == Spectrum)
-
-            # make type1_objects always == spectra. if input is spectra, just use "objects",
-            # otherwise build a list using the object IDs in the results array
-            type1_objects = objects if spectra_input else {self.npl.spectra[int(index)] for index in results[0][self.R_DST_ID]}
-
-            # other objs should be "objects" if input is GCF, otherwise create 
-            # from the results array as above
-            other_objs = objects if not spectra_input else {self.npl._gcfs[int(index)] for index in results[0][self.R_DST_ID]}
-
-            # build a lookup table for pairs of object IDs and their index in the results array
-            if spectra_input:
-                pairs_lookup = {(results[0][self.R_SRC_ID][i], results[0][self.R_DST_ID][i]): i for i in range(len(results[0][self.R_SRC_ID]))}
+            type1_input = (input_type != GCF)
+            type_ = 'fam-gcf' if input_type == MolecularFamily else 'spec-gcf'
+            res = results[0]
+            type1_ids = res[self.R_SRC_ID] if type1_input else res[self.R_DST_ID]
+            gcf_ids = res[self.R_DST_ID] if type1_input else res[self.R_SRC_ID]
+
+            # look up the expected value + variance for every pairing at once, based
+            # on their strain counts (the metcalf_expected and metcalf_variance matrices 
+            # should have been calculated already), then apply the scoring cutoff
+            final_scores = linkfinder.standardise_metcalf(datalinks, type1_ids, gcf_ids, res[self.R_SCORE], type_)
+            if self.cutoff is None:
+                keep = np.ones(final_scores.shape, dtype=bool)
             else:
-                pairs_lookup = {(results[0][self.R_DST_ID][i], results[0][self.R_SRC_ID][i]): i for i in range(len(results[0][self.R_SRC_ID]))}
-
-            # apply score update to each spec:gcf pairing and update the corresponding entry in results
-            # (the metcalf_expected and metcalf_variance matrices should have been calculated already)
-            new_src, new_dst, new_res = [], [], []
-
-            # iterating over spectra
-            for i, type1_obj in enumerate(type1_objects):
-                met_strains = len(type1_obj.strains) # number of strains left after filtering
-                # iterating over GCFs
-                for j, other_obj in enumerate(other_objs): 
-                    gen_strains = len(other_obj.strains) # number of strains left after filtering
-
-                    # lookup expected + variance values based on strain counts 
-                    expected = linkfinder.metcalf_expected[met_strains][gen_strains]
-                    variance_sqrt = linkfinder.metcalf_variance_sqrt[met_strains][gen_strains]
-
-                    # now need to extract the original score for this particular pair of objects. 
-                    # this requires figuring out the correct index into the results array for the pair,
-                    # using the lookup table constructed above
-                    k = pairs_lookup[(type1_obj.id, other_obj.id)]
-
-                    # calculate the final score based on the basic Metcalf score for these two
-                    # particular objects
-                    final_score = (results[0][self.R_SCORE][k] - expected) / variance_sqrt
-
-                    # finally apply the scoring cutoff and store the result
-                    if self.cutoff is None or (final_score >= self.cutoff):
-                        new_src.append(results[0][self.R_SRC_ID][k])
-                        new_dst.append(results[0][self.R_DST_ID][k])
-                        new_res.append(final_score)
-                
+                keep = final_scores >= self.cutoff
+
             # overwrite original "results" with equivalent new data structure
-            results = [np.array([new_src, new_dst, new_res])]
+            results = [np.array([res[self.R_SRC_ID][keep], res[self.R_DST_ID][keep], final_scores[keep]])]
 
             if input_type == GCF:
                 # TODO molfam...
                 results.append(np.zeros((3, 0)))
 
+        if isinstance(link_collection, ColumnarLinkCollection):
+            self._add_link_arrays(input_type, results, link_collection)
+            logger.debug('MetcalfScoring: completed')
+            return link_collection
+
         scores_found = set()
         metcalf_results = {}
 
@@ -614,10 +1319,34 @@ class MetcalfScoring(ScoringMethod):
         logger.debug('MetcalfScoring: completed')
         return link_collection
 
+    def _add_link_arrays(self, input_type, results, link_collection):
+        # add the results to a ColumnarLinkCollection directly from the arrays,
+        # without creating any ObjectLinks
+        npl = self.npl
+        if input_type == GCF:
+            # spec-gcf and fam-gcf links, both with the GCFs as sources
+            blocks = [(results[0], npl._gcfs, npl._spectra), (results[1], npl._gcfs, npl._molfams)]
+        else:
+            blocks = [(results[0], npl._spectra if input_type == Spectrum else npl._molfams, npl._gcfs)]
+
+        source_keys, target_keys, scores = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], [np.zeros(0)]
+        for res, sources, targets in blocks:
+            if res.shape[1] == 0:
+                continue
+            source_keys.append(link_collection._object_keys(sources, res[self.R_SRC_ID].astype(np.int64)))
+            target_keys.append(link_collection._object_keys(targets, res[self.R_DST_ID].astype(np.int64)))
+            scores.append(res[self.R_SCORE])
+
+        logger.debug('MetcalfScoring found {} links'.format(sum(len(x) for x in scores)))
+        link_collection._add_link_arrays(self, np.concatenate(source_keys), np.concatenate(target_keys), np.concatenate(scores))
+
     def format_data(self, data):
         # for metcalf the data will just be a floating point value (i.e. the score)
         return '{:.4f}'.format(data)
 
+    def sort_key(self, link):
+        return link.data(self)
+
     def sort(self, objects, reverse=True):
         # sort based on score
-        return sorted(objects, key=lambda objlink: objlink[self], reverse=reverse)
+        return sorted(objects, key=self.sort_key, reverse=reverse)
@@ -0,0 +1,436 @@
+import hashlib
+import os
+
+import numpy as np
+
+from .arraystore import load_store, load_store_metadata, save_store
+from .genomics import BGC, MiBIGBGC, GCF, _NO_EDGES
+from .metabolomics import Spectrum, MolecularFamily, SingletonFamily, MGFPeaks, _EMPTY_DICT, _EMPTY_LIST
+from .strains import Strain, StrainCollection, StrainSet
+
+from .logconfig import LogConfig
+logger = LogConfig.getLogger(__file__)
+
+# A binary snapshot of a fully loaded dataset (see DatasetLoader.load).
+#
+# Parsing all the input files of a large dataset (MGF, GNPS tables, BiG-SCAPE
+# output, every antiSMASH .gbk file, ...) can take many minutes. After the first
+# load the resulting objects are converted to a set of flat arrays and saved
+# using arraystore:
+#  - the peaks of all spectra as 2 (num_peaks x 2) arrays plus offsets
+#  - strain memberships as arrays of indices into a single table of strains
+#  - the fields of the spectra, families, BGCs and GCFs as columns
+# Anything that isn't easily stored as an array (metadata dicts, annotations,
+# names, ...) is pickled along with them.
+#
+# On later loads the objects are recreated from the snapshot instead, as long as
+# none of the input files have changed (based on their sizes and modification
+# times) and the loading options are the same. The arrays are memory-mapped, so
+# the peaks of each spectrum are only read from disk when they are first used.
+
+SNAPSHOT_VERSION = 2
+
+def _file_entries(path):
+    # (path, size, mtime) for a file, or every file under a directory
+    if path is None:
+        return []
+    if os.path.isdir(path):
+        entries = []
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for f in sorted(files):
+                entries.extend(_file_entries(os.path.join(root, f)))
+        return entries
+    try:
+        st = os.stat(path)
+    except OSError:
+        return [(path, -1, -1)]
+    return [(path, st.st_size, st.st_mtime_ns)]
+
+def input_fingerprint(paths, options):
+    """
+    Return a hash of the sizes and modification times of the files in <paths>
+    (including all files under any directories) and the loading options
+    """
+    h = hashlib.sha1(repr((SNAPSHOT_VERSION, sorted(options.items()))).encode('utf-8'))
+    for path in paths:
+        for entry in _file_entries(path):
+            h.update(repr(entry).encode('utf-8'))
+    return h.hexdigest()
+
+def _csr(lists):
+    indptr = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum([len(x) for x in lists], out=indptr[1:])
+    indices = np.fromiter((i for x in lists for i in x), dtype=np.int64, count=indptr[-1])
+    return indptr, indices
+
+def _csr_rows(indptr, indices):
+    # the rows of a CSR array as lists
+    indices = indices.tolist()
+    indptr = indptr.tolist()
+    return [indices[indptr[i]:indptr[i + 1]] for i in range(len(indptr) - 1)]
+
+def _float_column(values):
+    # None values are stored as NaN, with a mask to tell them apart from real NaNs
+    is_none = np.array([x is None for x in values], dtype=bool)
+    column = np.array([np.nan if x is None else x for x in values], dtype=np.float64)
+    return column, is_none
+
+def _float_values(column, is_none):
+    return [None if n else x for x, n in zip(column.tolist(), is_none.tolist())]
+
+class _IndexTable(object):
+    # assigns consecutive indices to objects, by identity
+
+    def __init__(self, objects=()):
+        self.objects = []
+        self._indices = {}
+        for obj in objects:
+            self.index(obj)
+
+    def index(self, obj):
+        if obj is None:
+            return -1
+        i = self._indices.get(id(obj))
+        if i is None:
+            i = len(self.objects)
+            self._indices[id(obj)] = i
+            self.objects.append(obj)
+        return i
+
+class DatasetSnapshot(object):
+    """
+    The contents of a loaded dataset (the objects created by DatasetLoader.load)
+    in a form that can be saved using arraystore. Numpy arrays are saved as
+    separate files which are memory-mapped when the snapshot is loaded, other
+    attributes are pickled.
+    """
+
+    @staticmethod
+    def from_loader(loader):
+        snapshot = DatasetSnapshot()
+        snapshot._save_genomics(loader)
+        snapshot._save_metabolomics(loader)
+        snapshot._save_strains(loader)
+        snapshot.product_types = loader.product_types
+        snapshot.gnps_params = loader.gnps_params
+        snapshot.description_text = loader.description_text
+        return snapshot
+
+    def restore(self, loader):
+        """
+        Recreate the dataset objects and set them on <loader>
+        """
+        strains = self._restore_strains(loader)
+        gcfs, bgcs = self._restore_genomics(loader, strains)
+        spectra = self._restore_metabolomics(loader, strains)
+        # the GCFs reference the BGCs and vice versa, so these have to be linked up
+        # once they've all been created
+        for bgc, parent in zip(bgcs, self.bgc_parent.tolist()):
+            bgc.parent = gcfs[parent] if parent >= 0 else None
+
+        # anything that wasn't loaded when the snapshot was saved is still loaded 
+        # when it's first used
+        if self.deferred_annotations is not None:
+            loader._defer_annotations([spectra[i] for i in self.deferred_annotations])
+        if self.deferred_edges is not None:
+            network_files, indices = self.deferred_edges
+            loader._network_files = network_files
+            loader._defer_edges(network_files, [bgcs[i] for i in indices])
+        loader.product_types = self.product_types
+        loader.gnps_params = self.gnps_params
+        loader.description_text = self.description_text
+
+    # strains
+    #
+    # every Strain object referenced by the dataset is given an index in a single
+    # table (self._strain_table while saving), starting with the StrainCollection
+
+    def _save_strains(self, loader):
+        table = self._strain_table
+        collection = loader.strains
+        self.strain_collection = [table.index(strain) for strain in collection._strains]
+        self.strain_collection_lookup = [(key, table.index(strain)) for key, strain in collection._lookup.items()]
+        self.strain_collection_indices = [(key, table.index(strain)) for key, strain in collection._lookup_indices.items()]
+
+        include_only = loader.include_only_strains
+        self.include_only_is_collection = isinstance(include_only, StrainCollection)
+        self.include_only_strains = [table.index(strain) for strain in include_only]
+
+        self.strain_ids = [strain.id for strain in table.objects]
+        self.strain_aliases = [sorted(strain.aliases) for strain in table.objects]
+        del self._strain_table
+
+    def _restore_strains(self, loader):
+        strains = []
+        for strain_id, aliases in zip(self.strain_ids, self.strain_aliases):
+            strain = Strain.__new__(Strain)
+            strain.id = strain_id
+            strain.aliases = set(aliases)
+            strains.append(strain)
+
+        # restore the collection exactly as it was (including any lookup entries
+        # which StrainCollection.remove doesn't update)
+        collection = StrainCollection()
+        collection._strains = [strains[i] for i in self.strain_collection]
+        collection._lookup = {key: strains[i] for key, i in self.strain_collection_lookup}
+        collection._lookup_indices = {key: strains[i] for key, i in self.strain_collection_indices}
+        loader.strains = collection
+
+        include_only = [strains[i] for i in self.include_only_strains]
+        if self.include_only_is_collection:
+            loader.include_only_strains = StrainCollection()
+            for strain in include_only:
+                loader.include_only_strains.add(strain)
+        else:
+            loader.include_only_strains = set(include_only)
+        return strains
+
+    def _strain_set(self, strains, indices):
+        strain_set = StrainSet()
+        for i in indices:
+            strain_set.add(strains[i])
+        return strain_set
+
+    # genomics
+
+    def _save_genomics(self, loader):
+        self._strain_table = _IndexTable(loader.strains._strains)
+        strain_table = self._strain_table
+
+        gcf_table = _IndexTable(loader.gcfs)
+        # the BGC list, then any MiBIG BGCs which aren't in it
+        bgc_table = _IndexTable(loader.bgcs)
+        for bgc in loader.mibig_bgc_dict.values():
+            bgc_table.index(bgc)
+        for gcf in loader.gcfs:
+            for bgc in gcf.bgcs:
+                bgc_table.index(bgc)
+        # the network files may not have been loaded yet (see LoadPlan)
+        deferred_edges = loader.deferred(loader.load_plan.EDGES)
+        self.deferred_edges = None
+        if deferred_edges is not None:
+            self.deferred_edges = (loader._network_files, [bgc_table.index(bgc) for bgc in deferred_edges.objects])
+        bgcs = bgc_table.objects
+        gcfs = gcf_table.objects
+
+        self.num_bgcs = len(loader.bgcs)
+        self.bgc_is_mibig = np.array([isinstance(bgc, MiBIGBGC) for bgc in bgcs], dtype=bool)
+        self.bgc_id = np.array([bgc.id for bgc in bgcs], dtype=np.int64)
+        self.bgc_strain = np.array([strain_table.index(bgc.strain) for bgc in bgcs], dtype=np.int64)
+        self.bgc_parent = np.array([gcf_table.index(bgc.parent) for bgc in bgcs], dtype=np.int64)
+        self.bgc_region = np.array([bgc.region for bgc in bgcs], dtype=np.int64)
+        self.bgc_cluster = np.array([bgc.cluster for bgc in bgcs], dtype=np.int64)
+        self.bgc_fields = [(bgc.name, bgc.bigscape_class, bgc.product_prediction, bgc.description,
+                            bgc._antismash_header, bgc.antismash_file) for bgc in bgcs]
+        self.bgc_edges = {i: bgc._edges for i, bgc in enumerate(bgcs) if len(bgc._edges) > 0}
+        self.mibig_bgc_dict = [(key, bgc_table.index(bgc)) for key, bgc in loader.mibig_bgc_dict.items()]
+
+        self.num_gcfs = len(loader.gcfs)
+        self.gcf_id = np.array([gcf.id for gcf in gcfs], dtype=np.int64)
+        self.gcf_fields = [(gcf.gcf_id, gcf.product_type, gcf.classes) for gcf in gcfs]
+        self.gcf_bgcs_indptr, self.gcf_bgcs = _csr([[bgc_table.index(bgc) for bgc in gcf.bgcs] for gcf in gcfs])
+        self.gcf_strains_indptr, self.gcf_strains = _csr([[strain_table.index(strain) for strain in gcf.strains] for gcf in gcfs])
+        self.gcf_strains_lookup = [[(strain_table.index(strain), bgc_table.index(bgc)) for strain, bgc in gcf.strains_lookup.items()] for gcf in gcfs]
+
+    def _restore_genomics(self, loader, strains):
+        bgcs = []
+        bgc_ids = self.bgc_id.tolist()
+        bgc_strains = self.bgc_strain.tolist()
+        regions, clusters = self.bgc_region.tolist(), self.bgc_cluster.tolist()
+        for i, is_mibig in enumerate(self.bgc_is_mibig.tolist()):
+            bgc = MiBIGBGC.__new__(MiBIGBGC) if is_mibig else BGC.__new__(BGC)
+            bgc.id = bgc_ids[i]
+            bgc.strain = strains[bgc_strains[i]] if bgc_strains[i] >= 0 else None
+            (bgc.name, bgc.bigscape_class, bgc.product_prediction, bgc.description,
+             bgc._antismash_header, bgc.antismash_file) = self.bgc_fields[i]
+            bgc.region = regions[i]
+            bgc.cluster = clusters[i]
+            bgc.parent = None
+            bgc._aa_predictions = None
+            bgc._known_cluster_blast = None
+            bgc._smiles = None
+            bgc._smiles_parsed = False
+            bgc._edges = self.bgc_edges.get(i, _NO_EDGES)
+            bgc._deferred_edges = None
+            bgcs.append(bgc)
+
+        gcfs = []
+        gcf_ids = self.gcf_id.tolist()
+        gcf_bgcs = _csr_rows(self.gcf_bgcs_indptr, self.gcf_bgcs)
+        gcf_strains = _csr_rows(self.gcf_strains_indptr, self.gcf_strains)
+        for i, (gcf_id, product_type, classes) in enumerate(self.gcf_fields):
+            gcf = GCF.__new__(GCF)
+            gcf.id = gcf_ids[i]
+            gcf.gcf_id = gcf_id
+            gcf.product_type = product_type
+            gcf.bgcs = set(bgcs[j] for j in gcf_bgcs[i])
+            gcf.classes = set(classes)
+            gcf._aa_predictions = None
+            gcf.strains = self._strain_set(strains, gcf_strains[i])
+            gcf.strains_lookup = {strains[s]: bgcs[b] for s, b in self.gcf_strains_lookup[i]}
+            gcfs.append(gcf)
+
+        loader.bgcs = bgcs[:self.num_bgcs]
+        loader.gcfs = gcfs[:self.num_gcfs]
+        loader.mibig_bgc_dict = {key: bgcs[i] for key, i in self.mibig_bgc_dict}
+        return gcfs, bgcs
+
+    # metabolomics
+
+    def _save_metabolomics(self, loader):
+        strain_table = self._strain_table
+        # the spectra list, then any spectra which are only referenced by a family
+        # (these can be left behind by _filter_user_strains)
+        spec_table = _IndexTable(loader.spectra)
+        molfam_table = _IndexTable(loader.molfams)
+        for spec in loader.spectra:
+            molfam_table.index(spec.family)
+        for molfam in molfam_table.objects:
+            for spec in molfam.spectra:
+                spec_table.index(spec)
+        # the annotation files may not have been loaded yet (see LoadPlan)
+        deferred_annotations = loader.deferred(loader.load_plan.ANNOTATIONS)
+        self.deferred_annotations = None
+        if deferred_annotations is not None:
+            self.deferred_annotations = [spec_table.index(spec) for spec in deferred_annotations.objects]
+        for spec in spec_table.objects:
+            molfam_table.index(spec.family)
+        spectra = spec_table.objects
+        molfams = molfam_table.objects
+
+        self.num_spectra = len(loader.spectra)
+        self.num_molfams = len(loader.molfams)
+        self.molfams_is_set = isinstance(loader.molfams, set)
+        self.molfam_is_singleton = np.array([isinstance(molfam, SingletonFamily) for molfam in molfams], dtype=bool)
+        self.molfam_id = np.array([molfam.id for molfam in molfams], dtype=np.int64)
+        self.molfam_family_id = [molfam.family_id for molfam in molfams]
+        self.molfam_spectra_indptr, self.molfam_spectra = _csr([[spec_table.index(spec) for spec in molfam.spectra] for molfam in molfams])
+
+        self.spec_id = np.array([spec.id for spec in spectra], dtype=np.int64)
+        self.spec_spectrum_id = np.array([spec.spectrum_id for spec in spectra], dtype=np.int64)
+        self.spec_family_id = [spec.family_id for spec in spectra]
+        self.spec_family = np.array([molfam_table.index(spec.family) for spec in spectra], dtype=np.int64)
+        # (the private attributes are used to avoid loading anything that hasn't been loaded yet)
+        self.spec_n_peaks = np.array([-1 if spec._n_peaks is None else spec._n_peaks for spec in spectra], dtype=np.int64)
+        for name in ['rt', 'precursor_mz', 'parent_mz', '_max_ms2_intensity', '_total_ms2_intensity']:
+            column, is_none = _float_column([getattr(spec, name) for spec in spectra])
+            setattr(self, 'spec_' + name.lstrip('_'), column)
+            setattr(self, 'spec_' + name.lstrip('_') + '_none', is_none)
+        self.spec_gnps_id = [spec._gnps_id for spec in spectra]
+
+        # the peaks of all spectra, spectrum i has rows peak_offsets[i]:peak_offsets[i + 1]
+        # (spectra from an earlier snapshot may still only have arrays of their peaks, 
+        # there's no need to unpack them. spectra whose peaks are still in the MGF file 
+        # are saved with no peaks and the location of them instead)
+        self.spec_peak_sources = {i: spec._peak_source for i, spec in enumerate(spectra) if isinstance(spec._peak_source, MGFPeaks)}
+        peaks = []
+        for spec in spectra:
+            if isinstance(spec._peak_source, tuple):
+                peaks.append(spec._peak_source)
+            elif spec._peak_source is not None:
+                peaks.append(((), ()))
+            else:
+                peaks.append((spec.peaks, spec.normalised_peaks))
+        self.peak_offsets = np.zeros(len(spectra) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p, _ in peaks], out=self.peak_offsets[1:])
+        self.peaks = np.zeros((self.peak_offsets[-1], 2), dtype=np.float64)
+        self.normalised_peaks = np.zeros((self.peak_offsets[-1], 2), dtype=np.float64)
+        for i, (spec_peaks, spec_normalised_peaks) in enumerate(peaks):
+            start, end = self.peak_offsets[i], self.peak_offsets[i + 1]
+            if end > start:
+                self.peaks[start:end] = spec_peaks
+                self.normalised_peaks[start:end] = spec_normalised_peaks
+
+        self.spec_strains_indptr, self.spec_strains = _csr([[strain_table.index(strain) for strain in spec.strains] for spec in spectra])
+        # {spectrum index: value} for the containers that are usually empty (read 
+        # from the private attributes, which don't create empty containers)
+        self.spec_containers = {}
+        for name in ['_metadata', '_annotations', '_edges']:
+            self.spec_containers[name] = {i: getattr(spec, name) for i, spec in enumerate(spectra) if len(getattr(spec, name)) > 0}
+        self.spec_growth_media = {i: {strain_table.index(strain): media for strain, media in spec._growth_media.items()}
+                                  for i, spec in enumerate(spectra) if len(spec._growth_media) > 0}
+
+    def _restore_metabolomics(self, loader, strains):
+        molfams = []
+        molfam_ids = self.molfam_id.tolist()
+        for i, is_singleton in enumerate(self.molfam_is_singleton.tolist()):
+            molfam = SingletonFamily.__new__(SingletonFamily) if is_singleton else MolecularFamily.__new__(MolecularFamily)
+            molfam.id = molfam_ids[i]
+            molfam.family_id = self.molfam_family_id[i]
+            molfam.spectra = []
+            molfam.family = None
+            molfams.append(molfam)
+
+        spectra = []
+        ids = self.spec_id.tolist()
+        spectrum_ids = self.spec_spectrum_id.tolist()
+        families = self.spec_family.tolist()
+        n_peaks = self.spec_n_peaks.tolist()
+        floats = {name: _float_values(getattr(self, 'spec_' + name.lstrip('_')), getattr(self, 'spec_' + name.lstrip('_') + '_none'))
+                  for name in ['rt', 'precursor_mz', 'parent_mz', '_max_ms2_intensity', '_total_ms2_intensity']}
+        spec_strains = _csr_rows(self.spec_strains_indptr, self.spec_strains)
+        offsets = self.peak_offsets.tolist()
+        metadata = self.spec_containers['_metadata']
+        annotations = self.spec_containers['_annotations']
+        edges = self.spec_containers['_edges']
+        for i in range(len(ids)):
+            spec = Spectrum.__new__(Spectrum)
+            spec.id = ids[i]
+            spec.spectrum_id = spectrum_ids[i]
+            spec._peaks = None
+            spec._normalised_peaks = None
+            spec._peak_source = self.spec_peak_sources.get(i, None)
+            if spec._peak_source is None:
+                spec._peak_source = (self.peaks[offsets[i]:offsets[i + 1]], self.normalised_peaks[offsets[i]:offsets[i + 1]])
+            spec._n_peaks = None if n_peaks[i] == -1 else n_peaks[i]
+            for name, values in floats.items():
+                setattr(spec, name, values[i])
+            spec._gnps_id = self.spec_gnps_id[i]
+            spec._metadata = metadata.get(i, _EMPTY_DICT)
+            spec._annotations = annotations.get(i, _EMPTY_DICT)
+            spec._deferred_annotations = None
+            spec._edges = edges.get(i, _EMPTY_LIST)
+            spec.strains = self._strain_set(strains, spec_strains[i])
+            spec._growth_media = _EMPTY_DICT
+            if i in self.spec_growth_media:
+                spec._growth_media = {strains[s]: media for s, media in self.spec_growth_media[i].items()}
+            spec.family_id = self.spec_family_id[i]
+            spec.family = molfams[families[i]] if families[i] >= 0 else None
+            spec._losses = None
+            spec._jcamp = None
+            spectra.append(spec)
+
+        for molfam, members in zip(molfams, _csr_rows(self.molfam_spectra_indptr, self.molfam_spectra)):
+            molfam.spectra = [spectra[i] for i in members]
+
+        loader.spectra = spectra[:self.num_spectra]
+        loader.molfams = molfams[:self.num_molfams]
+        if self.molfams_is_set:
+            loader.molfams = set(loader.molfams)
+        return spectra
+
+def load_snapshot(path, loader, fingerprint):
+    """
+    Restore the dataset objects on <loader> from the snapshot at <path>. Returns
+    False if there's no valid snapshot matching the given input fingerprint
+    """
+    metadata = load_store_metadata(path)
+    if metadata is None:
+        return False
+    if metadata.get('fingerprint', None) != fingerprint:
+        logger.info('Dataset snapshot "{}" is out of date'.format(path))
+        return False
+
+    metadata, objects = load_store(None, path, {'dataset': DatasetSnapshot})
+    if objects is None:
+        return False
+
+    objects['dataset'].restore(loader)
+    return True
+
+def save_snapshot(path, loader, fingerprint):
+    """
+    Save the dataset objects from <loader> as a snapshot at <path>
+    """
+    save_store(path, {'fingerprint': fingerprint}, {'dataset': DatasetSnapshot.from_loader(loader)})
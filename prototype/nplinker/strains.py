@@ -1,11 +1,14 @@
 import os
 import csv
+from array import array
 
 from .logconfig import LogConfig
 logger = LogConfig.getLogger(__file__)
 
 class Strain(object):
 
+    __slots__ = ('id', 'aliases')
+
     def __init__(self, primary_strain_id):
         self.id = primary_strain_id
         self.aliases = set()
@@ -41,6 +44,8 @@ class StrainCollection(object):
             existing.aliases.update(strain.aliases)
             for alias in strain.aliases:
                 self._lookup[alias] = existing
+            # (the strain may already be in some StrainSets)
+            _strain_table.update_aliases(existing)
             return
 
         self._lookup_indices[len(self)] = strain
@@ -127,3 +132,158 @@ class StrainCollection(object):
             return 'StrainCollection(n={})'.format(len(self))
 
         return 'StrainCollection(n={}) ['.format(len(self)) + ','.join(s.id for s in self._strains) + ']'
+
+class _StrainTable(object):
+    """
+    Table of every Strain object added to a StrainSet, so that the sets only
+    need to store integer indices into it. Strains are identified by object 
+    (like the dicts/sets of Strains used elsewhere), not by their IDs. The table
+    also maps each strain ID and alias to the indices of the strains with that 
+    ID/alias, so the sets can be searched by ID without checking every strain.
+
+    Each StrainSet keeps a reference to the table it was created with. The
+    loader starts a new table for each dataset (see new_strain_table), so a 
+    table is freed along with the last object from its dataset rather than 
+    growing for as long as the process runs.
+    """
+
+    __slots__ = ('strains', '_indices', '_keys')
+
+    def __init__(self):
+        self.strains = []
+        self._indices = {}
+        self._keys = {}
+
+    def index(self, strain):
+        i = self._indices.get(id(strain))
+        if i is None:
+            # self.strains keeps a reference to the object, so its id() stays unique
+            i = len(self.strains)
+            self._indices[id(strain)] = i
+            self.strains.append(strain)
+            self._add_key(strain.id, i)
+            self.update_aliases(strain)
+        return i
+
+    def _add_key(self, key, i):
+        indices = self._keys.get(key)
+        if indices is None:
+            self._keys[key] = [i]
+        elif i not in indices:
+            indices.append(i)
+
+    def update_aliases(self, strain):
+        # make any aliases added to a strain since it was added to the table searchable
+        i = self._indices.get(id(strain))
+        if i is not None:
+            for alias in strain.aliases:
+                self._add_key(alias, i)
+
+    def find(self, strain_id):
+        # indices of the strains with the given ID or alias
+        return self._keys.get(strain_id, ())
+
+# the table used by new StrainSets
+_strain_table = _StrainTable()
+
+def new_strain_table():
+    """
+    Start a new strain table for the StrainSets created from now on (existing 
+    sets keep using their own table). This is called before loading a dataset.
+    """
+    global _strain_table
+    _strain_table = _StrainTable()
+
+# shared by all empty StrainSets, a new array is only created when a strain is added
+_NO_STRAINS = array('i')
+
+class StrainSet(object):
+    """
+    Compact set of the strains a single object (Spectrum/GCF) was found in. 
+
+    This supports the parts of the StrainCollection interface used for these
+    objects (add/remove/filter, lookup, membership tests, iteration) but only 
+    stores an array of indices into a table of Strain objects shared by all 
+    StrainSets of a dataset, instead of a list and two dicts per object.
+    """
+
+    __slots__ = ('_table', '_indices')
+
+    def __init__(self, strains=()):
+        self._table = _strain_table
+        self._indices = _NO_STRAINS
+        for strain in strains:
+            self.add(strain)
+
+    def _find(self, strain_id):
+        # the table index of the strain in this set with the given ID or alias, or -1
+        for i in self._table.find(strain_id):
+            if i in self._indices:
+                return i
+        return -1
+
+    def add(self, strain):
+        i = self._find(strain.id)
+        if i >= 0:
+            # if it already exists, just merge the set of aliases
+            existing = self._table.strains[i]
+            existing.aliases.update(strain.aliases)
+            self._table.update_aliases(existing)
+            return
+
+        if self._indices is _NO_STRAINS:
+            self._indices = array('i')
+        self._indices.append(self._table.index(strain))
+
+    def remove(self, strain):
+        i = self._find(strain.id)
+        if i < 0:
+            return
+
+        self._indices = array('i', [j for j in self._indices if j != i]) or _NO_STRAINS
+
+    def filter(self, strain_set):
+        """
+        Remove all strains that are not in strain_set from the set
+        """
+        strains = self._table.strains
+        self._indices = array('i', [i for i in self._indices if strains[i] in strain_set]) or _NO_STRAINS
+
+    def lookup(self, strain_id, default=None):
+        # matches the strain ID or any of its aliases, like StrainCollection.lookup
+        i = self._find(strain_id)
+        if i < 0:
+            return default
+        return self._table.strains[i]
+
+    def __contains__(self, strain_id):
+        if not isinstance(strain_id, str):
+            # assume it's a Strain object
+            strain_id = strain_id.id
+        return self._find(strain_id) >= 0
+
+    def __iter__(self):
+        strains = self._table.strains
+        return (strains[i] for i in self._indices)
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __getstate__(self):
+        # the indices are only valid in this process, so pickle the strains
+        return list(self)
+
+    def __setstate__(self, strains):
+        self._table = _strain_table
+        self._indices = _NO_STRAINS
+        for strain in strains:
+            self.add(strain)
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        if len(self) > 20:
+            return 'StrainSet(n={})'.format(len(self))
+
+        return 'StrainSet(n={}) ['.format(len(self)) + ','.join(s.id for s in self) + ']'
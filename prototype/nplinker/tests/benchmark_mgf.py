@@ -0,0 +1,58 @@
+# benchmark for parsing MGF files with multiple processes (see LoadMGF.load_spectra_arrays)
+#
+# run from the directory containing the nplinker package:
+#   python -m nplinker.tests.benchmark_mgf [<MGF file>]
+#
+# without an MGF file, a synthetic one of ~200MB is generated in a temporary directory
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+import numpy as np
+
+from nplinker.parsers.mgf import LoadMGF
+
+NUM_SPECTRA = 50000
+NUM_PEAKS = 200
+
+def write_mgf(filename, num_spectra=NUM_SPECTRA, num_peaks=NUM_PEAKS):
+    rnd = random.Random(42)
+    with open(filename, 'w') as f:
+        for i in range(1, num_spectra + 1):
+            f.write('BEGIN IONS\nPEPMASS={:.4f}\nCHARGE=1+\nRTINSECONDS={:.1f}\nSCANS={}\n'.format(100 + rnd.random() * 1000, rnd.random() * 1000, i))
+            for j in range(num_peaks):
+                f.write('{:.5f}\t{:.3f}\n'.format(50 + rnd.random() * 1000, rnd.random() * 1000))
+            f.write('END IONS\n\n')
+
+def parse(mgf_file, processes):
+    t = time.time()
+    result = LoadMGF(name_field='scans').load_spectra_arrays(mgf_file, processes=processes)
+    return time.time() - t, result
+
+def same_result(a, b):
+    (ms1_a, md_a, peaks_a, offsets_a), (ms1_b, md_b, peaks_b, offsets_b) = a, b
+    return [(m.id, m.name) for m in ms1_a] == [(m.id, m.name) for m in ms1_b] and md_a == md_b \
+        and np.array_equal(peaks_a, peaks_b) and np.array_equal(offsets_a, offsets_b)
+
+def main(mgf_file):
+    cpus = os.cpu_count() or 1
+    processes = sorted(set([1, 2, 4, 8, cpus]))
+    print('{}: {:.1f}MB, {} CPUs'.format(mgf_file, os.path.getsize(mgf_file) / 1e6, cpus))
+
+    baseline, expected = parse(mgf_file, 1)
+    print('processes=1: {:.2f}s, {} spectra'.format(baseline, len(expected[0])))
+    for p in processes[1:]:
+        elapsed, result = parse(mgf_file, p)
+        print('processes={}: {:.2f}s, speed-up {:.2f}x, same result: {}'.format(p, elapsed, baseline / elapsed, same_result(result, expected)))
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(sys.argv[1])
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            mgf_file = os.path.join(tmp_dir, 'benchmark.mgf')
+            write_mgf(mgf_file)
+            main(mgf_file)
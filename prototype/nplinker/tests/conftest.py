@@ -0,0 +1,258 @@
+# pytest setup shared by all the tests
+#
+# nplinker isn't installed as a package, and since the tests directory is
+# inside it pytest puts the nplinker directory itself on sys.path, where
+# "import nplinker" would find nplinker/nplinker.py instead of the package.
+# Fix up sys.path so that the package can be imported as usual (and the
+# scoring modules directly, which some of the older tests do).
+
+import math
+import os
+import sys
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+NPLINKER_DIR = os.path.dirname(TESTS_DIR)
+PACKAGE_PARENT = os.path.dirname(NPLINKER_DIR)
+
+sys.path[:] = [p for p in sys.path if os.path.abspath(p or os.curdir) != NPLINKER_DIR]
+for path in [os.path.join(NPLINKER_DIR, 'scoring'), PACKAGE_PARENT]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+sys.modules.pop('nplinker', None)
+import nplinker
+
+import numpy as np
+import pytest
+
+from nplinker.genomics import BGC, GCF
+from nplinker.metabolomics import Spectrum, MolecularFamily
+from nplinker.scoring.data_linking import DataLinks, LinkFinder, LinkLikelihood
+from nplinker.strains import Strain, StrainCollection
+
+FAMILY_ID_OFFSET = 1000
+
+def random_subset(rng, items):
+    return [items[i] for i in sorted(rng.choice(len(items), rng.integers(1, len(items)), replace=False))]
+
+def create_linking_objects(seed=0, num_strains=20, num_gcfs=12, num_spectra=30):
+    """
+    Create a random set of strains, GCFs (with BGCs), spectra and molecular 
+    families that can be used to test the scoring code. Some of the spectra
+    are singletons (family -1). Returns (strains, gcfs, spectra, molfams)
+    """
+    rng = np.random.default_rng(seed)
+    strains = [Strain('strain_{:02d}'.format(i)) for i in range(num_strains)]
+
+    gcfs = []
+    for i in range(num_gcfs):
+        gcf = GCF(i, 'gcf_{}'.format(i), 'NRPS')
+        for j, strain in enumerate(random_subset(rng, strains)):
+            gcf.add_bgc(BGC(j, strain, strain.id, 'NRPS', None))
+        gcfs.append(gcf)
+
+    spectra = []
+    family_ids = rng.integers(-1, num_spectra // 3, num_spectra)
+    for i in range(num_spectra):
+        spec = Spectrum(i, [(1, 2), (3, 4)], i, rng.random())
+        spec.family = int(family_ids[i])
+        spec.family_id = spec.family
+        for strain in random_subset(rng, strains):
+            spec.add_strain(strain, 'medium', 1)
+        spectra.append(spec)
+
+    # the families are in the order of their family ids, which is also the order 
+    # of the rows in DataLinks.M_fam_strain. Their IDs are offset so that they don't
+    # clash with the spectrum IDs (the objects compare equal if their IDs are equal)
+    molfams = []
+    for i, family_id in enumerate(sorted(set(int(x) for x in family_ids if x != -1))):
+        molfam = MolecularFamily(family_id)
+        molfam.id = FAMILY_ID_OFFSET + i
+        for spec in spectra:
+            if spec.family == family_id:
+                molfam.add_spectrum(spec)
+        molfams.append(molfam)
+
+    return strains, gcfs, spectra, molfams
+
+def score_all(spectra, gcfs, strains, packed=False):
+    """
+    Return DataLinks and LinkFinder objects for the given data, with every type
+    of score calculated
+    """
+    datalinks = DataLinks(packed=packed)
+    datalinks.load_data(spectra, gcfs, strains)
+    datalinks.find_correlations()
+    linkfinder = LinkFinder()
+    likelihoods = LinkLikelihood()
+    for type_ in ['spec-gcf', 'fam-gcf']:
+        linkfinder.metcalf_scoring(datalinks, type=type_)
+        linkfinder.standardised_metcalf_scoring(datalinks, type=type_)
+        linkfinder.hg_scoring(datalinks, type=type_)
+        likelihoods.calculate_likelihoods(datalinks, type=type_)
+        linkfinder.likelihood_scoring(datalinks, likelihoods, type=type_)
+    return datalinks, linkfinder
+
+class FakeNPLinker(object):
+    """
+    The parts of the NPLinker class that the scoring methods use
+    """
+
+    def __init__(self, root_dir, strains, gcfs, spectra, molfams, config=None):
+        self.root_dir = str(root_dir)
+        self.config = config or {}
+        self.bgcs = [bgc for gcf in gcfs for bgc in gcf.bgcs]
+        self._gcfs = self.gcfs = gcfs
+        self._spectra = self.spectra = spectra
+        self._molfams = self.molfams = molfams
+        self._strains = self.strains = StrainCollection()
+        for strain in strains:
+            self._strains.add(strain)
+
+@pytest.fixture
+def linking_objects():
+    return create_linking_objects()
+
+@pytest.fixture
+def metcalf_npl(tmp_path, linking_objects):
+    from nplinker.scoring.methods import MetcalfScoring
+    npl = FakeNPLinker(tmp_path, *linking_objects)
+    MetcalfScoring.setup(npl)
+    return npl
+
+def create_mgf(path, num_spectra, num_peaks, rng):
+    """
+    Write an MGF file with spectra 1 to <num_spectra> (the SCANS values) and 
+    random peaks. It includes an MSLEVEL=1 spectrum (7), a spectrum with no 
+    non-zero peaks (9), peaks with zero intensity, spectra with a library ID, 
+    and has no END IONS line after the last spectrum
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        for i in range(1, num_spectra + 1):
+            f.write('BEGIN IONS\nPEPMASS={:.4f}{}\nCHARGE={}\nRTINSECONDS={}\nSCANS={}\n'.format(
+                    100 + i * 3.1, ' 5000.0' if i % 2 else '', '2+' if i % 5 == 0 else '1+', 10.5 * i, i))
+            if i % 17 == 0:
+                f.write('SPECTRUMID=CCMSLIB{:08d}\n'.format(i))
+            if i == 7:
+                f.write('MSLEVEL=1\n')
+            for k in range(num_peaks):
+                intensity = 0.0 if i == 9 or k % 7 == 3 else rng.random() * 1000
+                f.write('{:.5f}\t{:.3f}\n'.format(rng.random() * 500 + 50, intensity))
+            if i != num_spectra:
+                f.write('END IONS\n\n')
+
+def create_dataset(root, num_spectra=60, num_peaks=20, seed=0):
+    """
+    Write a small (old-style GNPS, non-paired) dataset under <root> with 8 strains
+    and 3 BGCs per strain, and an MGF file from create_mgf
+    """
+    from Bio import SeqIO
+    from Bio.Seq import Seq
+    from Bio.SeqRecord import SeqRecord
+
+    rng = np.random.default_rng(seed)
+    root = str(root)
+
+    def _open(path):
+        path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return open(path, 'w')
+
+    strains = ['STR{}'.format(i) for i in range(1, 9)]
+    with _open('strain_mappings.csv') as f:
+        for strain in strains:
+            f.write('{},{}_alt\n'.format(strain, strain))
+
+    scans = list(range(1, num_spectra + 1))
+    create_mgf(os.path.join(root, 'spectra', 'specs.mgf'), num_spectra, num_peaks, rng)
+
+    valid = [i for i in scans if i not in (7, 9)]
+    with _open('clusterinfo_summary/nodes.tsv') as f:
+        f.write('cluster index\tAllFiles\tx\n')
+        for i in valid:
+            files = ['{}.mzXML:{}'.format(strain, i) for strain in rng.choice(strains, 3, replace=False)]
+            f.write('{}\t{}\t0\n'.format(i, '###'.join(files)))
+    with _open('networkedges_selfloop/edges.pairsinfo') as f:
+        f.write('CLUSTERID1\tCLUSTERID2\tCosine\tComponentIndex\n')
+        for i in valid:
+            f.write('{}\t{}\t{:.3f}\t{}\n'.format(i, rng.choice(valid), rng.random(), -1 if i % 4 == 0 else i % 6))
+    with _open('DB_result/gnps.tsv') as f:
+        f.write('#Scan#\tCompound_Name\tOrganism\tMQScore\tSpectrumID\n')
+        for i in valid[::5]:
+            if i % 17 != 0:
+                f.write('{}\tcmpd{}\torg\t0.9\tCCMSLIB{:08d}\n'.format(i, i, i))
+
+    os.makedirs(os.path.join(root, 'mibig_json'), exist_ok=True)
+    bgcs = []
+    for strain in strains:
+        for region in range(1, 4):
+            name = '{}_region{:03d}'.format(strain, region)
+            record = SeqRecord(Seq('ACGT' * 10), id='NZ_{}.{}'.format(strain, region), name='ACC{}{}'.format(strain, region), 
+                               description='x', annotations={'molecule_type': 'DNA'})
+            with _open(os.path.join('antismash', strain, name + '.gbk')) as f:
+                SeqIO.write([record], f, 'genbank')
+            bgcs.append(name)
+    with _open('bigscape/NRPS/NRPS_clustering_c0.30.tsv') as f:
+        f.write('#BGC Name\tFamily Number\n')
+        for i, bgc in enumerate(bgcs):
+            f.write('{}\t{}\n'.format(bgc, i % 7))
+    with _open('bigscape/NRPS/Network_Annotations_NRPS.tsv') as f:
+        f.write('BGC\tAccession ID\tDescription\tProduct Prediction\tBiG-SCAPE class\tOrganism\tTaxonomy\n')
+        for bgc in bgcs:
+            f.write('{}\tacc\tdesc {}\tnrps\tNRPS\torg\ttax\n'.format(bgc, bgc))
+    with _open('bigscape/NRPS/NRPS_c0.30.network') as f:
+        f.write('Clustername 1\tClustername 2\tRaw distance\n')
+        for _ in range(40):
+            f.write('{}\t{}\t0.5\n'.format(rng.choice(bgcs), rng.choice(bgcs)))
+
+def load_test_dataset(root, load_plan='full', snapshot=False, **options):
+    """
+    Load the dataset at <root> (see create_dataset) with a DatasetLoader
+    """
+    from nplinker.loader import DatasetLoader
+    dataset = dict(options, root=str(root), platform_id='', load_plan=load_plan, snapshot=snapshot)
+    loader = DatasetLoader({'dataset': dataset})
+    loader.validate()
+    assert loader.load(False)
+    return loader
+
+def dataset_contents(loader):
+    """
+    The contents of every object loaded by <loader> as plain values that can be 
+    compared between loads. Anything that wasn't loaded yet is loaded
+    """
+    spectra = [(spec.id, spec.spectrum_id, spec.peaks, spec.normalised_peaks, spec.n_peaks, 
+                spec.max_ms2_intensity, spec.total_ms2_intensity, spec.precursor_mz, spec.parent_mz, 
+                spec.rt, spec.gnps_id, spec.metadata, spec.annotations, spec.edges, 
+                sorted(strain.id for strain in spec.strains), 
+                sorted((strain.id, media) for strain, media in spec.growth_media.items()),
+                spec.family.id, spec.family_id) for spec in loader.spectra]
+    molfams = [(molfam.id, molfam.family_id, [spec.id for spec in molfam.spectra]) for molfam in loader.molfams]
+    bgcs = [(bgc.id, bgc.name, bgc.strain.id, bgc.antismash_id, bgc.antismash_accession, bgc.antismash_file, 
+             bgc.product_prediction, bgc.bigscape_class, sorted(bgc.edges), bgc.parent.id, bgc.region) for bgc in loader.bgcs]
+    gcfs = [(gcf.id, gcf.gcf_id, gcf.product_type, sorted(gcf.classes), sorted(bgc.id for bgc in gcf.bgcs), 
+             sorted(strain.id for strain in gcf.strains),
+             sorted((strain.id, bgc.id) for strain, bgc in gcf.strains_lookup.items())) for gcf in loader.gcfs]
+    strains = sorted((strain.id, sorted(strain.aliases)) for strain in loader.strains)
+    return {'spectra': spectra, 'molfams': molfams, 'bgcs': bgcs, 'gcfs': gcfs, 'strains': strains,
+            'mibig': sorted(loader.mibig_bgc_dict.keys()), 'product_types': loader.product_types}
+
+def assert_close(actual, expected, rel_tol=1e-12, path='value'):
+    """
+    Assert that two nested structures of lists, tuples and dicts are equal, with
+    floats only having to be equal to within <rel_tol> (e.g. where intensities 
+    can be summed in a different order)
+    """
+    if isinstance(expected, float) and isinstance(actual, float):
+        assert math.isclose(actual, expected, rel_tol=rel_tol), '{}: {} != {}'.format(path, actual, expected)
+    elif isinstance(expected, dict) and isinstance(actual, dict):
+        assert sorted(actual.keys(), key=repr) == sorted(expected.keys(), key=repr), path
+        for key in expected:
+            assert_close(actual[key], expected[key], rel_tol, '{}[{!r}]'.format(path, key))
+    elif isinstance(expected, (list, tuple)) and isinstance(actual, (list, tuple)):
+        assert type(actual) == type(expected) and len(actual) == len(expected), path
+        for i, (a, e) in enumerate(zip(actual, expected)):
+            assert_close(a, e, rel_tol, '{}[{}]'.format(path, i))
+    else:
+        assert actual == expected, '{}: {} != {}'.format(path, actual, expected)
@@ -0,0 +1,95 @@
+# tests for saving/loading objects in an array store
+
+import os
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from nplinker.arraystore import save_store, load_store, load_store_metadata, MANIFEST
+from nplinker.scoring.data_linking import DataLinks, LinkFinder
+from nplinker.scoring.data_linking_functions import PackedStrainMatrix, OccurrenceCSR
+
+from .conftest import create_linking_objects, score_all
+
+def assert_same_value(loaded, original):
+    assert type(loaded) == type(original) or isinstance(loaded, np.memmap)
+    if isinstance(original, np.ndarray):
+        assert loaded.dtype == original.dtype
+        assert np.array_equal(loaded, original, equal_nan=original.dtype.kind in 'fc')
+        # arrays are memory-mapped read-only from the store
+        assert not loaded.flags.writeable
+    elif isinstance(original, PackedStrainMatrix):
+        assert loaded.num_strains == original.num_strains
+        assert_same_value(loaded.words, original.words)
+    elif isinstance(original, OccurrenceCSR):
+        assert loaded.num_strains == original.num_strains
+        assert_same_value(loaded.indptr, original.indptr)
+        assert_same_value(loaded.indices, original.indices)
+    elif isinstance(original, pd.DataFrame):
+        pd.testing.assert_frame_equal(loaded, original)
+    elif isinstance(original, list) and len(original) > 0 and isinstance(original[0], tuple):
+        # DataLinks.family_members
+        assert len(loaded) == len(original)
+        for a, b in zip(loaded, original):
+            assert all(np.array_equal(x, y) for x, y in zip(a, b))
+    else:
+        assert loaded == original
+
+@pytest.mark.parametrize('packed', [False, True])
+def test_store_round_trip(tmp_path, packed):
+    strains, gcfs, spectra, molfams = create_linking_objects()
+    datalinks, linkfinder = score_all(spectra, gcfs, strains, packed)
+    metadata = {'hashes': datalinks.content_hashes(spectra, gcfs, strains), 'packed_strains': packed}
+    store_dir = str(tmp_path / 'store')
+    save_store(store_dir, metadata, {'datalinks': datalinks, 'linkfinder': linkfinder})
+
+    assert load_store_metadata(store_dir) == metadata
+    loaded_metadata, objects = load_store(None, store_dir, {'datalinks': DataLinks, 'linkfinder': LinkFinder})
+    assert loaded_metadata == metadata
+
+    kinds = set()
+    for name, original in [('datalinks', datalinks), ('linkfinder', linkfinder)]:
+        loaded = objects[name]
+        assert type(loaded) == type(original)
+        assert vars(loaded).keys() == vars(original).keys()
+        for attr, value in vars(original).items():
+            assert_same_value(getattr(loaded, attr), value)
+            kinds.add(type(value))
+    assert OccurrenceCSR in kinds
+    assert (PackedStrainMatrix in kinds) == packed
+
+    # the loaded objects give the same links as the originals
+    for objects_ in [spectra, molfams, gcfs]:
+        for main_score in ['metcalf', 'hg']:
+            expected = linkfinder.get_links(datalinks, objects_, main_score, None)
+            actual = objects['linkfinder'].get_links(objects['datalinks'], objects_, main_score, None)
+            assert all(np.array_equal(a, e) for a, e in zip(actual, expected))
+
+def test_store_invalid(tmp_path):
+    store_dir = str(tmp_path / 'store')
+    assert load_store_metadata(store_dir) is None
+    assert load_store(None, store_dir, {}) == (None, None)
+
+    strains, gcfs, spectra, molfams = create_linking_objects()
+    datalinks = DataLinks()
+    datalinks.load_data(spectra, gcfs, strains)
+    save_store(store_dir, {'a': 1}, {'datalinks': datalinks})
+    assert load_store_metadata(store_dir) == {'a': 1}
+
+    # stores from a different version are ignored
+    manifest_path = os.path.join(store_dir, MANIFEST)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest['version'] = -1
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+    assert load_store_metadata(store_dir) is None
+
+    # saving again replaces the old contents, and a store without a 
+    # manifest is incomplete
+    save_store(store_dir, {'a': 2}, {'datalinks': datalinks})
+    assert load_store_metadata(store_dir) == {'a': 2}
+    os.unlink(manifest_path)
+    assert load_store(None, store_dir, {'datalinks': DataLinks}) == (None, None)
@@ -6,7 +6,156 @@
 # spec  stands for spectrum
 # fam   stands for molecular family
 
-from data_linking import DataLinks
+import numpy as np
+import pandas as pd
+import pytest
+
+from nplinker.genomics import BGC, GCF
+from nplinker.scoring.data_linking import DataLinks, LinkFinder
+from nplinker.scoring.data_linking_functions import PackedStrainMatrix
+
+from .conftest import create_linking_objects, score_all
 
 def test_find_correlations():
     pass
+
+def sorted_links(links):
+    return [x[:, np.lexsort((x[1], x[0]))] for x in links]
+
+@pytest.fixture
+def scored_objects():
+    strains, gcfs, spectra, molfams = create_linking_objects(seed=1)
+    # objects found in every strain have undefined standardised Metcalf and 
+    # likelihood scores
+    gcf = GCF(len(gcfs), 'gcf_all', 'NRPS')
+    for i, strain in enumerate(strains):
+        gcf.add_bgc(BGC(i, strain, strain.id, 'NRPS', None))
+    gcfs.append(gcf)
+    for strain in strains:
+        if strain not in spectra[0].strains:
+            spectra[0].add_strain(strain, 'medium', 1)
+    return strains, gcfs, spectra, molfams
+
+@pytest.mark.parametrize('main_score,cutoff', [('metcalf', None), ('metcalf', 5),
+                                               ('metcalf_std', None), ('metcalf_std', 0.5),
+                                               ('hg', None), ('hg', 0.1),
+                                               ('likescore', None), ('likescore', 0.2)])
+@pytest.mark.parametrize('packed', [False, True])
+def test_query_links(scored_objects, main_score, cutoff, packed):
+    # the block-wise query_links should find the same links as get_links
+    # does with the full score matrices
+    strains, gcfs, spectra, molfams = scored_objects
+    datalinks, linkfinder = score_all(spectra, gcfs, strains, packed)
+    for objects in [spectra, spectra[3:9], molfams, gcfs, gcfs[-3:]]:
+        expected = sorted_links(linkfinder.get_links(datalinks, objects, main_score, cutoff))
+        with np.errstate(all='raise'):
+            actual = sorted_links(LinkFinder().query_links(datalinks, objects, main_score, cutoff, block_size=7))
+        assert len(actual) == len(expected)
+        for a, e in zip(actual, expected):
+            assert a.shape == e.shape
+            assert np.array_equal(a[:2], e[:2])
+            assert np.allclose(a[2], e[2], equal_nan=True)
+
+def test_score_block(scored_objects):
+    strains, gcfs, spectra, molfams = scored_objects
+    datalinks, linkfinder = score_all(spectra, gcfs, strains)
+    type1_ids = np.array([0, 5, 2, 9])
+    gcf_ids = np.array([len(gcfs) - 1, 0, 4])
+    for type_ in ['spec-gcf', 'fam-gcf']:
+        for main_score in ['metcalf', 'metcalf_std', 'hg', 'likescore']:
+            expected = linkfinder.get_scores(main_score, type_)[type1_ids[:, None], gcf_ids[None, :]]
+            actual = LinkFinder().score_block(datalinks, type1_ids, gcf_ids, main_score, type_)
+            assert np.allclose(actual, expected, equal_nan=True)
+
+def as_array(M):
+    return M.words if isinstance(M, PackedStrainMatrix) else np.asarray(M)
+
+def assert_same_links(datalinks, linkfinder, expected_datalinks, expected_linkfinder):
+    for attr in ['M_spec_strain', 'M_gcf_strain', 'M_fam_strain',
+                 'M_spec_gcf', 'M_spec_notgcf', 'M_notspec_gcf', 'M_notspec_notgcf', 
+                 'M_fam_gcf', 'M_fam_notgcf', 'M_notfam_gcf', 'M_notfam_notgcf']:
+        assert np.array_equal(as_array(getattr(datalinks, attr)), as_array(getattr(expected_datalinks, attr))), attr
+    for attr in ['mapping_spec', 'mapping_gcf', 'mapping_strain', 'mapping_fam']:
+        pd.testing.assert_frame_equal(getattr(datalinks, attr), getattr(expected_datalinks, attr), check_dtype=False)
+
+    for type_ in ['spec-gcf', 'fam-gcf']:
+        for method in ['metcalf', 'metcalf_std', 'hg']:
+            assert np.allclose(linkfinder.get_scores(method, type_), expected_linkfinder.get_scores(method, type_), equal_nan=True)
+        # (likelihood scores have to be recalculated)
+        assert len(linkfinder.get_scores('likescore', type_)) == 0
+
+@pytest.mark.parametrize('new_families', [False, True])
+@pytest.mark.parametrize('packed', [False, True])
+def test_incremental_updates(new_families, packed):
+    # adding spectra, GCFs and strains to existing DataLinks should give the same
+    # results as loading everything from scratch
+    strains, gcfs, spectra, molfams = create_linking_objects(seed=2)
+    num_spectra, num_gcfs, num_strains = 22, 9, 16
+    added = spectra[num_spectra:]
+    if new_families:
+        # some of the new spectra form new families, others join existing ones
+        for i, spec in enumerate(added):
+            spec.family = 100 + i % 3 if i % 2 == 0 else spectra[i].family
+    else:
+        # the new spectra only belong to existing families (or are singletons)
+        for i, spec in enumerate(added):
+            spec.family = spectra[i].family if i % 3 else -1
+    assert (len(set(s.family for s in added) - set(s.family for s in spectra[:num_spectra])) > 0) == new_families
+
+    datalinks, linkfinder = score_all(spectra[:num_spectra], gcfs[:num_gcfs], strains[:num_strains], packed)
+    num_families = len(datalinks.mapping_fam)
+
+    changes = datalinks.add_spectra(added)
+    assert changes.keys() == {'spec-gcf', 'fam-gcf'}
+    linkfinder.update_scores(datalinks, changes)
+    assert_same_links(datalinks, linkfinder, *score_all(spectra, gcfs[:num_gcfs], strains[:num_strains], packed))
+    assert (len(datalinks.mapping_fam) > num_families) == new_families
+
+    changes = datalinks.add_gcfs(gcfs[num_gcfs:])
+    linkfinder.update_scores(datalinks, changes)
+    assert_same_links(datalinks, linkfinder, *score_all(spectra, gcfs, strains[:num_strains], packed))
+
+    changes = datalinks.add_strains(strains[num_strains:], spectra, gcfs)
+    linkfinder.update_scores(datalinks, changes)
+    assert_same_links(datalinks, linkfinder, *score_all(spectra, gcfs, strains, packed))
+
+def test_incremental_updates_without_families():
+    # before find_correlations has been called there are no family matrices to update
+    strains, gcfs, spectra, molfams = create_linking_objects(seed=3)
+    datalinks = DataLinks()
+    datalinks.load_data(spectra[:20], gcfs[:8], strains[:15])
+    datalinks.correlation_matrices(type='spec-gcf')
+    linkfinder = LinkFinder()
+    linkfinder.metcalf_scoring(datalinks, type='spec-gcf')
+
+    for changes in [datalinks.add_gcfs(gcfs[8:]),
+                    datalinks.add_spectra(spectra[20:]),
+                    datalinks.add_strains(strains[15:], spectra, gcfs)]:
+        assert changes.keys() == {'spec-gcf'}
+        linkfinder.update_scores(datalinks, changes)
+    assert len(datalinks.M_fam_strain) == 0
+
+    expected = DataLinks()
+    expected.load_data(spectra, gcfs, strains)
+    expected.correlation_matrices(type='spec-gcf')
+    assert np.array_equal(datalinks.M_spec_gcf, expected.M_spec_gcf)
+    assert np.array_equal(linkfinder.metcalf_spec_gcf, LinkFinder().metcalf_scoring(expected, type='spec-gcf'))
+
+@pytest.mark.parametrize('packed', [False, True])
+def test_hg_scoring(scored_objects, packed):
+    from scipy.stats import hypergeom
+    strains, gcfs, spectra, molfams = scored_objects
+    datalinks, linkfinder = score_all(spectra, gcfs, strains, packed=packed)
+    num_strains = len(strains)
+    for type_, objects in [('spec-gcf', spectra), ('fam-gcf', molfams)]:
+        M_type1_strain = datalinks.M_spec_strain if type_ == 'spec-gcf' else datalinks.M_fam_strain
+        n = np.asarray(M_type1_strain.sum(axis=1), dtype=np.float64)[:, None]
+        m = np.asarray(datalinks.M_gcf_strain.sum(axis=1), dtype=np.float64)[None, :]
+        overlap = np.asarray(datalinks.M_spec_gcf if type_ == 'spec-gcf' else datalinks.M_fam_gcf, dtype=np.float64)
+        expected = hypergeom.sf(overlap, num_strains, m, n, loc=1)
+        assert np.allclose(linkfinder.get_scores('hg', type_), expected, rtol=1e-10, atol=0)
+        # the same scores calculated for blocks of objects
+        rows = np.arange(0, len(objects), 2)
+        cols = np.arange(1, len(gcfs), 3)
+        block = linkfinder.score_block(datalinks, rows, cols, 'hg', type_)
+        assert np.allclose(block, expected[np.ix_(rows, cols)], rtol=1e-10, atol=0)
@@ -112,4 +112,211 @@ def test_link_prob():
     Ny = 3
     Nx = 5
     assert link_prob(P_str, XGS, Nx, Ny, Nstr) == 6*0.5*P_str[0]**2/(0.9*0.8)
-  
\ No newline at end of file
+  
+
+from data_linking_functions import pack_strain_matrix, popcount
+
+def test_pack_strain_matrix():
+    # Test packed strain matrices against their dense equivalent (spans 2 words)
+    rng = np.random.RandomState(42)
+    A = rng.rand(7, 100) > 0.6
+    B = rng.rand(9, 100) > 0.6
+    A_packed = pack_strain_matrix(A)
+    B_packed = pack_strain_matrix(B)
+    assert A_packed.shape == (7, 100)
+    assert A_packed.words.shape == (7, 2)
+    assert np.array_equal(A_packed.toarray(dtype=bool), A)
+    assert np.array_equal(A_packed[2, :], A[2, :])
+    assert np.array_equal(A_packed.sum(axis=1), A.sum(axis=1))
+    assert np.array_equal(A_packed.sum(axis=0), A.sum(axis=0))
+    assert np.array_equal(popcount(A_packed.words).sum(axis=1), A.sum(axis=1))
+    assert np.array_equal(A_packed.common_indices(3, B_packed, 4), np.where(A[3] & B[4])[0])
+
+    dense = calc_correlation_matrix(A.astype(float), B.astype(float))
+    packed = calc_correlation_matrix(A_packed, B_packed)
+    for M_dense, M_packed in zip(dense, packed):
+        assert np.array_equal(M_dense, M_packed)
+
+
+def test_calc_correlation_matrix_single_product():
+    # Derived matrices must match the explicit products, as small signed ints
+    rng = np.random.RandomState(1)
+    A = (rng.rand(6, 30) > 0.5).astype(float)
+    B = (rng.rand(8, 30) > 0.5).astype(float)
+    expected = [np.dot(A, B.T), np.dot(A, 1 - B.T), np.dot(1 - A, B.T), np.dot(1 - A, 1 - B.T)]
+    result = calc_correlation_matrix(A, B)
+    for M_expected, M in zip(expected, result):
+        assert M.dtype == np.int8
+        assert np.array_equal(M_expected, M)
+    # differences between the matrices mustn't wrap around
+    assert np.array_equal(result[0] - result[1], expected[0] - expected[1])
+
+    table = calc_correlation_matrix(A, B, lazy=True)
+    assert table.shape == (6, 8)
+    for M_expected, M in zip(expected, table):
+        assert np.array_equal(M_expected, M)
+    metcalf = expected[0] * 10 - expected[1] * 10 + expected[3]
+    assert np.array_equal(table.metcalf(10, -10, 0, 1), metcalf)
+
+
+from data_linking_functions import OccurrenceCSR
+
+def test_occurrence_csr():
+    # Test CSR strain indices against the equivalent dense/packed matrices
+    csr = OccurrenceCSR.from_lists([[3, 0, 3], [], [69, 1]], 70)
+    assert csr.shape == (3, 70)
+    assert list(csr.row(0)) == [0, 3]
+    assert list(csr.counts()) == [2, 0, 2]
+    dense = csr.to_dense()
+    assert dense.sum() == 4
+    assert dense[2, 69] == 1 and dense[0, 3] == 1 and dense[1].sum() == 0
+    assert np.array_equal(csr.to_packed().toarray(), dense)
+
+
+from scipy.stats import hypergeom
+from data_linking_functions import metcalf_expected_variance
+
+def test_metcalf_expected_variance():
+    # Compare the closed-form table with explicit sums over the hypergeometric pmf
+    N = 9
+    weights = (10, -10, 0, 1)
+    expected, variance = metcalf_expected_variance(N, *weights)
+    assert expected.shape == (N + 1, N + 1)
+    for n in range(N + 1):
+        for m in range(N + 1):
+            o = np.arange(max(0, n + m - N), min(n, m) + 1)
+            p = hypergeom.pmf(o, N, n, m)
+            score = o * weights[0] + (n - o) * weights[1] + (m - o) * weights[2] + (N - (n + m - o)) * weights[3]
+            e = np.sum(p * score)
+            v = np.sum(p * score ** 2) - e ** 2
+            assert np.isclose(expected[n, m], e)
+            assert np.isclose(variance[n, m], v if v >= 1e-09 else 1)
+    # results are cached per (N, weights)
+    assert metcalf_expected_variance(N, *weights)[0] is expected
+
+
+from data_linking_functions import top_k_by_group
+
+def test_top_k_by_group():
+    # Test selecting the k highest scores per group
+    groups = np.array([1, 0, 1, 1, 0, 2])
+    scores = np.array([0.5, 2.0, 3.0, 1.0, -1.0, 0.0])
+    keep = top_k_by_group(groups, scores, 2)
+    assert list(keep) == [1, 4, 2, 3, 5]
+    assert list(top_k_by_group(groups, scores, 1)) == [1, 2, 5]
+
+
+from data_linking_functions import pair_prob_hg, pair_prob_approx, link_prob
+from data_linking_functions import pair_prob_hg_batch, pair_prob_approx_batch, link_prob_batch
+
+def test_link_prob_batch():
+    # Compare the batched log-space versions with the per-link functions
+    P_str = np.array([0.1, 0.3, 0.05, 0.15, 0.2, 0.2])
+    Nstr = len(P_str)
+    links = [([0, 1, 3], [1, 3], 3), ([2], [], 2), ([0, 1, 2, 4], [0, 2, 4], 4), ([5, 4], [4], 1)]
+    Nx = np.array([len(XG) for XG, XGS, Ny in links])
+    Ny = np.array([Ny for XG, XGS, Ny in links])
+    hits = np.array([len(XGS) for XG, XGS, Ny in links])
+    P_str_sum = np.array([np.sum(P_str[XG]) for XG, XGS, Ny in links])
+    log_P_shared = np.array([np.sum(np.log(P_str[XGS])) for XG, XGS, Ny in links])
+
+    assert np.allclose(pair_prob_hg_batch(hits, Nstr, Nx, Ny), 
+                       [pair_prob_hg(k, Nstr, x, y) for k, x, y in zip(hits, Nx, Ny)])
+    assert np.allclose(pair_prob_approx_batch(P_str_sum, Nx, Ny, hits, Nstr), 
+                       [pair_prob_approx(P_str, XG, y, k) for (XG, XGS, y), k in zip(links, hits)])
+    assert np.allclose(link_prob_batch(log_P_shared, Nx, Ny, hits, Nstr), 
+                       [link_prob(P_str, XGS, x, y, Nstr) for (XG, XGS, y), x in zip(links, Nx)])
+    # no overflow for large numbers of strains
+    assert np.isfinite(pair_prob_hg_batch(500, 5000, 1000, 2000))
+
+
+from data_linking_functions import hypergeom_sf_lookup, hypergeom_sf_table
+
+def test_hypergeom_sf_lookup():
+    # Compare the table lookup with scipy for all possible counts
+    N = 7
+    o, n, m = np.meshgrid(np.arange(N + 1), np.arange(N + 1), np.arange(N + 1), indexing='ij')
+    valid = (o <= np.minimum(n, m)) & (o >= n + m - N)
+    o, n, m = o[valid], n[valid], m[valid]
+    assert np.allclose(hypergeom_sf_lookup(o, N, n, m), hypergeom.sf(o, N, m, n, loc=1))
+
+def test_hypergeom_sf_table():
+    # The table is cached, and only filled in for the pairs of strain counts
+    # which have been looked up
+    N = 60
+    rng = np.random.default_rng(0)
+    table = hypergeom_sf_table(N)
+    assert hypergeom_sf_table(N) is table
+    for i in range(5):
+        n = rng.integers(0, N + 1, (40, 1))
+        m = rng.integers(0, N + 1, (1, 30))
+        o = rng.hypergeometric(np.broadcast_to(m, (40, 30)), N - m, np.broadcast_to(n, (40, 30)))
+        assert np.allclose(hypergeom_sf_lookup(o, N, n, m), hypergeom.sf(o, N, m, n, loc=1), rtol=1e-10, atol=0)
+
+        # (the values for k = 0..min(n, m) of each (min(n, m), max(n, m)) pair)
+        n_keys = table.keys // (N + 1)
+        assert np.all(n_keys <= table.keys % (N + 1))
+        assert len(table.values) == np.sum(n_keys + 1)
+        num_keys = len(table.keys)
+        assert np.array_equal(hypergeom_sf_lookup(o.T, N, m.T, n.T), hypergeom_sf_lookup(o, N, n, m).T)
+        assert len(table.keys) == num_keys
+
+    assert hypergeom_sf_lookup(np.zeros((0, 3)), N, np.zeros((0, 1)), np.ones((1, 3))).shape == (0, 3)
+
+def test_calc_likelihood_matrix_outputs():
+    # Only the requested likelihood matrices are calculated
+    A = np.array([[0, 0, 0, 1], [0, 0, 1, 1], [0, 0, 1, 1], [0, 0, 0, 1], [0, 0, 0, 1]])
+    B = np.array([[1, 1, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0], [0, 1, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1]])
+    M_A_B, M_A_notB, M_notA_B, M_notA_notB = calc_correlation_matrix(A, B)
+    full = calc_likelihood_matrix(A, B, M_A_B, M_A_notB, M_notA_B)
+    LBA, LBnotA, LAB, LAnotB = calc_likelihood_matrix(A, B, M_A_B, M_A_notB, None, 
+                                                      outputs=('P_type2_given_type1', 'P_type1_not_type2'))
+    assert LBnotA is None and LAB is None
+    assert np.array_equal(LBA, full[0])
+    assert np.array_equal(LAnotB, full[3])
+
+
+from data_linking_functions import permutation_null_counts
+
+def test_permutation_null_counts():
+    # Permutation results are reproducible and bounded by the number of permutations
+    A = np.array([[0, 0, 0, 1], [0, 0, 1, 1], [0, 0, 1, 1], [0, 0, 0, 1], [0, 0, 0, 1]])
+    B = np.array([[1, 1, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0], [0, 1, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1]])
+    seeds = [1, 2, 3, 4, 5]
+    exceed, extremes = permutation_null_counts(A, B, seeds)
+    assert exceed.shape == (len(A), len(B))
+    assert extremes.shape == (len(seeds), len(B))
+    assert exceed.max() <= len(seeds)
+    exceed2, extremes2 = permutation_null_counts(A, B, seeds)
+    assert np.array_equal(exceed, exceed2) and np.array_equal(extremes, extremes2)
+    # with a single condition nothing changes, so every permutation is as extreme
+    exceed, extremes = permutation_null_counts(A[:, 3:], B[:, 3:], seeds, method='hg', greater=False)
+    assert np.all(exceed == len(seeds))
+
+
+from data_linking_functions import merge_link_keys
+
+def test_merge_link_keys():
+    # Three sets of (source, target) links, merged in one pass
+    sources = [np.array([5, 5, 1, 1, 3]), np.array([1, 5, 3, 9]), np.array([3, 5, 1])]
+    targets = [np.array([0, 1, 0, 2, 7]), np.array([0, 1, 7, 9]), np.array([7, 1, 2])]
+    src, tgt, rows = merge_link_keys(sources, targets, and_mode=True)
+    assert list(zip(src, tgt)) == [(5, 1), (3, 7)]
+    assert rows.tolist() == [[1, 4], [1, 2], [1, 0]]
+    src, tgt, rows = merge_link_keys(sources, targets, and_mode=False)
+    assert list(zip(src, tgt)) == [(5, 0), (5, 1), (1, 0), (1, 2), (3, 7), (9, 9)]
+    assert rows[1].tolist() == [-1, 1, 0, -1, 2, 3]
+    assert rows[2].tolist() == [-1, 1, -1, 2, 0, -1]
+
+
+from data_linking_functions import top_k_indices
+
+def test_top_k_indices():
+    # Same result (including the order of ties) as a stable sort of all values
+    values = np.array([3.0, 1.0, np.nan, 3.0, 2.0, 1.0, 3.0, 0.5])
+    for reverse in (True, False):
+        full = top_k_indices(values, None, reverse)
+        for k in range(len(values) + 2):
+            assert np.array_equal(top_k_indices(values, k, reverse), full[:k])
+    assert top_k_indices(values, 3).tolist() == [0, 3, 6]
+    assert top_k_indices(values, 2, reverse=False).tolist() == [7, 1]
@@ -0,0 +1,25 @@
+# test that importing nplinker stays fast, i.e. that the heavy optional
+# dependencies are only imported when they're actually used
+
+import os
+import sys
+import subprocess
+
+# the directory containing the nplinker package
+PACKAGE_PARENT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# none of these should be imported by "import nplinker.nplinker"
+DEFERRED_MODULES = ['matplotlib', 'seaborn', 'Bio', 'scipy', 'pandas', 'httpx', 'bs4']
+
+SCRIPT = '''
+import sys
+import nplinker.nplinker
+print([m for m in {} if m in sys.modules])
+'''.format(DEFERRED_MODULES)
+
+def test_deferred_imports():
+    # (in a new interpreter, as the tests themselves import most of these)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = PACKAGE_PARENT
+    output = subprocess.check_output([sys.executable, '-c', SCRIPT], cwd=PACKAGE_PARENT, env=env)
+    assert output.decode('utf-8').strip().split('\n')[-1] == '[]'
@@ -0,0 +1,42 @@
+# tests for DatasetLoader
+
+import pytest
+
+from nplinker.loader import LoadPlan
+from nplinker.metabolomics import MGFPeaks
+
+from .conftest import create_dataset, load_test_dataset, dataset_contents, assert_close
+
+PLANS = ['full', 'metcalf'] + [[component] for component in LoadPlan.COMPONENTS]
+
+@pytest.fixture
+def dataset_root(tmp_path):
+    create_dataset(tmp_path)
+    return tmp_path
+
+def check_deferred(loader, loaded):
+    # whether each optional component of the dataset has been loaded
+    assert all(not isinstance(spec._peak_source, MGFPeaks) for spec in loader.spectra) == (LoadPlan.PEAKS in loaded)
+    assert all(bgc._antismash_header is not None for bgc in loader.bgcs) == (LoadPlan.ANTISMASH in loaded)
+    assert (loader.deferred(LoadPlan.ANNOTATIONS) is None) == (LoadPlan.ANNOTATIONS in loaded)
+    assert (loader.deferred(LoadPlan.EDGES) is None) == (LoadPlan.EDGES in loaded)
+
+@pytest.mark.parametrize('load_plan', PLANS, ids=str)
+def test_load_plan(dataset_root, load_plan):
+    # the dataset should be the same whatever was loaded up front (apart from the
+    # last few bits of the total intensities, see arrays_to_spectra)
+    expected = dataset_contents(load_test_dataset(dataset_root))
+
+    loader = load_test_dataset(dataset_root, load_plan)
+    check_deferred(loader, loader.load_plan.components)
+    # (the intensities first, before the peaks)
+    intensities = [(spec.n_peaks, spec.max_ms2_intensity, spec.total_ms2_intensity) for spec in loader.spectra]
+    assert_close(intensities, [spec[4:7] for spec in expected['spectra']])
+    assert [spec.annotations for spec in loader.spectra] == [spec[12] for spec in expected['spectra']]
+    assert [sorted(bgc.edges) for bgc in loader.bgcs] == [bgc[8] for bgc in expected['bgcs']]
+    assert_close(dataset_contents(loader), expected)
+
+    loader = load_test_dataset(dataset_root, load_plan)
+    loader.load_deferred()
+    check_deferred(loader, LoadPlan.COMPONENTS)
+    assert_close(dataset_contents(loader), expected)
@@ -0,0 +1,96 @@
+# tests for the metabolomics classes
+
+import numpy as np
+import pytest
+
+from nplinker.genomics import BGC
+from nplinker.metabolomics import Spectrum, MGFPeaks
+from nplinker.parsers.mgf import LoadMGF
+from nplinker.strains import Strain
+
+def test_spectrum_containers():
+    # the metadata, annotations, edges and growth media of a new spectrum can
+    # be modified directly, without changing those of other spectra
+    spec = Spectrum(0, [(1, 2)], 0, 100.0)
+    other = Spectrum(1, [(1, 2)], 1, 100.0)
+    strain = Strain('strain1')
+
+    # reading them doesn't change anything
+    assert spec.get_metadata_value('x') is None
+    assert not spec.has_annotations() and not spec.is_library
+    assert spec.gnps_annotations is None
+    assert spec.get_growth_medium(strain) is None
+
+    spec.metadata['x'] = 1
+    spec.annotations['file'] = [{'a': 1}]
+    spec.edges.append((0, 1, 0.5))
+    spec.growth_media[strain] = {'medium': 1}
+    assert spec.get_metadata_value('x') == 1
+    assert spec.has_annotations()
+    assert spec.edges == [(0, 1, 0.5)]
+    assert spec.growth_media == {strain: {'medium': 1}}
+
+    spec.set_metadata_value('y', 2)
+    spec.update_metadata({'z': 3})
+    spec.set_annotations('gnps', [{'b': 2}])
+    spec.add_edge((0, 2, 0.1))
+    spec.add_strain(Strain('strain2'), 'medium2', 5)
+    assert spec.metadata == {'x': 1, 'y': 2, 'z': 3}
+    assert spec.annotations == {'file': [{'a': 1}], 'gnps': [{'b': 2}]}
+    assert spec.gnps_annotations == {'b': 2} and spec.is_library
+    assert spec.edges == [(0, 1, 0.5), (0, 2, 0.1)]
+    assert spec.get_growth_medium(spec.strains.lookup('strain2')) == 'medium2'
+
+    for container in [other.metadata, other.annotations, other.growth_media]:
+        assert container == {}
+    assert other.edges == []
+
+    # they can also be replaced
+    other.metadata = {'a': 1}
+    other.annotations = {'gnps': [{'c': 3}]}
+    other.edges = [(1, 0, 0.5)]
+    assert other.get_metadata_value('a') == 1
+    assert other.gnps_annotations == {'c': 3}
+    assert other.edges == [(1, 0, 0.5)]
+    assert Spectrum(2, [], 2, 100.0).metadata == {}
+
+def test_bgc_edges():
+    bgc = BGC(0, Strain('strain1'), 'bgc0', 'NRPS', 'NRPS')
+    other = BGC(1, Strain('strain1'), 'bgc1', 'NRPS', 'NRPS')
+    assert bgc.edges == set()
+    bgc.edges.add(1)
+    bgc.add_edge(2)
+    assert bgc.edges == {1, 2}
+    assert other.edges == set()
+
+PEAKS = [(300.5, 20.0), (100.25, 0.1), (250.0, 0.0), (120.0, 1000.5), (100.5, 0.2)]
+
+def peak_values(spec, order):
+    return [getattr(spec, name) for name in order]
+
+@pytest.mark.parametrize('order', [['peaks', 'normalised_peaks', 'n_peaks', 'max_ms2_intensity', 'total_ms2_intensity'],
+                                   ['n_peaks', 'max_ms2_intensity', 'total_ms2_intensity', 'peaks', 'normalised_peaks'],
+                                   ['total_ms2_intensity', 'normalised_peaks', 'max_ms2_intensity', 'peaks', 'n_peaks']])
+@pytest.mark.parametrize('peaks', [PEAKS, []])
+def test_spectrum_peak_sources(tmp_path, peaks, order):
+    # spectra whose peaks are loaded later (from arrays or an MGF file) should
+    # end up the same as spectra created with the peaks, whatever is used first
+    expected = peak_values(Spectrum(0, peaks, 0, 100.0), order)
+
+    spec = Spectrum(0, peaks, 0, 100.0)
+    arrays = (np.array(spec.peaks, dtype=np.float64).reshape(-1, 2), np.array(spec.normalised_peaks, dtype=np.float64).reshape(-1, 2))
+    spec.set_peak_source(arrays)
+    assert peak_values(spec, order) == expected
+
+    if len(peaks) == 0:
+        return
+    # (peaks with zero intensity are skipped when reading MGF files)
+    expected = peak_values(Spectrum(0, [p for p in peaks if p[1] > 0], 0, 100.0), order)
+    mgf_file = str(tmp_path / 'test.mgf')
+    with open(mgf_file, 'w') as f:
+        f.write('BEGIN IONS\nPEPMASS=100.0\nCHARGE=1+\nSCANS=1\n')
+        f.write(''.join('{}\t{}\n'.format(mz, intensity) for mz, intensity in peaks))
+        f.write('END IONS\n')
+    ms1, metadata, offsets = LoadMGF(name_field='scans').load_spectra_index(mgf_file)
+    spec.set_peak_source(MGFPeaks(mgf_file, offsets[0]))
+    assert peak_values(spec, order) == expected
@@ -0,0 +1,255 @@
+# tests for the scoring methods
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from nplinker.scoring.methods import MetcalfScoring, ScoringMethod, ObjectLink, SharedStrainBatch
+from nplinker.scoring.methods import LinkCollection, ColumnarLinkCollection
+from nplinker.scoring.methods import ScoreFilter, SharedStrainsFilter, TargetTypeFilter, TargetFilter, ProductClassFilter, BGCClassFilter
+from nplinker.genomics import GCF
+from nplinker.metabolomics import Spectrum, MolecularFamily
+from nplinker.scoring.data_linking import DataLinks, LinkFinder
+from nplinker.scoring.data_linking_functions import PackedStrainMatrix
+
+from .conftest import FakeNPLinker, create_linking_objects
+
+def standardised_score(linkfinder, type1_obj, gcf, score):
+    # the per-link standardisation, as it was done before get_links was vectorised
+    met_strains = len(type1_obj.strains)
+    gen_strains = len(gcf.strains)
+    expected = linkfinder.metcalf_expected[met_strains][gen_strains]
+    variance_sqrt = linkfinder.metcalf_variance_sqrt[met_strains][gen_strains]
+    return (score - expected) / variance_sqrt
+
+def get_scores(npl, objects, standardised, cutoff):
+    mc = MetcalfScoring(npl)
+    mc.standardised = standardised
+    mc.cutoff = cutoff
+    lc = mc.get_links(objects, LinkCollection())
+    return {(link.source, link.target): link[mc] for links in lc.links.values() for link in links.values()}
+
+@pytest.mark.parametrize('input_type', ['spectra', 'molfams', 'gcfs'])
+@pytest.mark.parametrize('cutoff', [None, 0.5])
+def test_standardised_get_links(metcalf_npl, input_type, cutoff):
+    npl = metcalf_npl
+    linkfinder = MetcalfScoring.LINKFINDER
+    objects = getattr(npl, input_type)
+
+    expected = {}
+    if input_type == 'gcfs':
+        # only spectrum links are returned for GCF input
+        for gcf in objects:
+            for spec in npl.spectra:
+                score = linkfinder.metcalf_spec_gcf[spec.id, gcf.id]
+                expected[(gcf, spec)] = standardised_score(linkfinder, spec, gcf, score)
+    else:
+        scores = linkfinder.metcalf_spec_gcf if input_type == 'spectra' else linkfinder.metcalf_fam_gcf
+        for row, obj in enumerate(objects):
+            for gcf in npl.gcfs:
+                expected[(obj, gcf)] = standardised_score(linkfinder, obj, gcf, scores[row, gcf.id])
+
+    if cutoff is not None:
+        expected = {k: v for k, v in expected.items() if v >= cutoff}
+
+    actual = get_scores(npl, objects, True, cutoff)
+    assert len(expected) > 0
+    assert actual.keys() == expected.keys()
+    for key, score in expected.items():
+        assert actual[key] == pytest.approx(score)
+
+def test_standardised_get_links_subset(metcalf_npl):
+    # results for a subset of the inputs should be the same as for all of them
+    npl = metcalf_npl
+    for objects in [npl.spectra, npl.molfams, npl.gcfs]:
+        subset = objects[1::3]
+        full = get_scores(npl, objects, True, None)
+        actual = get_scores(npl, subset, True, None)
+        assert actual == {k: v for k, v in full.items() if k[0] in subset}
+
+def as_array(M):
+    return M.words if isinstance(M, PackedStrainMatrix) else np.asarray(M)
+
+@pytest.mark.parametrize('packed', [False, True])
+def test_setup_update_genomics(tmp_path, monkeypatch, linking_objects, packed):
+    # if only the GCFs change, setup should update the cached DataLinks instead
+    # of rebuilding everything, with the same results
+    strains, gcfs, spectra, molfams = linking_objects
+    config = {'scoring': {'metcalf': {'packed_strains': packed}}}
+    MetcalfScoring.setup(FakeNPLinker(tmp_path, strains, gcfs, spectra, molfams, config))
+
+    calls = []
+    def record_call(name, method):
+        def wrapper(self, *args, **kwargs):
+            calls.append(name)
+            return method(self, *args, **kwargs)
+        return wrapper
+    monkeypatch.setattr(DataLinks, 'update_genomics', record_call('update_genomics', DataLinks.update_genomics))
+    monkeypatch.setattr(DataLinks, 'load_data', record_call('load_data', DataLinks.load_data))
+
+    new_gcfs = create_linking_objects(seed=5)[1]
+    MetcalfScoring.setup(FakeNPLinker(tmp_path, strains, new_gcfs, spectra, molfams, config))
+    assert calls == ['update_genomics']
+    datalinks, linkfinder = MetcalfScoring.DATALINKS, MetcalfScoring.LINKFINDER
+
+    monkeypatch.undo()
+    expected = DataLinks(packed=packed)
+    expected.load_data(spectra, new_gcfs, strains)
+    expected.find_correlations()
+    for attr in ['M_gcf_strain', 'M_spec_strain', 'M_fam_strain', 
+                 'M_spec_gcf', 'M_spec_notgcf', 'M_notspec_gcf',
+                 'M_fam_gcf', 'M_fam_notgcf', 'M_notfam_gcf']:
+        assert np.array_equal(as_array(getattr(datalinks, attr)), as_array(getattr(expected, attr)))
+    pd.testing.assert_frame_equal(datalinks.mapping_gcf, expected.mapping_gcf)
+
+    expected_linkfinder = LinkFinder()
+    for type_ in ['spec-gcf', 'fam-gcf']:
+        expected_scores = expected_linkfinder.metcalf_scoring(expected, type=type_)
+        assert np.array_equal(linkfinder.get_scores('metcalf', type_), expected_scores)
+
+    # and the next setup finds the updated data in the cache
+    calls.clear()
+    monkeypatch.setattr(DataLinks, 'update_genomics', record_call('update_genomics', DataLinks.update_genomics))
+    monkeypatch.setattr(DataLinks, 'load_data', record_call('load_data', DataLinks.load_data))
+    MetcalfScoring.setup(FakeNPLinker(tmp_path, strains, new_gcfs, spectra, molfams, config))
+    assert calls == []
+
+class RandomScoring(ScoringMethod):
+    # links a random subset of the possible targets of each object, the data for
+    # each link is a list containing a random integer
+
+    NAME = 'random'
+
+    def get_links(self, objects, link_collection):
+        rng = np.random.default_rng(len(objects))
+        results = {}
+        for obj in objects:
+            targets = self.npl.spectra if isinstance(obj, GCF) else self.npl.gcfs
+            for target in targets:
+                if rng.random() < 0.3:
+                    results.setdefault(obj, {})[target] = ObjectLink(obj, target, self, [int(rng.integers(5))])
+        link_collection._add_links_from_method(self, results)
+        return link_collection
+
+    def sort(self, objects, reverse=True):
+        return sorted(objects, key=lambda link: link[self][0], reverse=reverse)
+
+def link_contents(lc):
+    # {(source, target): (method names, data for each method, shared strains)}
+    contents = {}
+    for source, links in lc.links.items():
+        for target, link in links.items():
+            methods = sorted(link.methods, key=lambda m: m.name)
+            data = tuple(pytest.approx(float(link[m])) if isinstance(m, MetcalfScoring) else tuple(link[m]) for m in methods)
+            contents[(source, target)] = (tuple(m.name for m in methods), data, tuple(s.id for s in link.shared_strains))
+    return contents
+
+def collection_summary(lc, methods):
+    # everything that should be the same for a LinkCollection and a ColumnarLinkCollection
+    return {'contents': link_contents(lc),
+            'sources': set(lc.sources),
+            'targets': set(lc.get_all_targets()),
+            'len': len(lc),
+            'method_count': lc.method_count,
+            'sorted': [[link.target for link in lc.get_sorted_links(method, source, strict=strict)] 
+                       for method in methods for source in lc.sources for strict in [False, True]]}
+
+def get_link_collections(npl, objects, standardised, and_mode, lazy):
+    # the same links in a LinkCollection and a ColumnarLinkCollection
+    collections = []
+    for cls in [LinkCollection, ColumnarLinkCollection]:
+        mc = MetcalfScoring(npl)
+        mc.standardised = standardised
+        mc.cutoff = -0.5 if standardised else 20
+        methods = [mc, RandomScoring(npl)]
+        lc = cls(and_mode)
+        for method in methods:
+            lc = method.get_links(objects, lc)
+        if cls is ColumnarLinkCollection:
+            lc.set_shared_strains(MetcalfScoring.DATALINKS, npl._strains, lazy=lazy)
+        else:
+            SharedStrainBatch(MetcalfScoring.DATALINKS, npl._strains, [link for links in lc.links.values() for link in links.values()], lazy=lazy)
+        collections.append((lc, methods))
+    return collections
+
+@pytest.mark.parametrize('input_type', ['spectra', 'molfams', 'gcfs', 'subset'])
+@pytest.mark.parametrize('standardised', [False, True])
+@pytest.mark.parametrize('and_mode', [False, True])
+@pytest.mark.parametrize('lazy', [False, True])
+def test_columnar_link_collection(metcalf_npl, input_type, standardised, and_mode, lazy):
+    # ColumnarLinkCollection should give the same results as LinkCollection
+    npl = metcalf_npl
+    objects = npl.spectra[2:9] if input_type == 'subset' else getattr(npl, input_type)
+    (lc, methods), (clc, cmethods) = get_link_collections(npl, objects, standardised, and_mode, lazy)
+    expected = collection_summary(lc, methods)
+    assert len(expected['contents']) > 0
+    assert collection_summary(clc, cmethods) == expected
+
+    for collection in [lc, clc]:
+        collection.filter_targets(lambda target: target.id % 3 != 0)
+        collection.filter_links(lambda link: len(link.shared_strains) % 2 == 0)
+        collection.filter_no_shared_strains()
+        collection.filter_sources(lambda source: source.id % 2 == 0)
+    assert collection_summary(clc, cmethods) == collection_summary(lc, methods)
+
+def is_gcf_with(link, attr, classes):
+    return any(isinstance(obj, GCF) and len(set(attr(obj)) & classes) > 0 for obj in [link.source, link.target])
+
+# (name, function returning a filter for the given MetcalfScoring object and NPLinker,
+#  the same test for a single link)
+FILTERS = [
+    ('score_min', lambda mc, npl: ScoreFilter(mc, 60),
+                  lambda mc, npl, link: mc in link.methods and link[mc] >= 60),
+    ('score_max', lambda mc, npl: ScoreFilter(mc, None, 40),
+                  lambda mc, npl, link: mc in link.methods and link[mc] <= 40),
+    ('score_range', lambda mc, npl: ScoreFilter(mc, 30, 80),
+                    lambda mc, npl, link: mc in link.methods and 30 <= link[mc] <= 80),
+    ('shared_strains', lambda mc, npl: SharedStrainsFilter(5),
+                       lambda mc, npl, link: len(link.shared_strains) >= 5),
+    ('target_type', lambda mc, npl: TargetTypeFilter(MolecularFamily),
+                    lambda mc, npl, link: isinstance(link.target, MolecularFamily)),
+    ('target_types', lambda mc, npl: TargetTypeFilter(Spectrum, GCF),
+                     lambda mc, npl, link: isinstance(link.target, (Spectrum, GCF))),
+    ('target', lambda mc, npl: TargetFilter(npl.spectra[::2] + npl.molfams[::2] + npl.gcfs[::3]),
+               lambda mc, npl, link: any(link.target is obj for obj in npl.spectra[::2] + npl.molfams[::2] + npl.gcfs[::3])),
+    ('product_class', lambda mc, npl: ProductClassFilter('NRPS', 'PKS'),
+                      lambda mc, npl, link: is_gcf_with(link, lambda gcf: [gcf.product_type], {'NRPS', 'PKS'})),
+    ('bgc_class', lambda mc, npl: BGCClassFilter('RiPP'),
+                  lambda mc, npl, link: is_gcf_with(link, lambda gcf: gcf.classes, {'RiPP'})),
+    ('and', lambda mc, npl: ScoreFilter(mc, None, 40) & SharedStrainsFilter(5),
+            lambda mc, npl, link: mc in link.methods and link[mc] <= 40 and len(link.shared_strains) >= 5),
+    ('or', lambda mc, npl: SharedStrainsFilter(8) | TargetTypeFilter(MolecularFamily),
+           lambda mc, npl, link: len(link.shared_strains) >= 8 or isinstance(link.target, MolecularFamily)),
+    ('not', lambda mc, npl: ~ScoreFilter(mc, 60),
+            lambda mc, npl, link: not (mc in link.methods and link[mc] >= 60)),
+    ('combined', lambda mc, npl: ~(ScoreFilter(mc, 60) | BGCClassFilter('RiPP')) & SharedStrainsFilter(3),
+                 lambda mc, npl, link: not (mc in link.methods and link[mc] >= 60 or is_gcf_with(link, lambda gcf: gcf.classes, {'RiPP'})) 
+                                       and len(link.shared_strains) >= 3),
+]
+
+@pytest.mark.parametrize('name,make_filter,accept', FILTERS, ids=[f[0] for f in FILTERS])
+@pytest.mark.parametrize('input_type', ['spectra', 'molfams', 'gcfs'])
+@pytest.mark.parametrize('and_mode', [False, True])
+def test_link_filters(metcalf_npl, name, make_filter, accept, input_type, and_mode):
+    npl = metcalf_npl
+    rng = np.random.default_rng(4)
+    for gcf in npl.gcfs:
+        gcf.product_type = str(rng.choice(['NRPS', 'PKS', 'Other']))
+        gcf.classes = set(rng.choice(['NRPS', 'PKSI', 'RiPP', 'Terpene'], 2, replace=False).tolist())
+
+    # (GCFs are only linked to both spectra and families with the unstandardised scores)
+    (lc, methods), (clc, cmethods) = get_link_collections(npl, getattr(npl, input_type), False, and_mode, False)
+    all_links = [link for links in lc.links.values() for link in links.values()]
+    expected = {(link.source, link.target) for link in all_links if accept(methods[0], npl, link)}
+    # the filters shouldn't keep or remove everything (except for the target types,
+    # which are all GCFs for spectrum/family input, and in AND mode there are 
+    # only a few links to start with)
+    if not and_mode and (input_type == 'gcfs' or not name.startswith('target_type')):
+        assert 0 < len(expected) < len(all_links)
+
+    lc.filter(make_filter(methods[0], npl))
+    clc.filter(make_filter(cmethods[0], npl))
+    for collection in [lc, clc]:
+        assert {(source, target) for source, links in collection.links.items() for target in links} == expected
+        assert set(collection.sources) == {source for source, target in expected}
+        assert len(collection) == len({source for source, target in expected})
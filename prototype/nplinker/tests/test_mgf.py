@@ -0,0 +1,136 @@
+# tests for the MGF parser, and creating spectra from its output
+
+import math
+import os
+
+import numpy as np
+import pytest
+
+from nplinker.metabolomics import mols_to_spectra, arrays_to_spectra
+from nplinker.parsers import mgf
+from nplinker.parsers.mgf import LoadMGF
+from nplinker.utils import sqrt_normalise, sqrt_normalise_arrays
+
+from .conftest import create_mgf, assert_close
+
+# blocks with duplicate mz values, an MSLEVEL=1 block, a block with only zero
+# intensity peaks, metadata and other lines after the first peak, no blank line
+# between blocks, and no END IONS at the end
+EDGE_CASES_MGF = '''BEGIN IONS
+PEPMASS=100.5 5000.0
+CHARGE=1+
+RTINSECONDS=10.5
+SCANS=1
+150.1\t10.0
+120.3\t20.0
+150.1\t5.0
+END IONS
+
+BEGIN IONS
+PEPMASS=200.5
+CHARGE=2+
+SCANS=2
+MSLEVEL=1
+150.1\t10.0
+END IONS
+
+BEGIN IONS
+PEPMASS=300.5
+SCANS=3
+110.0\t0.0
+END IONS
+
+BEGIN IONS
+PEPMASS=400.5
+SCANS=4
+410.0\t1.0
+a line which is ignored
+CHARGE=3+
+405.0\t2.0
+END IONS
+BEGIN IONS
+PEPMASS=500.5
+SCANS=5
+510.0\t3.0
+515.0\t0.0
+'''
+
+@pytest.fixture(params=['random', 'edge_cases', 'random_crlf', 'edge_cases_crlf'])
+def mgf_file(request, tmp_path):
+    path = str(tmp_path / 'spectra.mgf')
+    if request.param.startswith('random'):
+        create_mgf(path, 60, 20, np.random.default_rng(0))
+    else:
+        with open(path, 'w') as f:
+            f.write(EDGE_CASES_MGF)
+    if request.param.endswith('_crlf'):
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(data.replace(b'\n', b'\r\n'))
+    return path
+
+def spectrum_values(spec):
+    return (spec.id, spec.spectrum_id, spec.precursor_mz, spec.parent_mz, spec.n_peaks, spec.max_ms2_intensity,
+            spec.total_ms2_intensity, spec.peaks, spec.normalised_peaks, spec.metadata, spec.annotations)
+
+def test_spectra_arrays(mgf_file):
+    # the spectra created from the peak arrays should be the same as the spectra 
+    # created from the output of load_spectra (apart from the last few bits of the
+    # total intensities, which are summed in a different order)
+    ms1, ms2, metadata = LoadMGF(name_field='scans').load_spectra([mgf_file])
+    expected = [spectrum_values(spec) for spec in mols_to_spectra(ms2, metadata)]
+
+    ms1, metadata, peaks, offsets = LoadMGF(name_field='scans').load_spectra_arrays(mgf_file)
+    spectra = arrays_to_spectra(ms1, metadata, peaks, offsets)
+    assert len(spectra) > 0
+    intensities = [(spec.max_ms2_intensity, spec.total_ms2_intensity) for spec in spectra]
+    assert_close([spectrum_values(spec) for spec in spectra], expected)
+    # (and they don't change once the peaks have been unpacked)
+    assert [(spec.max_ms2_intensity, spec.total_ms2_intensity) for spec in spectra] == intensities
+
+def test_sqrt_normalise_arrays():
+    rng = np.random.default_rng(0)
+    spectra = [[(float(mz), float(intensity)) for mz, intensity in rng.random((n, 2)) * 1000] for n in [1, 5, 2, 30, 1]]
+    offsets = np.cumsum([0] + [len(peaks) for peaks in spectra])
+    peaks = np.array([peak for peaks in spectra for peak in peaks], dtype=np.float64)
+    expected = [peak for peaks in spectra for peak in sqrt_normalise(peaks)]
+
+    # exactly the same if the totals are summed in the same order
+    totals = np.array([sum(intensity for mz, intensity in peaks) for peaks in spectra])
+    assert [tuple(peak) for peak in sqrt_normalise_arrays(peaks, offsets, totals).tolist()] == expected
+
+    normalised_peaks = sqrt_normalise_arrays(peaks, offsets)
+    assert normalised_peaks[:, 0].tolist() == peaks[:, 0].tolist()
+    assert np.allclose(normalised_peaks, expected, rtol=1e-12, atol=0)
+    for i in range(len(spectra)):
+        assert math.isclose(np.sum(normalised_peaks[offsets[i]:offsets[i + 1], 1] ** 2), 1.0, rel_tol=1e-12)
+
+    assert sqrt_normalise_arrays(np.zeros((0, 2)), np.zeros(1, dtype=np.int64)).shape == (0, 2)
+
+def mgf_arrays(mgf_file, processes):
+    ms1, metadata, peaks, offsets = LoadMGF(name_field='scans').load_spectra_arrays(mgf_file, processes=processes)
+    return [(m.id, m.name, m.mz, m.rt, m.intensity) for m in ms1], metadata, peaks.tolist(), offsets.tolist()
+
+def test_spectra_arrays_processes(mgf_file, monkeypatch):
+    # parsing a file in any number of byte ranges and chunks should give exactly 
+    # the same results as parsing it in one go
+    expected = mgf_arrays(mgf_file, 1)
+    ms1, ms2, metadata = LoadMGF(name_field='scans').load_spectra([mgf_file])
+    expected_spectra = [spectrum_values(spec) for spec in mols_to_spectra(ms2, metadata)]
+
+    size = os.path.getsize(mgf_file)
+    monkeypatch.setattr(mgf, 'MGF_MIN_RANGE_SIZE', 1)
+    monkeypatch.setattr(mgf, 'MGF_CHUNK_SIZE', 37)
+    for processes in [1, 2, 3, 5, 16]:
+        # (the ranges end at the end of a block, the initial split points are 
+        # usually inside a block or a line)
+        if processes > 1:
+            boundaries = LoadMGF()._range_boundaries(mgf_file, processes)
+            assert len(boundaries) > 2
+            assert any(size * i // processes not in boundaries for i in range(1, processes))
+
+        result = mgf_arrays(mgf_file, processes)
+        assert result == expected
+        spectra = arrays_to_spectra(*LoadMGF(name_field='scans').load_spectra_arrays(mgf_file, processes=processes))
+        assert_close([spectrum_values(spec) for spec in spectra], expected_spectra)
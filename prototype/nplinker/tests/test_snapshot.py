@@ -0,0 +1,108 @@
+# tests for the dataset snapshots saved/restored by DatasetLoader.load
+
+import os
+
+import pytest
+
+from nplinker.loader import DatasetLoader
+from nplinker.metabolomics import MGFPeaks
+from nplinker.snapshot import save_snapshot
+
+from .conftest import create_dataset, load_test_dataset, dataset_contents
+
+@pytest.fixture
+def dataset_root(tmp_path):
+    create_dataset(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def load_calls(monkeypatch):
+    # records each time a dataset is loaded from the input files rather than a snapshot
+    calls = []
+    load_files = DatasetLoader._load_files
+
+    def _load_files(self, met_only):
+        calls.append(met_only)
+        return load_files(self, met_only)
+
+    monkeypatch.setattr(DatasetLoader, '_load_files', _load_files)
+    return calls
+
+def check_references(loader):
+    # the restored objects should reference each other, not copies
+    gcfs = set(map(id, loader.gcfs))
+    molfams = set(map(id, loader.molfams))
+    strains = set(map(id, loader.strains))
+    assert all(id(bgc.parent) in gcfs for bgc in loader.bgcs)
+    assert all(id(bgc.strain) in strains for bgc in loader.bgcs)
+    assert all(any(b is bgc for b in bgc.parent.bgcs) for bgc in loader.bgcs)
+    assert all(id(spec.family) in molfams for spec in loader.spectra)
+    assert all(any(s is spec for s in spec.family.spectra) for spec in loader.spectra)
+    assert all(id(strain) in strains for spec in loader.spectra for strain in spec.strains)
+    for strain in loader.strains:
+        for alias in strain.aliases:
+            assert loader.strains.lookup(alias) is strain
+
+@pytest.mark.parametrize('load_plan', ['full', 'metcalf'])
+def test_snapshot_round_trip(dataset_root, load_calls, load_plan):
+    expected = dataset_contents(load_test_dataset(dataset_root, load_plan))
+    assert len(expected['spectra']) > 0 and len(expected['gcfs']) > 0
+
+    load_test_dataset(dataset_root, load_plan, snapshot=True)
+    assert os.path.exists(os.path.join(dataset_root, 'snapshot', 'manifest.json'))
+    del load_calls[:]
+
+    loader = load_test_dataset(dataset_root, load_plan, snapshot=True)
+    assert load_calls == []
+    # with the full plan the peaks are saved in the snapshot, otherwise they're
+    # still read from the MGF file when they're first used
+    peak_sources = [spec._peak_source for spec in loader.spectra]
+    if load_plan == 'full':
+        assert all(isinstance(source, tuple) for source in peak_sources)
+    else:
+        assert all(isinstance(source, MGFPeaks) for source in peak_sources)
+        assert loader.deferred('annotations') is not None and loader.deferred('edges') is not None
+    check_references(loader)
+    assert dataset_contents(loader) == expected
+
+    # a snapshot of a restored dataset, where some of the spectra have unpacked
+    # their peaks (so a mix of peak sources: tuples/MGF file locations and loaded peaks)
+    loader = load_test_dataset(dataset_root, load_plan, snapshot=True)
+    for spec in loader.spectra[::3]:
+        spec.peaks
+    save_snapshot(loader._snapshot_path(), loader, loader._snapshot_fingerprint(False))
+    loader = load_test_dataset(dataset_root, load_plan, snapshot=True)
+    assert load_calls == []
+    check_references(loader)
+    assert dataset_contents(loader) == expected
+
+def test_snapshot_options(dataset_root, load_calls):
+    load_test_dataset(dataset_root, 'full', snapshot=True)
+    load_test_dataset(dataset_root, 'metcalf', snapshot=True)
+    load_test_dataset(dataset_root, 'metcalf', snapshot=True)
+    load_test_dataset(dataset_root, 'metcalf', snapshot=True, bigscape_cutoff=30)
+    assert len(load_calls) == 2
+
+@pytest.mark.parametrize('change', ['mtime', 'size'])
+@pytest.mark.parametrize('filename', ['spectra/specs.mgf', 'antismash/STR3/STR3_region002.gbk'])
+def test_snapshot_invalidated(dataset_root, load_calls, filename, change):
+    expected = dataset_contents(load_test_dataset(dataset_root, snapshot=True))
+    load_test_dataset(dataset_root, snapshot=True)
+    assert len(load_calls) == 1
+
+    path = os.path.join(dataset_root, filename)
+    if change == 'mtime':
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    else:
+        st = os.stat(path)
+        with open(path, 'a') as f:
+            f.write('\n')
+        # (with the same mtime, so that only the size has changed)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    # the input files are loaded again, and the snapshot updated
+    assert dataset_contents(load_test_dataset(dataset_root, snapshot=True)) == expected
+    assert len(load_calls) == 2
+    assert dataset_contents(load_test_dataset(dataset_root, snapshot=True)) == expected
+    assert len(load_calls) == 2
@@ -0,0 +1,120 @@
+# tests for the strain classes
+
+import pickle
+
+import pytest
+
+from nplinker import strains as strains_module
+from nplinker.strains import Strain, StrainCollection, StrainSet, new_strain_table
+
+def make_strain(strain_id, *aliases):
+    strain = Strain(strain_id)
+    for alias in aliases:
+        strain.add_alias(alias)
+    return strain
+
+@pytest.fixture
+def strain_list():
+    return [make_strain('s{}'.format(i), 'alias{}'.format(i), 'other{}'.format(i)) for i in range(6)]
+
+def test_strain_set(strain_list):
+    strain_set = StrainSet(strain_list[:3])
+    assert len(strain_set) == 3
+    assert list(strain_set) == strain_list[:3]
+
+    # lookup and membership tests by ID, alias or object
+    for strain in strain_list[:3]:
+        for key in [strain.id] + sorted(strain.aliases):
+            assert strain_set.lookup(key) is strain
+            assert key in strain_set
+        assert strain in strain_set
+    for strain in strain_list[3:]:
+        assert strain_set.lookup(strain.id) is None
+        assert strain_set.lookup(strain.id, 'default') == 'default'
+        assert strain.id not in strain_set
+        assert strain not in strain_set
+    assert 'unknown' not in strain_set
+
+    # strains in another set aren't found in this one
+    other_set = StrainSet(strain_list[3:])
+    assert list(other_set) == strain_list[3:]
+    assert strain_list[0] not in other_set
+
+def test_strain_set_add(strain_list):
+    strain_set = StrainSet()
+    assert len(strain_set) == 0
+    assert list(strain_set) == []
+
+    strain_set.add(strain_list[0])
+    strain_set.add(strain_list[1])
+    # adding another strain with the same ID merges the aliases
+    strain_set.add(make_strain('s0', 'new_alias'))
+    assert list(strain_set) == strain_list[:2]
+    assert strain_list[0].aliases == {'alias0', 'other0', 'new_alias'}
+    assert strain_set.lookup('new_alias') is strain_list[0]
+
+    # aliases added through a StrainCollection are found as well
+    collection = StrainCollection()
+    collection.add(strain_list[1])
+    collection.add(make_strain('s1', 'collection_alias'))
+    assert strain_set.lookup('collection_alias') is strain_list[1]
+
+    # adding a strain by one of its aliases finds the existing strain
+    strain_set.add(make_strain('other1'))
+    assert len(strain_set) == 2
+
+def test_strain_set_remove(strain_list):
+    strain_set = StrainSet(strain_list)
+    strain_set.remove(strain_list[2])
+    strain_set.remove(make_strain('s4'))
+    strain_set.remove(make_strain('unknown'))
+    assert list(strain_set) == [strain_list[i] for i in [0, 1, 3, 5]]
+    assert 's2' not in strain_set and 'alias4' not in strain_set
+
+    strain_set.filter({strain_list[1], strain_list[5]})
+    assert list(strain_set) == [strain_list[1], strain_list[5]]
+    collection = StrainCollection()
+    collection.add(strain_list[5])
+    strain_set.filter(collection)
+    assert list(strain_set) == [strain_list[5]]
+
+    for strain in list(strain_set):
+        strain_set.remove(strain)
+    assert len(strain_set) == 0 and 's5' not in strain_set
+    strain_set.add(strain_list[0])
+    assert list(strain_set) == [strain_list[0]]
+
+def test_strain_set_same_ids(strain_list):
+    # strains are identified by object, different objects can have the same ID
+    strain_set = StrainSet(strain_list[:2])
+    copy = make_strain('s0', 'alias0')
+    other_set = StrainSet([copy])
+    assert strain_set.lookup('s0') is strain_list[0]
+    assert other_set.lookup('s0') is copy
+    assert other_set.lookup('s1') is None
+
+def test_strain_set_pickle(strain_list):
+    strain_set = StrainSet(strain_list[1:4])
+    strain_set.remove(strain_list[2])
+    loaded = pickle.loads(pickle.dumps(strain_set))
+    assert [s.id for s in loaded] == ['s1', 's3']
+    assert loaded.lookup('alias3').id == 's3'
+    assert 's2' not in loaded
+
+def test_new_strain_table(strain_list):
+    old_set = StrainSet(strain_list[:3])
+    old_table = strains_module._strain_table
+    new_strain_table()
+    assert strains_module._strain_table is not old_table
+
+    # existing sets keep working with the old table, new ones use the new table
+    new_set = StrainSet(strain_list[2:4])
+    new_set.add(strain_list[0])
+    old_set.add(strain_list[5])
+    assert list(old_set) == strain_list[:3] + [strain_list[5]]
+    assert list(new_set) == [strain_list[2], strain_list[3], strain_list[0]]
+    assert 's1' not in new_set and 's3' not in old_set
+    assert new_set.lookup('alias0') is strain_list[0]
+
+    # the new table only contains the strains of the new sets
+    assert strains_module._strain_table.strains == [strain_list[2], strain_list[3], strain_list[0]]
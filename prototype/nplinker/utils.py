@@ -1,5 +1,7 @@
 import math
 
+import numpy as np
+
 # code to normalise peaks for spectral matching ("rosetta stone" stuff)
 def sqrt_normalise(peaks):
     temp = []
@@ -12,3 +14,20 @@ def sqrt_normalise(peaks):
     for mz, intensity in temp:
         normalised_peaks.append((mz, intensity / norm_facc))
     return normalised_peaks
+
+def sqrt_normalise_arrays(peaks, offsets, totals=None):
+    """
+    Array version of sqrt_normalise for the peaks of many spectra at once, where
+    peaks is a (num_peaks x 2) array of (mz, intensity) values and the peaks of
+    spectrum i are peaks[offsets[i]:offsets[i + 1]] (which mustn't be empty).
+    The total intensity of each spectrum can be passed in if already known.
+    """
+    normalised_peaks = np.empty_like(peaks)
+    normalised_peaks[:, 0] = peaks[:, 0]
+    if len(peaks) == 0:
+        return normalised_peaks
+    if totals is None:
+        totals = np.add.reduceat(peaks[:, 1], offsets[:-1])
+    norm_facc = np.repeat(np.sqrt(totals), np.diff(offsets))
+    normalised_peaks[:, 1] = np.sqrt(peaks[:, 1]) / norm_facc
+    return normalised_peaks
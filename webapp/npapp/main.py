@@ -9,7 +9,7 @@ from bokeh.models import ColumnDataSource
 from nplinker.metabolomics import Spectrum, MolecularFamily
 from nplinker.genomics import GCF, BGC
 from nplinker.annotations import gnps_url, GNPS_KEY
-from nplinker.scoring.methods import LinkCollection
+from nplinker.scoring.methods import LinkCollection, TargetFilter, SharedStrainsFilter
 
 from searching import SEARCH_OPTIONS, Searcher
 
@@ -418,8 +418,9 @@ class NPLinkerBokeh(object):
     def display_links(self, scoring_results, mode, div, include_only=None):
         # 1. need to filter out linked objects that don't appear in the tables 
         # in their current state
+        filters = []
         if include_only is not None:
-            scoring_results.filter_targets(lambda x: x in include_only)
+            filters.append(TargetFilter(include_only))
 
         # TODO should probably remove this, or at least make it optional
         # 2. if the linked objects are GCFs, need to filter out those results for
@@ -431,7 +432,11 @@ class NPLinkerBokeh(object):
 
         # 3. filter out any results with no shared strains, if that option is enabled
         if self.filter_no_shared_strains:
-            scoring_results.filter_no_shared_strains()
+            filters.append(SharedStrainsFilter())
+
+        # the results are stored as arrays (see get_links), so the filters are
+        # applied to all links at once
+        scoring_results.filter(*filters)
 
         if len(scoring_results) > 0:
             self.debug_log('set_results')
@@ -879,7 +884,7 @@ class NPLinkerBokeh(object):
         current_methods = self.current_scoring_methods()
         
         # call get_links, which returns the subset of input objects which have links
-        results = self.nh.nplinker.get_links(selected_spectra, current_methods, and_mode=self.score_helper.method_and_mode)
+        results = self.nh.nplinker.get_links(selected_spectra, current_methods, and_mode=self.score_helper.method_and_mode, columnar=True)
 
         # TODO quick attempt to display scores in the tables (for metcalf only for now)
         # TODO does it make sense to do this with other methods? might not have a single score...
@@ -979,7 +984,7 @@ class NPLinkerBokeh(object):
         current_methods = self.current_scoring_methods()
         
         # call get_links, which returns the subset of input objects which have links
-        results = self.nh.nplinker.get_links(selected_gcfs, current_methods, and_mode=self.score_helper.method_and_mode)
+        results = self.nh.nplinker.get_links(selected_gcfs, current_methods, and_mode=self.score_helper.method_and_mode, columnar=True)
 
         # TODO quick attempt to display scores in the tables (for metcalf only for now)
         # TODO does it make sense to do this with other methods? might not have a single score...